@@ -0,0 +1,214 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+Minimal MQTT 3.1.1 broker for the benchmarks, so that they can run
+without an external one.
+
+Only what the benchmarks need is implemented: QoS 0 and 1 publishes
+(always delivered with QoS 0), wildcard subscriptions and the
+``$share/{group}/{filter}`` shared subscriptions (round robin among the
+members of the group). Retained messages, wills and sessions are not
+supported.
+
+Run with ``python -m benchmarks.broker [port]``.
+"""
+
+import asyncio
+import itertools
+import struct
+import sys
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+CONNECT = 1
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+UNSUBSCRIBE = 10
+PINGREQ = 12
+DISCONNECT = 14
+
+
+def encode_packet(header: int, body: bytes) -> bytes:
+    length = len(body)
+    encoded = bytearray([header])
+    while True:
+        byte = length % 128
+        length //= 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded) + body
+
+
+def encode_string(value: str) -> bytes:
+    data = value.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+class Node:
+    __slots__ = ("children", "clients", "groups")
+
+    def __init__(self):
+        self.children: Dict[str, Node] = {}
+        self.clients: Set[Client] = set()
+        self.groups: Dict[str, List[Client]] = {}
+
+
+class Broker:
+    def __init__(self):
+        self.root = Node()
+        self.counters: Dict[Tuple[int, str], Iterator[int]] = {}
+
+    def _node(self, topic_filter: str) -> Node:
+        node = self.root
+        for level in topic_filter.split("/"):
+            node = node.children.setdefault(level, Node())
+        return node
+
+    @staticmethod
+    def _parse(topic_filter: str) -> Tuple[Optional[str], str]:
+        if topic_filter.startswith("$share/"):
+            _, group, topic_filter = topic_filter.split("/", 2)
+            return group, topic_filter
+        return None, topic_filter
+
+    def subscribe(self, client: "Client", topic_filter: str):
+        group, topic_filter = self._parse(topic_filter)
+        node = self._node(topic_filter)
+        if group is None:
+            node.clients.add(client)
+        elif client not in node.groups.setdefault(group, []):
+            node.groups[group].append(client)
+
+    def unsubscribe(self, client: "Client", topic_filter: str):
+        group, topic_filter = self._parse(topic_filter)
+        node = self._node(topic_filter)
+        node.clients.discard(client)
+        if group is not None and client in node.groups.get(group, []):
+            node.groups[group].remove(client)
+
+    def remove(self, client: "Client", node: Optional[Node] = None):
+        node = node or self.root
+        node.clients.discard(client)
+        for members in node.groups.values():
+            if client in members:
+                members.remove(client)
+        for child in node.children.values():
+            self.remove(client, child)
+
+    def _match(self, node: Node, levels: List[str], found: List[Node]):
+        if "#" in node.children:
+            found.append(node.children["#"])
+        if not levels:
+            found.append(node)
+            return
+        for key in (levels[0], "+"):
+            child = node.children.get(key)
+            if child is not None:
+                self._match(child, levels[1:], found)
+
+    def publish(self, topic: str, payload: bytes):
+        nodes: List[Node] = []
+        self._match(self.root, topic.split("/"), nodes)
+        receivers: Set[Client] = set()
+        for node in nodes:
+            receivers.update(node.clients)
+            for group, members in node.groups.items():
+                if members:
+                    counter = self.counters.setdefault(
+                        (id(node), group), itertools.count()
+                    )
+                    receivers.add(members[next(counter) % len(members)])
+        if receivers:
+            packet = encode_packet(PUBLISH << 4, encode_string(topic) + payload)
+            for receiver in receivers:
+                receiver.writer.write(packet)
+
+
+class Client:
+    def __init__(self, broker: Broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+
+    async def read_packet(self) -> Tuple[int, bytes]:
+        header = (await self.reader.readexactly(1))[0]
+        length = 0
+        multiplier = 1
+        while True:
+            byte = (await self.reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return header, await self.reader.readexactly(length)
+
+    @staticmethod
+    def _filters(body: bytes) -> Iterator[str]:
+        offset = 2
+        while offset < len(body):
+            (length,) = struct.unpack_from("!H", body, offset)
+            yield body[offset + 2: offset + 2 + length].decode()
+            offset += 2 + length
+
+    def handle(self, header: int, body: bytes) -> bool:
+        kind = header >> 4
+        if kind == PUBLISH:
+            (length,) = struct.unpack_from("!H", body)
+            topic = body[2: 2 + length].decode()
+            offset = 2 + length
+            if (header >> 1) & 3:
+                self.writer.write(encode_packet(PUBACK << 4, body[offset: offset + 2]))
+                offset += 2
+            self.broker.publish(topic, body[offset:])
+        elif kind == SUBSCRIBE:
+            granted = bytearray()
+            offset = 2
+            while offset < len(body):
+                (length,) = struct.unpack_from("!H", body, offset)
+                self.broker.subscribe(self, body[offset + 2: offset + 2 + length].decode())
+                offset += 3 + length
+                granted.append(0)
+            self.writer.write(encode_packet(0x90, body[:2] + bytes(granted)))
+        elif kind == UNSUBSCRIBE:
+            for topic_filter in self._filters(body):
+                self.broker.unsubscribe(self, topic_filter)
+            self.writer.write(encode_packet(0xB0, body[:2]))
+        elif kind == CONNECT:
+            self.writer.write(encode_packet(0x20, b"\x00\x00"))
+        elif kind == PINGREQ:
+            self.writer.write(encode_packet(0xD0, b""))
+        elif kind == DISCONNECT:
+            return False
+        return True
+
+    async def serve(self):
+        try:
+            while self.handle(*await self.read_packet()):
+                await self.writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.broker.remove(self)
+            self.writer.close()
+
+
+async def serve(host: str = "localhost", port: int = 1883):
+    broker = Broker()
+
+    async def on_connection(reader, writer):
+        await Client(broker, reader, writer).serve()
+
+    server = await asyncio.start_server(on_connection, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1883
+    asyncio.run(serve(port=port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+Benchmark of PayProc message dispatch, inline in the network thread and
+on a :class:`~manta.lanes.LanePool`.
+
+``SESSIONS`` orders are followed by their *all* payment requests, while
+``get_destinations`` waits ``LOOKUP_DELAY`` seconds, like a merchant
+database lookup. Messages are fed directly to ``on_message``, without a
+broker. Reports payment requests per second and the lane utilization.
+
+Run with ``python -m benchmarks.dispatch``.
+"""
+
+from decimal import Decimal
+import os
+import threading
+import time
+from typing import NamedTuple
+
+from manta.messages import Destination, Merchant, MerchantOrderRequestMessage
+from manta.payproc import PayProc
+
+SESSIONS = 2000
+LOOKUP_DELAY = 0.002
+WORKERS = (0, 4, 16)
+KEY_FILE = os.path.join(
+    os.path.dirname(__file__), "..", "certificates", "root", "keys", "test.key"
+)
+
+MERCHANT = Merchant(name="Merchant 1", address="5th Avenue")
+DESTINATIONS = [
+    Destination(amount=Decimal("0.01"), destination_address="btc_address",
+                crypto_currency="BTC")
+]
+
+
+class Message(NamedTuple):
+    topic: str
+    payload: bytes
+
+
+class Client:
+    """Stand-in for the MQTT client, counting the payment requests"""
+
+    def __init__(self):
+        self.payment_requests = 0
+        self.done = threading.Event()
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if topic.startswith("payment_requests/"):
+            self.payment_requests += 1
+            if self.payment_requests == SESSIONS:
+                self.done.set()
+
+    def subscribe(self, topic):
+        pass
+
+
+def get_destinations(application, order):
+    time.sleep(LOOKUP_DELAY)
+    return DESTINATIONS
+
+
+def run(workers: int):
+    payproc = PayProc(KEY_FILE, dispatch_workers=workers)
+    payproc.get_merchant = lambda application: MERCHANT
+    payproc.get_destinations = get_destinations
+    payproc.get_supported_cryptos = lambda application, order: {"BTC"}
+    client = payproc.mqtt_client = Client()
+
+    messages = []
+    for i in range(SESSIONS):
+        session_id = "session{}".format(i)
+        order = MerchantOrderRequestMessage(amount=Decimal("10"), fiat_currency="EUR",
+                                            session_id=session_id)
+        messages.append(Message("merchant_order_request/bench",
+                                order.to_json().encode("utf-8")))
+        messages.append(Message("payment_requests/{}/all".format(session_id), b""))
+
+    start = time.perf_counter()
+    for message in messages:
+        payproc.on_message(client, None, message)
+    client.done.wait(120)
+    elapsed = time.perf_counter() - start
+
+    stats = None
+    if payproc.dispatch_pool is not None:
+        stats = payproc.dispatch_pool.stats()
+    payproc.close()
+
+    return client.payment_requests / elapsed, stats
+
+
+def main():
+    for workers in WORKERS:
+        rate, stats = run(workers)
+        line = f"dispatch_workers={workers}: {rate:.0f} payment requests/s"
+        if stats is not None:
+            utilization = sum(stats.utilization) / stats.lanes
+            line += (f", max lane queue {stats.max_pending}"
+                     f", mean lane utilization {utilization:.0%}")
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
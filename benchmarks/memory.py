@@ -0,0 +1,110 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+Benchmark of the memory used by open sessions in :class:`TXStorageMemory`.
+
+Every session holds the messages PayProc keeps in its
+:class:`TransactionState`: order, ack, payment request and payment.
+
+Compares the messages with the baseline layout (attrs classes with a
+per-instance ``__dict__``) with the slotted classes of
+:mod:`manta.messages`.
+
+Run with ``python -m benchmarks.memory``.
+"""
+
+from decimal import Decimal
+import tracemalloc
+from typing import Any, Callable, Dict
+
+import attr
+
+from manta.messages import (AckMessage, Destination, Merchant,
+                            MerchantOrderRequestMessage, PaymentMessage,
+                            PaymentRequestMessage, Status)
+from manta.payproc import TXStorageMemory
+
+SESSIONS = 10000
+
+MERCHANT = Merchant(name="Merchant 1", address="5th Avenue")
+CRYPTOS = {"BTC", "NANO", "XMR"}
+
+DICT_CLASSES: Dict[type, type] = {
+    cls: attr.make_class(cls.__name__,
+                         {a.name: attr.ib() for a in attr.fields(cls) if a.init},
+                         slots=False)
+    for cls in (AckMessage, Destination, Merchant, MerchantOrderRequestMessage,
+                PaymentMessage, PaymentRequestMessage)
+}
+
+
+def dict_layout(value: Any) -> Any:
+    """Copy of a message as an instance of its baseline class, without the
+    private caches"""
+    if isinstance(value, list):
+        return [dict_layout(item) for item in value]
+    if type(value) not in DICT_CLASSES:
+        return value
+
+    return DICT_CLASSES[type(value)](**{
+        a.name: dict_layout(getattr(value, a.name))
+        for a in attr.fields(type(value)) if a.init
+    })
+
+
+def slots_layout(value: Any) -> Any:
+    return value
+
+
+def open_session(storage: TXStorageMemory, txid: int, layout: Callable[[Any], Any]):
+    session_id = f"session{txid}"
+    order = MerchantOrderRequestMessage(amount=Decimal("10.5"),
+                                        session_id=session_id,
+                                        fiat_currency="EUR")
+    ack = AckMessage(txid=str(txid), status=Status.NEW,
+                     url=f"manta://localhost/{session_id}")
+    state = storage.create(txid, session_id, "device1", layout(order), layout(ack))
+    # PayProc stores the payment request decoded from the signed envelope
+    payment_request = PaymentRequestMessage(
+        merchant=MERCHANT,
+        amount=order.amount,
+        fiat_currency=order.fiat_currency,
+        destinations=[Destination(amount=Decimal("0.001"),
+                                  destination_address=f"{crypto}{txid}",
+                                  crypto_currency=crypto)
+                      for crypto in CRYPTOS],
+        supported_cryptos=CRYPTOS,
+    )
+    state.payment_request = layout(PaymentRequestMessage.from_json(
+        payment_request.to_json()))
+    state.payment_message = layout(PaymentMessage(crypto_currency="NANO",
+                                                  transaction_hash=f"hash{txid}"))
+
+
+def measure(label: str, layout: Callable[[Any], Any]) -> float:
+    # generates the cattrs functions before measuring
+    open_session(TXStorageMemory(), 0, layout)
+
+    storage = TXStorageMemory()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    for txid in range(SESSIONS):
+        open_session(storage, txid, layout)
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    size = (end - start) / SESSIONS
+    print(f"{label:<24} {size:8.0f} bytes/session")
+    return size
+
+
+def main():
+    print(f"{SESSIONS} sessions")
+    before = measure("__dict__ (baseline)", dict_layout)
+    after = measure("slots", slots_layout)
+    print(f"{'':<24} {before - after:8.0f} bytes/session saved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+Benchmark of message encoding/decoding.
+
+Compares the legacy implementation (global cattrs dispatch with hooks
+registered on every call) with the one in :mod:`manta.messages`.
+
+Run with ``python -m benchmarks.messages``.
+"""
+
+from decimal import Decimal
+import timeit
+
+import cattr
+import simplejson as json
+
+from manta.messages import (AckMessage, Destination, Merchant,
+                            MerchantOrderRequestMessage, PaymentRequestMessage,
+                            Status, drop_nonattrs)
+
+NUMBER = 10000
+
+ACK = AckMessage(txid="0", status=Status.NEW, url="manta://localhost/123",
+                 amount=Decimal("0.01"))
+ORDER = MerchantOrderRequestMessage(amount=Decimal("10.5"), session_id="123",
+                                    fiat_currency="EUR")
+PAYMENT_REQUEST = PaymentRequestMessage(
+    merchant=Merchant(name="Merchant 1", address="5th Avenue"),
+    amount=Decimal("10.5"),
+    fiat_currency="EUR",
+    destinations=[Destination(amount=Decimal(i), destination_address=f"addr{i}",
+                              crypto_currency=f"COIN{i}")
+                  for i in range(10)],
+    supported_cryptos={f"COIN{i}" for i in range(10)},
+)
+
+
+def legacy_to_json(message) -> str:
+    cattr.register_unstructure_hook(Decimal, lambda d: str(d))
+    return json.dumps(cattr.unstructure(message), iterable_as_array=True)
+
+
+def legacy_from_json(cls, json_str):
+    d = json.loads(json_str)
+    cattr.register_structure_hook(Decimal, lambda d, t: Decimal(d))
+    if "version" not in d:
+        d["version"] = ""
+    return cattr.structure(drop_nonattrs(d, cls), cls)
+
+
+def bench(label: str, fn) -> float:
+    seconds = min(timeit.repeat(fn, number=NUMBER, repeat=3))
+    usec = seconds / NUMBER * 1e6
+    print(f"{label:<48} {usec:8.2f} us/msg")
+    return usec
+
+
+def main():
+    for message in (ACK, ORDER, PAYMENT_REQUEST):
+        cls = type(message)
+        payload = message.to_json()
+        name = cls.__name__
+        before = bench(f"{name} to_json (legacy)",
+                       lambda: legacy_to_json(message))
+        after = bench(f"{name} to_json", message.to_json)
+        print(f"{'':<48} {before / after:8.2f}x")
+        before = bench(f"{name} from_json (legacy)",
+                       lambda: legacy_from_json(cls, payload))
+        after = bench(f"{name} from_json", lambda: cls.from_json(payload))
+        print(f"{'':<48} {before / after:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+Load benchmark of PayProc workers sharing the orders through an MQTT
+shared subscription.
+
+For 1, 2 and 4 workers (each a separate process) a merchant publishes
+``ORDERS`` merchant orders and waits for their NEW acks, reporting
+orders per second.
+
+Uses a broker supporting shared subscriptions (ie mosquitto >= 1.6) on
+``MQTT_HOST``:``MQTT_PORT``. Without ``MQTT_HOST`` the minimal broker of
+:mod:`benchmarks.broker` is started on localhost:``MQTT_PORT`` (1883 by
+default).
+
+With N workers, (N - 1) / N of the orders reach a worker that doesn't
+own their session and take an extra broker hop to be forwarded.
+
+Run with ``python -m benchmarks.scaling``.
+"""
+
+import asyncio
+from decimal import Decimal
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+
+import paho.mqtt.client as mqtt
+
+from benchmarks.broker import serve
+from manta.messages import AckMessage, Destination, Merchant, MerchantOrderRequestMessage
+from manta.payproc import PayProc
+
+ORDERS = 20000
+WORKERS = (1, 2, 4)
+LOCAL_BROKER = "MQTT_HOST" not in os.environ
+HOST = os.environ.get("MQTT_HOST", "localhost")
+PORT = int(os.environ.get("MQTT_PORT", "1883"))
+KEY_FILE = os.path.join(
+    os.path.dirname(__file__), "..", "certificates", "root", "keys", "test.key"
+)
+
+MERCHANT = Merchant(name="Merchant 1", address="5th Avenue")
+DESTINATIONS = [
+    Destination(amount=Decimal("0.01"), destination_address="btc_address",
+                crypto_currency="BTC")
+]
+
+
+def worker(index: int, workers: int, group: str, ready):
+    payproc = PayProc(KEY_FILE, host=HOST, port=PORT, workers=workers,
+                      worker_index=index, share_group=group)
+    payproc.get_merchant = lambda application: MERCHANT
+    payproc.get_destinations = lambda application, order: DESTINATIONS
+    payproc.get_supported_cryptos = lambda application, order: {"BTC"}
+    payproc.mqtt_client.on_subscribe = lambda *args: ready.release()
+    payproc.run()
+
+    while True:
+        time.sleep(60)
+
+
+def run(workers: int) -> float:
+    # a new group for each run, so that old subscriptions don't interfere
+    group = "bench{}".format(uuid.uuid4().hex[:8])
+    ready = multiprocessing.Semaphore(0)
+    processes = [
+        multiprocessing.Process(target=worker, args=(i, workers, group, ready),
+                                daemon=True)
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    # each worker subscribes to the orders and the cancels, plus the
+    # forwarded orders if there are many of them
+    for _ in range(workers * (3 if workers > 1 else 2)):
+        ready.acquire(timeout=10)
+
+    acks = 0
+    done = threading.Event()
+
+    def on_message(client, userdata, msg):
+        nonlocal acks
+        AckMessage.decode(msg.payload)
+        acks += 1
+        if acks == ORDERS:
+            done.set()
+
+    merchant = mqtt.Client()
+    merchant.on_message = on_message
+    merchant.connect(HOST, PORT)
+    merchant.subscribe("acks/+", qos=1)
+    merchant.loop_start()
+
+    orders = [
+        MerchantOrderRequestMessage(amount=Decimal("10"), fiat_currency="EUR",
+                                    session_id=uuid.uuid4().hex).to_json()
+        for _ in range(ORDERS)
+    ]
+
+    start = time.perf_counter()
+    for order in orders:
+        merchant.publish("merchant_order_request/bench", order, qos=1)
+    done.wait(120)
+    elapsed = time.perf_counter() - start
+
+    merchant.loop_stop()
+    merchant.disconnect()
+    for process in processes:
+        process.terminate()
+
+    if acks < ORDERS:
+        print("  only {} acks received".format(acks))
+    return acks / elapsed
+
+
+def broker():
+    asyncio.run(serve(HOST, PORT))
+
+
+def main():
+    if LOCAL_BROKER:
+        multiprocessing.Process(target=broker, daemon=True).start()
+        time.sleep(1)
+
+    print(f"{multiprocessing.cpu_count()} CPUs, {ORDERS} orders")
+    for workers in WORKERS:
+        rate = run(workers)
+        print(f"{workers} workers: {rate:.0f} orders/s")
+
+
+if __name__ == "__main__":
+    main()
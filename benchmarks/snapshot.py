@@ -0,0 +1,42 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+Benchmark of the warm restart of :class:`TXStorageMemory` from a
+snapshot: time to load it and to access one session, for increasing
+numbers of sessions.
+
+Run with ``python -m benchmarks.snapshot``.
+"""
+
+import os
+import tempfile
+import time
+
+from manta.payproc import TXStorageMemory
+
+from .memory import open_session
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sessions")
+
+        for sessions in (1000, 10000, 100000):
+            storage = TXStorageMemory()
+            for txid in range(sessions):
+                open_session(storage, txid)
+            storage.dump(path)
+
+            start = time.perf_counter()
+            restored = TXStorageMemory()
+            restored.load(path)
+            restored.get_state_for_session(f"session{sessions // 2}")
+            elapsed = time.perf_counter() - start
+            restored.snapshot.close()
+            print(f"{sessions} sessions: ready in {elapsed * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
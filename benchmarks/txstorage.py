@@ -0,0 +1,62 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+Benchmark of the state transitions per second of the persistent
+:class:`TXStorage` implementations.
+
+Every session goes through the transitions of a payment: creation with
+the NEW ack, payment request, payment with the PENDING ack and PAID ack.
+
+Run with ``python -m benchmarks.txstorage``.
+"""
+
+import os
+import tempfile
+import time
+
+import attr
+
+from manta.messages import Status
+from manta.txstorage import TXStorageJournal, TXStorageSQLite
+
+from .memory import open_session
+
+SESSIONS = 5000
+# create, payment_request, payment_message, 2 acks
+TRANSITIONS = 5
+
+
+def run(storage):
+    start = time.perf_counter()
+    for txid in range(SESSIONS):
+        open_session(storage, txid)
+        storage.flush()
+        state = storage.get_state_for_txid(txid)
+        # PayProc flushes after handling each message
+        state.ack = attr.evolve(state.ack, status=Status.PENDING)
+        storage.flush()
+        state.ack = attr.evolve(state.ack, status=Status.PAID)
+        storage.flush()
+    storage.sync()
+    elapsed = time.perf_counter() - start
+    return SESSIONS * TRANSITIONS / elapsed
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        storage = TXStorageSQLite(os.path.join(directory, "tx.db"))
+        rate = run(storage)
+        storage.close()
+    print(f"TXStorageSQLite: {rate:.0f} transitions/s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        storage = TXStorageJournal(os.path.join(directory, "payproc"))
+        rate = run(storage)
+        storage.close()
+    print(f"TXStorageJournal: {rate:.0f} transitions/s")
+
+
+if __name__ == "__main__":
+    main()
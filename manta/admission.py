@@ -0,0 +1,143 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+Admission control of merchant orders.
+
+Orders are admitted while the number of orders being processed is below
+a global cap and the :term:`POS` sending them has tokens left in its
+bucket. The other ones are rejected at once, so the admitted sessions keep
+a predictable latency during bursts.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, NamedTuple
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, not thread safe
+
+    Args:
+        rate: tokens added per second
+        burst: maximum number of tokens, the bucket starts full
+        clock: source of the time in seconds
+    """
+
+    rate: float
+    burst: float
+
+    def __init__(
+        self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.clock = clock
+        self.updated = clock()
+
+    def take(self) -> bool:
+        """Take a token if available"""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+class AdmissionStats(NamedTuple):
+    "orders admitted and not yet processed"
+    in_flight: int
+    "orders admitted since start"
+    admitted: int
+    "orders rejected by the in flight cap since start"
+    rejected_in_flight: int
+    "orders rejected by the rate limit since start"
+    rejected_rate: int
+
+
+class AdmissionControl:
+    """
+    Admission control of the merchant orders. Thread safe.
+
+    Args:
+        rate: orders per second admitted for each :term:`application_id`,
+          0 is unlimited
+        burst: orders admitted at once for each :term:`application_id`, by
+          default one second of ``rate``
+        max_in_flight: maximum number of orders being processed, 0 is
+          unlimited
+        clock: source of the time in seconds
+    """
+
+    rate: float
+    burst: float
+    max_in_flight: int
+
+    def __init__(
+        self,
+        rate: float = 0,
+        burst: float = 0,
+        max_in_flight: int = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst if burst > 0 else max(1.0, rate)
+        self.max_in_flight = max_in_flight
+        self.clock = clock
+        self.buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._admitted = 0
+        self._rejected_in_flight = 0
+        self._rejected_rate = 0
+
+    def admit(self, application_id: str) -> bool:
+        """
+        Admit an order. Each admitted order must be followed by a call of
+        :meth:`release` once processed.
+
+        Args:
+            application_id: :term:`application_id` of the :term:`POS`
+        Returns:
+            True if the order is admitted
+        """
+        with self._lock:
+            # Rejected orders don't take tokens
+            if 0 < self.max_in_flight <= self._in_flight:
+                self._rejected_in_flight += 1
+                return False
+
+            if self.rate > 0:
+                bucket = self.buckets.get(application_id)
+                if bucket is None:
+                    bucket = self.buckets[application_id] = TokenBucket(
+                        self.rate, self.burst, self.clock
+                    )
+                if not bucket.take():
+                    self._rejected_rate += 1
+                    return False
+
+            self._in_flight += 1
+            self._admitted += 1
+            return True
+
+    def release(self):
+        """Mark an admitted order as processed"""
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self) -> AdmissionStats:
+        with self._lock:
+            return AdmissionStats(
+                in_flight=self._in_flight,
+                admitted=self._admitted,
+                rejected_in_flight=self._rejected_in_flight,
+                rejected_rate=self._rejected_rate,
+            )
@@ -0,0 +1,125 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+:term:`MQTT` transport driven by an *asyncio* loop.
+
+The socket of a paho client is watched by the loop instead of a network
+thread, so the client callbacks (``on_connect``, ``on_message``...) run in
+the loop thread and can create tasks directly.
+"""
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Optional
+
+import paho.mqtt.client as mqtt
+
+if TYPE_CHECKING:
+    # only defined for type checkers, since paho-mqtt 2.0
+    from paho.mqtt.client import SocketLike
+
+logger = logging.getLogger(__name__)
+
+"Seconds between calls of the client housekeeping (keepalive pings, retries)"
+MISC_INTERVAL = 1.0
+"Maximum seconds between reconnection attempts"
+MAX_RECONNECT_DELAY = 30.0
+
+
+class AsyncioMQTTTransport:
+    """
+    Run the network I/O of a paho client in an *asyncio* loop.
+
+    All the methods of the client, ie ``publish`` and ``subscribe``, must
+    then be called from the loop thread.
+
+    Args:
+        client: the paho client, with its callbacks already set
+        loop: the loop, by default the current one
+    """
+
+    client: mqtt.Client
+    loop: asyncio.AbstractEventLoop
+
+    def __init__(
+        self, client: mqtt.Client, loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.client = client
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self._misc: Optional[asyncio.TimerHandle] = None
+        self._reconnect: Optional[asyncio.TimerHandle] = None
+        self._reconnect_delay = MISC_INTERVAL
+        self._closing = False
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def connect(self, host: str, port: int = 1883):
+        """
+        Connect to the broker. Only the TCP connection is established
+        synchronously, the client ``on_connect`` is called when the broker
+        accepts the session.
+
+        Args:
+            host: broker host
+            port: broker port
+        """
+        self._closing = False
+        self.client.connect(host=host, port=port)
+
+    def disconnect(self):
+        """Disconnect from the broker, without reconnecting"""
+        self._closing = True
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+            self._reconnect = None
+        self.client.disconnect()
+
+    # noinspection PyUnusedLocal
+    def _on_socket_open(self, client, userdata, sock: "SocketLike") -> None:
+        logger.debug("Socket opened")
+        self._reconnect_delay = MISC_INTERVAL
+        self.loop.add_reader(sock, self.client.loop_read)
+        self._misc = self.loop.call_later(MISC_INTERVAL, self._loop_misc)
+
+    # noinspection PyUnusedLocal
+    def _on_socket_close(self, client, userdata, sock: "SocketLike") -> None:
+        logger.debug("Socket closed")
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if self._misc is not None:
+            self._misc.cancel()
+            self._misc = None
+
+        if not self._closing:
+            self._schedule_reconnect()
+
+    # noinspection PyUnusedLocal
+    def _on_socket_register_write(self, client, userdata, sock: "SocketLike") -> None:
+        self.loop.add_writer(sock, self.client.loop_write)
+
+    # noinspection PyUnusedLocal
+    def _on_socket_unregister_write(self, client, userdata, sock: "SocketLike") -> None:
+        self.loop.remove_writer(sock)
+
+    def _loop_misc(self):
+        self.client.loop_misc()
+        if self._misc is not None:
+            self._misc = self.loop.call_later(MISC_INTERVAL, self._loop_misc)
+
+    def _schedule_reconnect(self):
+        logger.info("Reconnecting in %.0f seconds", self._reconnect_delay)
+        self._reconnect = self.loop.call_later(self._reconnect_delay, self._do_reconnect)
+        self._reconnect_delay = min(self._reconnect_delay * 2, MAX_RECONNECT_DELAY)
+
+    def _do_reconnect(self):
+        self._reconnect = None
+        try:
+            self.client.reconnect()
+        except OSError as e:
+            logger.warning("Reconnection failed: %s", e)
+            self._schedule_reconnect()
@@ -0,0 +1,287 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+*asyncio* native Manta :term:`Payment Processor`.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+import inspect
+import logging
+import traceback
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Set, TypeVar, Union
+
+import paho.mqtt.client as mqtt
+
+from .aiomqtt import AsyncioMQTTTransport
+from .dispatcher import Dispatcher
+from .messages import (
+    Destination,
+    JSONData,
+    MerchantOrderRequestMessage,
+    PaymentRequestEnvelope,
+)
+from .payproc import PayProc, is_manta_order
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+async def resolve(value: Union[T, Awaitable[T]]) -> T:
+    """Await the result of a callback if it's awaitable"""
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+class _Lane:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class AsyncPayProc(PayProc):
+    """
+    Payment Processor running in an *asyncio* loop, without a network
+    thread.
+
+    Each message is handled by a task, so a slow merchant callback delays
+    only its session. Messages of the same session are still handled in
+    order. The merchant callbacks (``get_merchant``, ``get_destinations``,
+    ``get_supported_cryptos``) can be coroutine functions, and the ones
+    needed for a payment request are awaited concurrently. With
+    ``signing_workers`` the signature is awaited, otherwise the messages
+    are signed in the loop. ``presign_workers`` only enables presigning,
+    done by tasks of the loop, and ``dispatch_workers`` is not supported.
+
+    :meth:`run`, :meth:`confirm`, :meth:`invalidate` and all the other
+    methods must be called from the loop thread.
+
+    Args:
+        key_file: File name of PEM private key of Payment Processor
+        loop: the loop, by default the current one
+        **kwargs: the other arguments of :class:`~.payproc.PayProc`
+    """
+
+    loop: asyncio.AbstractEventLoop
+    transport: AsyncioMQTTTransport
+    concurrent_orders = True
+    # pending message handlers
+    tasks: Set["asyncio.Task[Any]"]
+
+    def __init__(
+        self, key_file: str, loop: Optional[asyncio.AbstractEventLoop] = None, **kwargs
+    ):
+        if kwargs.get("dispatch_workers"):
+            raise ValueError("AsyncPayProc handles the messages in the loop")
+
+        super().__init__(key_file, **kwargs)
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.transport = AsyncioMQTTTransport(self.mqtt_client, self.loop)
+        self.tasks = set()
+        self._lanes: Dict[str, _Lane] = {}
+
+    def run(self):
+        """
+        Connect to the broker. The messages are then processed by the loop.
+        """
+        self.transport.connect(self.host, self.port)
+
+    async def stop(self):
+        """
+        Disconnect, wait for the pending message handlers and stop the
+        workers
+        """
+        self.transport.disconnect()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.close()
+
+    @asynccontextmanager
+    async def session_lane(self, session_id: str) -> AsyncIterator[None]:
+        """
+        Serialize the handlers of a session, in order of arrival
+
+        Args:
+            session_id: the session
+        """
+        lane = self._lanes.get(session_id)
+        if lane is None:
+            lane = self._lanes[session_id] = _Lane()
+
+        lane.users += 1
+        try:
+            async with lane.lock:
+                yield
+        finally:
+            lane.users -= 1
+            if lane.users == 0:
+                del self._lanes[session_id]
+
+    # noinspection PyUnusedLocal
+    def on_message(self, client: mqtt.Client, userdata, msg):
+        logger.info("New Message on %s", msg.topic)
+        logger.debug("Payload %r", msg.payload)
+
+        try:
+            for result in self.dispatcher.dispatch(msg.topic, payload=msg.payload):
+                if inspect.isawaitable(result):
+                    task = self.loop.create_task(self._handle(result))
+                    self.tasks.add(task)
+                    task.add_done_callback(self.tasks.discard)
+        except Exception as e:
+            logger.error(e)
+            traceback.print_exc()
+        finally:
+            self.tx_storage.flush()
+
+    async def _handle(self, handler: Awaitable[None]):
+        try:
+            await handler
+        except Exception as e:
+            logger.error(e)
+            traceback.print_exc()
+        finally:
+            self.tx_storage.flush()
+
+    @Dispatcher.method_topic("merchant_order_cancel/+")
+    async def on_merchant_order_cancel(self, session_id, payload):
+        async with self.session_lane(session_id):
+            super().on_merchant_order_cancel(session_id, payload)
+
+    @Dispatcher.method_topic("merchant_order_request/+")
+    async def on_merchant_order_request(self, application_id: str, payload: JSONData):
+        logger.info("Processing merchant_order message")
+
+        p = MerchantOrderRequestMessage.decode(payload)
+
+        if not self.forward_order(application_id, p, payload):
+            await self.process_order_async(application_id, p)
+
+    # noinspection PyUnusedLocal
+    @Dispatcher.method_topic("payproc_workers/+/+/merchant_order_request/+")
+    async def on_forwarded_order(
+        self, group: str, worker_index: str, application_id: str, payload: JSONData
+    ):
+        logger.info("Processing forwarded merchant_order message")
+        await self.process_order_async(
+            application_id, MerchantOrderRequestMessage.decode(payload)
+        )
+
+    async def process_order_async(
+        self, application_id: str, p: MerchantOrderRequestMessage
+    ):
+        """
+        Like :meth:`~.payproc.PayProc.process_order`, awaiting the
+        destinations of legacy orders. Orders not admitted are rejected
+
+        Args:
+            application_id: :term:`application_id` of the :term:`POS`
+            p: the merchant order
+        """
+        if not self.admit_order(application_id, p):
+            return
+
+        try:
+            async with self.session_lane(p.session_id):
+                destinations: Optional[List[Destination]] = None
+                if not is_manta_order(p):
+                    destinations = await resolve(self.get_destinations(application_id, p))
+                self.create_session(application_id, p, destinations)
+        finally:
+            if self.admission is not None:
+                self.admission.release()
+
+    # noinspection PyUnusedLocal
+    @Dispatcher.method_topic("payment_requests/+/+")
+    async def on_get_payment_request(
+        self, session_id: str, crypto_currency: str, payload: JSONData
+    ):
+        logger.info("Processing payment request message")
+
+        async with self.session_lane(session_id):
+            pending = self._start_payment_request(session_id, crypto_currency, payload)
+            if pending is None:
+                return
+
+            application, request = pending
+            envelope = None
+            presigned = self._take_presigned(session_id, crypto_currency)
+
+            if presigned is not None:
+                try:
+                    envelope = await asyncio.wrap_future(presigned, loop=self.loop)
+                except Exception:
+                    # Presigning failed, try again
+                    logger.exception("Error presigning payment request for %r", session_id)
+
+            if envelope is None:
+                envelope = await self.generate_payment_request_coro(application, request)
+
+            self._publish_payment_request(session_id, crypto_currency, envelope)
+
+    @Dispatcher.method_topic("payments/+")
+    async def on_payment(self, session_id: str, payload: JSONData):
+        async with self.session_lane(session_id):
+            super().on_payment(session_id, payload)
+
+    def presign(self, application_id: str, order: MerchantOrderRequestMessage):
+        request = MerchantOrderRequestMessage(
+            fiat_currency=order.fiat_currency,
+            amount=order.amount,
+            session_id=order.session_id,
+        )
+        task = self.generate_payment_request_async(application_id, request)
+        with self._presigned_lock:
+            self.presigned[order.session_id] = task  # type: ignore
+
+    def generate_payment_request_async(  # type: ignore
+        self, device: str, merchant_request: MerchantOrderRequestMessage
+    ) -> "asyncio.Task[PaymentRequestEnvelope]":
+        """
+        Run :meth:`generate_payment_request_coro` in a task of the loop
+
+        Returns:
+            the task, a future of the envelope
+        """
+        return self.loop.create_task(
+            self.generate_payment_request_coro(device, merchant_request)
+        )
+
+    async def generate_payment_request_coro(
+        self, device: str, merchant_request: MerchantOrderRequestMessage
+    ) -> PaymentRequestEnvelope:
+        """
+        Create a :class:`~.messages.PaymentRequestEnvelope`, awaiting the
+        merchant callbacks concurrently and the signature if there is a
+        signing pool.
+
+        Args:
+            device: :term:`application_id` of the :term:`POS`
+            merchant_request: object containing payment infos
+        Returns:
+            an envelope containing a :class:`~.message.PaymentRequestMessage`
+        """
+        merchant, destinations, supported_cryptos = await asyncio.gather(
+            resolve(self.get_merchant(device)),
+            resolve(self.get_destinations(device, merchant_request)),
+            resolve(self.get_supported_cryptos(device, merchant_request)),
+        )
+        json_message = self._build_payment_request_json(
+            merchant_request, merchant, destinations, supported_cryptos
+        )
+        data = json_message.encode("utf-8")
+
+        if self.signing_pool is None:
+            signature = self.sign(data)
+        else:
+            signature = await asyncio.wrap_future(
+                self.signing_pool.submit(data), loop=self.loop
+            )
+
+        return self._envelope(json_message, signature)
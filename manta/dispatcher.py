@@ -6,7 +6,7 @@ from __future__ import annotations
 
 import inspect
 import re
-from typing import List, Callable, Tuple
+from typing import Any, List, Callable, Tuple
 
 
 class Dispatcher:
@@ -18,13 +18,24 @@ class Dispatcher:
         if obj is None:
             return
 
+        registered = set()
+
         for cls in inspect.getmro(obj.__class__): # Register all subclasses methods
             for key, value in cls.__dict__.items():
                 if inspect.isfunction(value):
-                    if hasattr(value, "dispatcher"):
-                        self.callbacks.append((value.dispatcher, value.__get__(obj)))
+                    # Overriding methods inherit the topic, and are registered once
+                    if hasattr(value, "dispatcher") and key not in registered:
+                        registered.add(key)
+                        self.callbacks.append((value.dispatcher, getattr(obj, key)))
+
+    def dispatch(self, topic: str, **kwargs) -> List[Any]:
+        """
+        Call the callbacks matching a topic.
 
-    def dispatch(self, topic: str, **kwargs):
+        Returns: the values returned by the callbacks, ie the coroutines of
+          async callbacks
+        """
+        results = []
         for callback in self.callbacks:
             result = re.match(callback[0], topic)
             if result:
@@ -32,7 +43,8 @@ class Dispatcher:
                 args = list(groups[:-1])
                 #To match #
                 args = args + groups[-1].split("/")
-                callback[1](*args, **kwargs)
+                results.append(callback[1](*args, **kwargs))
+        return results
 
     @staticmethod
     def mqtt_to_regex(topic: str):
@@ -0,0 +1,144 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+Thread pool running the tasks of each key in order.
+"""
+
+import logging
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LaneStats(NamedTuple):
+    "number of lanes (threads)"
+    lanes: int
+    "tasks submitted and not yet completed, for each lane"
+    pending: Tuple[int, ...]
+    "highest number of pending tasks of a lane"
+    max_pending: int
+    "tasks submitted since start"
+    submitted: int
+    "tasks completed (or failed) since start"
+    completed: int
+    "fraction of the time since start each lane spent running tasks"
+    utilization: Tuple[float, ...]
+
+
+class _Lane:
+    __slots__ = ("queue", "thread", "pending", "busy")
+
+    def __init__(self, queue_size: int):
+        self.queue: "queue.Queue[Optional[Tuple[Callable, tuple]]]" = queue.Queue(queue_size)
+        self.thread: Optional[threading.Thread] = None
+        self.pending = 0
+        # seconds spent running tasks
+        self.busy = 0.0
+
+
+class LanePool:
+    """
+    Pool of threads ("lanes") running tasks, in order of submission for
+    each key.
+
+    Each key (ie a :term:`session_id`) is hashed to a lane, which runs its
+    tasks one at a time, so tasks of the same key never overlap while
+    tasks of different keys run in parallel on the other lanes.
+
+    Args:
+        lanes: number of lanes
+        queue_size: maximum number of tasks queued on each lane, 0 is
+          unbounded. When a lane is full :meth:`submit` blocks, slowing
+          down the producer
+    """
+
+    lanes: int
+    queue_size: int
+
+    def __init__(self, lanes: int, queue_size: int = 1000):
+        if lanes < 1:
+            raise ValueError("lanes must be at least 1")
+
+        self.lanes = lanes
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._completed = 0
+        self._max_pending = 0
+        self._started = time.monotonic()
+        self._lanes: List[_Lane] = [_Lane(queue_size) for _ in range(lanes)]
+
+        for i, lane in enumerate(self._lanes):
+            lane.thread = threading.Thread(
+                target=self._run, args=(lane,), name="manta-lane-{}".format(i), daemon=True
+            )
+            lane.thread.start()
+
+    def lane_index(self, key: str) -> int:
+        """Return the lane running the tasks of a key"""
+        return zlib.crc32(key.encode("utf-8")) % self.lanes
+
+    def submit(self, key: str, fn: Callable[..., Any], *args: Any):
+        """
+        Queue a task on the lane of a key. Exceptions raised by the task
+        are logged.
+
+        Args:
+            key: ordering key of the task
+            fn: function to call
+            *args: arguments of the function
+        """
+        lane = self._lanes[self.lane_index(key)]
+        with self._lock:
+            lane.pending += 1
+            self._submitted += 1
+            self._max_pending = max(self._max_pending, lane.pending)
+
+        lane.queue.put((fn, args))
+
+    def _run(self, lane: _Lane):
+        while True:
+            task = lane.queue.get()
+            if task is None:
+                return
+
+            fn, args = task
+            start = time.perf_counter()
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception("Error running %r", fn)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    lane.pending -= 1
+                    lane.busy += elapsed
+                    self._completed += 1
+
+    def stats(self) -> LaneStats:
+        with self._lock:
+            uptime = max(time.monotonic() - self._started, 1e-9)
+            return LaneStats(
+                lanes=self.lanes,
+                pending=tuple(lane.pending for lane in self._lanes),
+                max_pending=self._max_pending,
+                submitted=self._submitted,
+                completed=self._completed,
+                utilization=tuple(min(lane.busy / uptime, 1.0) for lane in self._lanes),
+            )
+
+    def shutdown(self, wait: bool = True):
+        """Stop the lanes after running the queued tasks"""
+        for lane in self._lanes:
+            lane.queue.put(None)
+
+        if wait:
+            for lane in self._lanes:
+                assert lane.thread is not None
+                lane.thread.join()
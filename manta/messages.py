@@ -7,23 +7,35 @@ import warnings
 
 warnings.filterwarnings("ignore", message="Global variable")
 
+from abc import ABC, abstractmethod
 import base64
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
 from decimal import Decimal
 from enum import Enum
-from typing import List, Set, TypeVar, Type, Optional, Union
+from functools import partial
+import os
+import threading
+from typing import (Any, Callable, Dict, FrozenSet, Hashable, Iterable, List,
+                    NamedTuple, Set, Tuple, TypeVar, Type, Optional, Union)
 
 import attr
 import cattr
+from cattr.gen import make_dict_structure_fn, make_dict_unstructure_fn, override
 from certvalidator import CertificateValidator, ValidationContext
 from cryptography import x509
-from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
-import simplejson as json
+import simplejson
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
 
 from . import MANTA_VERSION
+from .signing import DEFAULT_ALGORITHM, Verifier, get_signer, get_verifier
 
 
 class Status(Enum):
@@ -41,47 +53,325 @@ class Status(Enum):
     CANCELED = "canceled"  #: Order has been canceled
 
 
+#: Memo of the INVALID ack of an order rejected because the Payment
+#: Processor is overloaded
+BUSY_MEMO = "busy"
+
+
 T = TypeVar("T", bound="Message")
 
+#: Data accepted by the decoders: JSON text or the raw UTF-8 encoded payload
+JSONData = Union[str, bytes, bytearray, memoryview]
+
+
+class JSONBackend(ABC):
+    """
+    JSON encoder/decoder used to serialize messages
+
+    Implementations must encode :class:`~decimal.Decimal` values as strings
+    and sets as arrays.
+    """
+
+    name: str
+
+    @abstractmethod
+    def dumps(self, obj: Any) -> str:
+        pass
+
+    @abstractmethod
+    def loads(self, data: JSONData) -> Any:
+        pass
+
+
+class SimpleJSONBackend(JSONBackend):
+    """JSON backend based on *simplejson*, always available"""
+
+    name = "simplejson"
+
+    def dumps(self, obj: Any) -> str:
+        return simplejson.dumps(obj, iterable_as_array=True)
+
+    def loads(self, data: JSONData) -> Any:
+        if not isinstance(data, str):
+            # decode straight from the buffer, without an intermediate bytes copy
+            data = str(data, "utf-8")
+        return simplejson.loads(data)
+
+
+def _encode_default(obj: Any) -> Any:
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrjsonBackend(JSONBackend):
+    """
+    JSON backend based on *orjson*, used by default when installed
+
+    Output is compact (no whitespace after separators) and non ASCII
+    characters are not escaped.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self._orjson = orjson
+
+    def dumps(self, obj: Any) -> str:
+        return self._orjson.dumps(obj, default=_encode_default).decode("utf-8")
+
+    def loads(self, data: JSONData) -> Any:
+        # orjson parses bytes, bytearray and memoryview without copying
+        return self._orjson.loads(data)
+
+
+JSON_BACKENDS: Dict[str, Type[JSONBackend]] = {
+    SimpleJSONBackend.name: SimpleJSONBackend,
+    OrjsonBackend.name: OrjsonBackend,
+}
+
+
+def _default_json_backend() -> JSONBackend:
+    try:
+        return OrjsonBackend()
+    except ImportError:
+        return SimpleJSONBackend()
+
+
+json_backend: JSONBackend = _default_json_backend()
+
+
+def set_json_backend(backend: Union[str, JSONBackend]) -> JSONBackend:
+    """
+    Set the JSON backend used by all the messages
+
+    Args:
+        backend: a :class:`JSONBackend` instance or the name of one of the
+          :data:`JSON_BACKENDS`
+
+    Returns: the previous backend
+    """
+    global json_backend
+
+    if isinstance(backend, str):
+        backend = JSON_BACKENDS[backend]()
+
+    previous = json_backend
+    json_backend = backend
+    return previous
+
+
+#: Converter used for all the messages, hooks are registered only once
+converter = cattr.Converter(detailed_validation=False)
+converter.register_unstructure_hook(Decimal, str)
+converter.register_structure_hook(Decimal, lambda d, t: Decimal(d))
+
+_unstructure_fns: Dict[type, Callable[[Any], dict]] = {}
+
+
+def get_unstructure_fn(cls: type) -> Callable[[Any], dict]:
+    """Return the unstructure function generated for the given message class.
+
+    The function is generated on first use and registered on the
+    :data:`converter`, so nested messages (like :class:`Destination`) use
+    it too. Private caches (``init=False`` fields) are not part of the
+    message and are omitted.
+    """
+    try:
+        return _unstructure_fns[cls]
+    except KeyError:
+        omitted: Dict[str, Any] = {
+            a.name: override(omit=True) for a in attr.fields(cls) if not a.init
+        }
+        fn: Callable[[Any], dict] = make_dict_unstructure_fn(cls, converter, **omitted)
+        converter.register_unstructure_hook(cls, fn)
+        _unstructure_fns[cls] = fn
+        return fn
+
+
+#: Values used by :meth:`Message.from_json` for fields missing in the JSON
+MISSING_FIELDS = {"version": ""}
+
+
+class DecodingPlan:
+    """
+    Precomputed decoding of an attrs class
+
+    Holds the known field names, the defaults for missing fields and the
+    structure function generated by cattrs, which applies the Decimal,
+    Enum, Set and nested message coercions reading only the known keys
+    of the incoming dict, so unknown keys are dropped without copying it.
+
+    Use :func:`get_decoding_plan` to get the plan of a class.
+
+    Args:
+        cls: attrs class to decode
+    """
+
+    cls: type
+    field_names: frozenset
+    #: Defaults from :data:`MISSING_FIELDS` that apply to this class
+    missing: Dict[str, Any]
+
+    def __init__(self, cls: type):
+        if not attr.has(cls):
+            raise ValueError(f"type {cls} is not an attrs class")
+
+        self.cls = cls
+        self.field_names = frozenset(a.name for a in attr.fields(cls) if a.init)
+        self.missing = {
+            key: value
+            for key, value in MISSING_FIELDS.items()
+            if key in self.field_names
+        }
+        self._structure = make_dict_structure_fn(cls, converter)
+        # nested messages use the same generated function
+        converter.register_structure_hook(cls, self._structure)
+
+    def structure(self, d: dict) -> Any:
+        """
+        Create an instance from a dict, ignoring unknown keys
+
+        Args:
+            d: decoded JSON object
+        """
+        return self._structure(d, self.cls)
+
+    def structure_message(self, d: dict) -> Any:
+        """
+        Like :meth:`structure`, filling missing fields with the
+        :data:`MISSING_FIELDS` defaults. ``d`` is modified in place.
+
+        Args:
+            d: decoded JSON object
+        """
+        for key, value in self.missing.items():
+            if key not in d:
+                d[key] = value
+
+        return self._structure(d, self.cls)
+
+
+_decoding_plans: Dict[type, DecodingPlan] = {}
+
+
+def get_decoding_plan(cls: type) -> DecodingPlan:
+    """Return the :class:`DecodingPlan` of the given class, building it on
+    first use."""
+    try:
+        return _decoding_plans[cls]
+    except KeyError:
+        plan = DecodingPlan(cls)
+        _decoding_plans[cls] = plan
+        return plan
+
+
+#: Suffix of the version field advertising support for MessagePack payloads
+MSGPACK_TAG = "+msgpack"
+
+
+def msgpack_available() -> bool:
+    return msgpack is not None
+
+
+def msgpack_version(version: str = MANTA_VERSION) -> str:
+    """Return the version string advertising MessagePack support"""
+    return version + MSGPACK_TAG
+
+
+def supports_msgpack(version: Optional[str]) -> bool:
+    """Check if the given version field advertises MessagePack support"""
+    return version is not None and version.endswith(MSGPACK_TAG)
+
+
+def is_msgpack_payload(payload: JSONData) -> bool:
+    """
+    Check if the payload is a MessagePack encoded message
+
+    Messages are always maps, so a MessagePack payload starts with a
+    *fixmap*, *map16* or *map32* byte, while JSON starts with ``{`` or
+    whitespace.
+    """
+    if isinstance(payload, str) or len(payload) == 0:
+        return False
+
+    first = payload[0]
+    return first & 0xF0 == 0x80 or first in (0xDE, 0xDF)
+
 
 def drop_nonattrs(d: dict, type_: type) -> dict:
     """gets rid of all members of the dictionary that wouldn't fit in the given 'attrs' Type"""
-    attrs_attrs = getattr(type_, "__attrs_attrs__", None)
-    if attrs_attrs is None:
-        raise ValueError(f"type {type_} is not an attrs class")
-
-    attrs: Set[str] = {attr.name for attr in attrs_attrs}
-    # attrs: Set[str] = {attr.name for attr in attrs_attrs if attr.init is True}
+    attrs = get_decoding_plan(type_).field_names
 
     return {key: val for key, val in d.items() if key in attrs}
 
 
 def structure_ignore_extras(d: dict, Type: type):
-    return cattr.structure(drop_nonattrs(d, Type), Type)
+    return get_decoding_plan(Type).structure(d)
 
 
-@attr.s
+@attr.s(slots=True)
 class Message:
     def unstructure(self):
-        cattr.register_unstructure_hook(Decimal, lambda d: str(d))
-        return cattr.unstructure(self)
+        return get_unstructure_fn(type(self))(self)
 
     def to_json(self) -> str:
-        return json.dumps(self.unstructure(), iterable_as_array=True)
+        return json_backend.dumps(self.unstructure())
+
+    def to_msgpack(self) -> bytes:
+        if msgpack is None:
+            raise RuntimeError("msgpack package is not installed")
+
+        return msgpack.packb(self.unstructure(), default=_encode_default)
+
+    def encode(self, binary: bool = False) -> Union[str, bytes]:
+        """
+        Encode the message for the wire
+
+        Args:
+            binary: use MessagePack instead of JSON. Only to be used when
+              the receiver advertised it (see :func:`supports_msgpack`)
+        """
+        return self.to_msgpack() if binary else self.to_json()
+
+    @classmethod
+    def from_json(cls: Type[T], json_str: JSONData) -> T:
+        """
+        Decode a message
+
+        Args:
+            json_str: JSON text, or the UTF-8 encoded JSON as ``bytes``,
+              ``bytearray`` or ``memoryview`` (ie an MQTT payload)
+        """
+        d = json_backend.loads(json_str)
+        return get_decoding_plan(cls).structure_message(d)
 
     @classmethod
-    # def from_json(cls, json_str: str):
-    def from_json(cls: Type[T], json_str: str) -> T:
-        d = json.loads(json_str)
-        cattr.register_structure_hook(Decimal, lambda d, t: Decimal(d))
+    def from_msgpack(cls: Type[T], data: Union[bytes, bytearray, memoryview]) -> T:
+        if msgpack is None:
+            raise RuntimeError("msgpack package is not installed")
+
+        d = msgpack.unpackb(data)
+        return get_decoding_plan(cls).structure_message(d)
 
-        if "version" not in d:
-            d["version"] = ""
+    @classmethod
+    def decode(cls: Type[T], payload: JSONData) -> T:
+        """
+        Decode a message encoded either as JSON or as MessagePack
 
-        return structure_ignore_extras(d, cls)
+        Args:
+            payload: the message, usually an MQTT payload
+        """
+        if is_msgpack_payload(payload):
+            return cls.from_msgpack(payload)  # type: ignore
+        return cls.from_json(payload)
 
 
-@attr.s(auto_attribs=True)
+@attr.s(auto_attribs=True, slots=True)
 class MerchantOrderRequestMessage(Message):
     """
     Merchant Order Request
@@ -104,7 +394,7 @@ class MerchantOrderRequestMessage(Message):
     version: Optional[str] = MANTA_VERSION
 
 
-@attr.s(auto_attribs=True)
+@attr.s(auto_attribs=True, slots=True)
 class AckMessage(Message):
     """
     Ack Message
@@ -133,7 +423,7 @@ class AckMessage(Message):
     version: Optional[str] = MANTA_VERSION
 
 
-@attr.s(auto_attribs=True)
+@attr.s(auto_attribs=True, slots=True)
 class Destination(Message):
     """
     Destination
@@ -149,7 +439,7 @@ class Destination(Message):
     crypto_currency: str
 
 
-@attr.s(auto_attribs=True)
+@attr.s(auto_attribs=True, slots=True)
 class Merchant(Message):
     """
     Merchant
@@ -163,7 +453,7 @@ class Merchant(Message):
     address: Optional[str] = None
 
 
-@attr.s(auto_attribs=True)
+@attr.s(auto_attribs=True, slots=True)
 class PaymentRequestMessage(Message):
     """
     Payment Request
@@ -181,6 +471,10 @@ class PaymentRequestMessage(Message):
         destinations: list of destination addresses
         supported_cryptos: list of supported crypto currencies
 
+    Lookups by crypto currency are case insensitive and use an index built
+    on first use. The index is rebuilt when ``destinations`` or
+    ``supported_cryptos`` are reassigned, they must not be modified in
+    place afterwards.
     """
 
     merchant: Merchant
@@ -188,25 +482,65 @@ class PaymentRequestMessage(Message):
     fiat_currency: str
     destinations: List[Destination]
     supported_cryptos: Set[str]
+    _index: Optional["_CryptoIndex"] = attr.ib(
+        default=None, init=False, repr=False, eq=False
+    )
+
+    def _get_index(self) -> "_CryptoIndex":
+        index = self._index
+        if (
+            index is None
+            or index.destinations_src is not self.destinations
+            or index.cryptos_src is not self.supported_cryptos
+        ):
+            destinations: Dict[str, Destination] = {}
+            for d in self.destinations:
+                destinations.setdefault(d.crypto_currency.upper(), d)
+
+            index = _CryptoIndex(
+                destinations_src=self.destinations,
+                cryptos_src=self.supported_cryptos,
+                destinations=destinations,
+                cryptos=frozenset(c.upper() for c in self.supported_cryptos),
+            )
+            self._index = index
+        return index
 
-    def get_envelope(self, key: RSAPrivateKey):
+    def is_supported(self, crypto: str) -> bool:
+        """Check if ``crypto`` is one of the supported cryptos"""
+        return crypto.upper() in self._get_index().cryptos
+
+    def get_envelope(self, key: Any):
+        """
+        Sign the message and put it in an envelope
+
+        Args:
+            key: private key, the signature scheme depends on its type
+        """
         json_message = self.to_json()
-        signature = base64.b64encode(
-            key.sign(json_message.encode("utf-8"), padding.PKCS1v15(), hashes.SHA256())
-        )
+        signer = get_signer(key)
+        signature = base64.b64encode(signer.sign(json_message.encode("utf-8")))
 
         return PaymentRequestEnvelope(
-            message=json_message, signature=signature.decode("utf-8")
+            message=json_message,
+            signature=signature.decode("utf-8"),
+            algorithm=signer.algorithm,
         )
 
     def get_destination(self, crypto: str) -> Optional[Destination]:
-        try:
-            return next(d for d in self.destinations if d.crypto_currency == crypto)
-        except StopIteration:
-            return None
+        return self._get_index().destinations.get(crypto.upper())
 
 
-@attr.s(auto_attribs=True)
+class _CryptoIndex(NamedTuple):
+    destinations_src: List[Destination]
+    cryptos_src: Set[str]
+    #: first destination for each upper case crypto
+    destinations: Dict[str, Destination]
+    #: upper case supported cryptos
+    cryptos: FrozenSet[str]
+
+
+@attr.s(auto_attribs=True, slots=True, frozen=True)
 class PaymentRequestEnvelope(Message):
     """
     Payment Request Envelope
@@ -216,45 +550,67 @@ class PaymentRequestEnvelope(Message):
     Published by :term:`Payment Processor` on
     :ref:`payment_requests/{session_id}`.
 
+    The message is always a JSON string, also when the envelope is
+    MessagePack encoded, so that the signature is computed over the same
+    canonical bytes.
+
+    Envelopes are immutable, the unpacked message is parsed once and
+    cached.
+
     Args:
         message: message as json string
-        signature: PKCS#1 v1.5 signature of the message field
+        signature: base64 signature of the message field
         version: Manta protocol version
+        algorithm: signature scheme, ``RS256`` (PKCS#1 v1.5), ``ES256`` or
+          ``EdDSA``. See :mod:`manta.signing`
     """
 
     message: str
     signature: str
     version: Optional[str] = MANTA_VERSION
+    algorithm: str = DEFAULT_ALGORITHM
+    _unpacked: Optional[PaymentRequestMessage] = attr.ib(
+        default=None, init=False, repr=False, eq=False
+    )
 
     def unpack(self) -> PaymentRequestMessage:
-        pr = PaymentRequestMessage.from_json(self.message)
-        return pr
+        """
+        Return the :class:`PaymentRequestMessage` in the envelope. It's
+        parsed on first call, then the same instance is returned, so it
+        must not be modified.
+        """
+        if self._unpacked is None:
+            # the envelope is frozen
+            object.__setattr__(
+                self, "_unpacked", PaymentRequestMessage.from_json(self.message)
+            )
+        assert self._unpacked is not None
+        return self._unpacked
 
     def verify(self, certificate: Union[str, x509.Certificate]) -> bool:
-        if isinstance(certificate, x509.Certificate):
-            cert = certificate
-        else:
-            if certificate.startswith("-----BEGIN CERTIFICATE-----"):
-                pem = certificate.encode()
-            else:
-                with open(certificate, "rb") as my_file:
-                    pem = my_file.read()
+        """
+        Verify the signature of the message
 
-            cert = x509.load_pem_x509_certificate(pem, default_backend())
+        Args:
+            certificate: certificate of the :term:`Payment Processor`, as
+              object, PEM string or file name. Parsed certificates are kept
+              in :data:`certificate_cache`
+        """
+        verifier = certificate_cache.verifier(certificate)
+        return _verify_signature(verifier, self.message, self.signature, self.algorithm)
 
-        try:
-            cert.public_key().verify(
-                base64.b64decode(self.signature),
-                self.message.encode("utf-8"),
-                padding.PKCS1v15(),
-                hashes.SHA256(),
-            )
-            return True
-        except InvalidSignature:
-            return False
+
+def _verify_signature(
+    verifier: Verifier, message: str, signature: str, algorithm: str
+) -> bool:
+    # the scheme is given by the certificate, the envelope must agree
+    if algorithm != verifier.algorithm:
+        return False
+
+    return verifier.verify(base64.b64decode(signature), message.encode("utf-8"))
 
 
-@attr.s(auto_attribs=True)
+@attr.s(auto_attribs=True, slots=True)
 class PaymentMessage(Message):
     """
     Payment Message
@@ -273,23 +629,242 @@ class PaymentMessage(Message):
     version: Optional[str] = MANTA_VERSION
 
 
-def verify_chain(certificate: Union[str, x509.Certificate], ca: str):
-    if isinstance(certificate, x509.Certificate):
-        pem = certificate.public_bytes(serialization.Encoding.PEM)
-    else:
-        if certificate.startswith("-----BEGIN CERTIFICATE-----"):
-            pem = certificate.encode()
+def _not_valid_after(cert: x509.Certificate) -> datetime:
+    try:
+        return cert.not_valid_after_utc
+    except AttributeError:  # cryptography < 42
+        return cert.not_valid_after.replace(tzinfo=timezone.utc)
+
+
+#: Key of a cached certificate: kind (``fingerprint``, ``pem`` or ``path``),
+#: fingerprint, PEM string or file name, and modification time of the file
+CertificateKey = Tuple[str, Union[bytes, str], int]
+
+
+class CertificateCache:
+    """
+    Bounded cache of parsed certificates, their public keys and validated
+    certification paths
+
+    Certificates given as file name are keyed by path and modification
+    time, PEM strings by their content and certificate objects by their
+    fingerprint. Entries expire together with the certificates they
+    refer to, and the least recently used ones are evicted when the cache
+    is full. Expired certificates are never cached.
+
+    Args:
+        maxsize: maximum number of entries for certificates and for paths
+    """
+
+    maxsize: int
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._certificates: OrderedDict = OrderedDict()
+        self._paths: OrderedDict = OrderedDict()
+
+    def _get(self, entries: OrderedDict, key: Hashable) -> Any:
+        with self._lock:
+            entry = entries.get(key)
+            if entry is None:
+                return None
+
+            expiry, value = entry
+            if expiry <= datetime.now(timezone.utc):
+                del entries[key]
+                return None
+
+            entries.move_to_end(key)
+            return value
+
+    def _put(self, entries: OrderedDict, key: Hashable, expiry: datetime, value: Any):
+        if expiry <= datetime.now(timezone.utc):
+            return
+
+        with self._lock:
+            entries[key] = (expiry, value)
+            entries.move_to_end(key)
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+
+    def _load(
+        self, certificate: Union[str, x509.Certificate]
+    ) -> Tuple[CertificateKey, x509.Certificate, Any, bytes]:
+        key: CertificateKey
+        if isinstance(certificate, x509.Certificate):
+            key = ("fingerprint", certificate.fingerprint(hashes.SHA256()), 0)
+        elif certificate.startswith("-----BEGIN CERTIFICATE-----"):
+            key = ("pem", certificate, 0)
         else:
-            with open(certificate, "rb") as my_file:
-                pem = my_file.read()
-        # cert = x509.load_pem_x509_certificate(pem, default_backend())
+            key = ("path", certificate, os.stat(certificate).st_mtime_ns)
 
-    with open(ca, "rb") as my_file:
-        pem_ca = my_file.read()
-    # ca = x509.load_pem_x509_certificate(pem_ca, default_backend())
+        entry = self._get(self._certificates, key)
+        if entry is not None:
+            return (key,) + entry
 
-    trust_roots = [pem_ca]
-    context = ValidationContext(trust_roots=trust_roots)
+        if isinstance(certificate, x509.Certificate):
+            cert = certificate
+            pem = cert.public_bytes(serialization.Encoding.PEM)
+        else:
+            if key[0] == "pem":
+                pem = certificate.encode()
+            else:
+                with open(certificate, "rb") as my_file:
+                    pem = my_file.read()
+
+            cert = x509.load_pem_x509_certificate(pem, default_backend())
+
+        entry = (cert, cert.public_key(), pem)
+        self._put(self._certificates, key, _not_valid_after(cert), entry)
+        return (key,) + entry
+
+    def load_certificate(
+        self, certificate: Union[str, x509.Certificate]
+    ) -> x509.Certificate:
+        """
+        Return the parsed certificate
+
+        Args:
+            certificate: certificate object, PEM string or file name
+        """
+        return self._load(certificate)[1]
+
+    def public_key(self, certificate: Union[str, x509.Certificate]) -> Any:
+        """
+        Return the public key of the certificate
+
+        Args:
+            certificate: certificate object, PEM string or file name
+        """
+        return self._load(certificate)[2]
+
+    def verifier(self, certificate: Union[str, x509.Certificate]) -> Verifier:
+        """
+        Return the :class:`~.signing.Verifier` for the public key of the
+        certificate
+
+        Args:
+            certificate: certificate object, PEM string or file name
+        """
+        return get_verifier(self.public_key(certificate))
+
+    def verify_chain(self, certificate: Union[str, x509.Certificate], ca: str):
+        """
+        Validate the certification path of ``certificate`` up to ``ca``.
+        Successful validations are cached until one of the two certificates
+        expires.
+
+        Args:
+            certificate: certificate object, PEM string or file name
+            ca: file name of the Certificate Authority certificate
+
+        Returns: the validated path. Raises an exception if not valid
+        """
+        cert_key, cert, public_key, pem = self._load(certificate)
+        ca_key, ca_cert, _, pem_ca = self._load(ca)
+
+        key = (cert_key, ca_key)
+        path = self._get(self._paths, key)
+        if path is not None:
+            return path
+
+        # Envelopes signed with the key must be verifiable
+        get_verifier(public_key)
+
+        context = ValidationContext(trust_roots=[pem_ca])
+        validator = CertificateValidator(pem, validation_context=context)
+        path = validator.validate_usage({"digital_signature"})
+
+        expiry = min(_not_valid_after(cert), _not_valid_after(ca_cert))
+        self._put(self._paths, key, expiry, path)
+        return path
 
-    validator = CertificateValidator(pem, validation_context=context)
-    return validator.validate_usage({"digital_signature"})
+    def public_bytes(self, certificate: Union[str, x509.Certificate]) -> bytes:
+        """
+        Return the certificate PEM encoded
+
+        Args:
+            certificate: certificate object, PEM string or file name
+        """
+        return self._load(certificate)[3]
+
+    def clear(self):
+        with self._lock:
+            self._certificates.clear()
+            self._paths.clear()
+
+
+#: Cache used by :meth:`PaymentRequestEnvelope.verify` and :func:`verify_chain`
+certificate_cache = CertificateCache()
+
+
+def verify_chain(certificate: Union[str, x509.Certificate], ca: str):
+    return certificate_cache.verify_chain(certificate, ca)
+
+
+_worker_verifier: Any = None
+
+
+def _init_verify_worker(pem: bytes):
+    global _worker_verifier
+    cert = x509.load_pem_x509_certificate(pem, default_backend())
+    _worker_verifier = get_verifier(cert.public_key())
+
+
+def _verify_item(verifier: Verifier, item: Tuple[str, str, str]) -> bool:
+    try:
+        return _verify_signature(verifier, *item)
+    except ValueError:  # malformed base64 signature
+        return False
+
+
+def _verify_in_worker(item: Tuple[str, str, str]) -> bool:
+    return _verify_item(_worker_verifier, item)
+
+
+def verify_many(
+    envelopes: Iterable[PaymentRequestEnvelope],
+    certificate: Union[str, x509.Certificate],
+    max_workers: Optional[int] = None,
+    processes: bool = False,
+) -> List[bool]:
+    """
+    Verify the signature of many envelopes in parallel
+
+    The certificate is loaded once. By default the envelopes are verified
+    by a thread pool, which runs in parallel as long as the cryptography
+    backend releases the GIL, otherwise use ``processes`` to verify them
+    in a process pool where each worker loads the public key once.
+
+    Args:
+        envelopes: envelopes to verify
+        certificate: certificate of the :term:`Payment Processor`, as
+          object, PEM string or file name
+        max_workers: number of threads or processes, by default it depends
+          on the number of CPUs
+        processes: use a process pool instead of a thread pool
+
+    Returns: the result of :meth:`PaymentRequestEnvelope.verify` for each
+      envelope, in the same order. Malformed signatures are not valid
+    """
+    items = [
+        (envelope.message, envelope.signature, envelope.algorithm)
+        for envelope in envelopes
+    ]
+
+    if not items:
+        return []
+
+    if processes:
+        pem = certificate_cache.public_bytes(certificate)
+        workers = max_workers or os.cpu_count() or 1
+        chunksize = max(1, len(items) // (workers * 4))
+        with ProcessPoolExecutor(
+            workers, initializer=_init_verify_worker, initargs=(pem,)
+        ) as executor:
+            return list(executor.map(_verify_in_worker, items, chunksize=chunksize))
+
+    verifier = certificate_cache.verifier(certificate)
+    with ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(partial(_verify_item, verifier), items))
@@ -9,23 +9,28 @@ Library that implements a basic a Manta :term:`Payment Processor`.
 """
 
 from abc import abstractmethod
-import base64
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from decimal import Decimal
+from functools import partial
 import logging
+import threading
+import time
 import traceback
-from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set
+import zlib
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
 
 import attr
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
 from cryptography.hazmat.primitives.serialization import load_pem_private_key
 import paho.mqtt.client as mqtt
 
+from . import MANTA_VERSION, messages
+from .admission import AdmissionControl
 from .base import MantaComponent
 from .dispatcher import Dispatcher
+from .lanes import LanePool
 from .messages import (
     PaymentRequestMessage,
     MerchantOrderRequestMessage,
@@ -35,11 +40,28 @@ from .messages import (
     AckMessage,
     Status,
     Merchant,
+    JSONData,
+    BUSY_MEMO,
+    msgpack_available,
+    msgpack_version,
+    supports_msgpack,
 )
+from .signing import Signer, SigningPool, get_signer, sign_message
+from .snapshot import SessionSnapshot, encode_fields, write_snapshot
+from .txid import CounterAllocator, TxidAllocator
 
 
 logger = logging.getLogger(__name__)
 
+"Maximum number of topics subscribed at once when reconnecting"
+SUBSCRIBE_BATCH = 1000
+
+"Topics with the session_id as first argument"
+SESSION_TOPICS = ("payment_requests", "payments", "merchant_order_cancel")
+
+# Locks shared by the sessions, see PayProc.session_lock
+SESSION_LOCKS = 64
+
 
 class Conf(NamedTuple):
     url: str
@@ -52,6 +74,10 @@ class SessionDoesNotExist(Exception):
     pass
 
 
+class TxidInUse(Exception):
+    pass
+
+
 @dataclass()
 class TransactionState:
     # noinspection PyUnresolvedReferences
@@ -67,6 +93,8 @@ class TransactionState:
             payment_message: Last payment message of transaction
             ack: Last ack of transaction
             wallet_request: Last wallet request of transaction
+            wallet_version: Version advertised by the wallet in its last
+              request
             notify: callback to be called when attributes of transaction change
         """
     txid: int
@@ -77,15 +105,18 @@ class TransactionState:
     payment_message: Optional[PaymentMessage] = None
     ack: Optional[AckMessage] = None
     wallet_request: Optional[str] = None
+    wallet_version: Optional[str] = None
 
-    notify: Optional[Callable[[int, str, Any], None]] = None
+    notify: Optional[Callable[[int, str, str, Any], None]] = None
 
     def __setattr__(self, key, value):
-        if callable(self.notify):
-            self.notify(self.txid, key, value)
-
+        # Notify after the change, so a storage saving the state concurrently
+        # never reads the old value after being notified
         super().__setattr__(key, value)
 
+        if callable(self.notify):
+            self.notify(self.txid, self.session_id, key, value)
+
 
 class TXStorage:
     """
@@ -106,7 +137,7 @@ class TXStorage:
         session_id: str,
         application: str,
         order: MerchantOrderRequestMessage,
-        ack: AckMessage = None,
+        ack: Optional[AckMessage] = None,
     ) -> TransactionState:
         """
         Create a new transaction
@@ -120,6 +151,8 @@ class TXStorage:
 
         Returns:
 
+        Raises:
+            TxidInUse: if an open transaction already has the txid
         """
         pass
 
@@ -136,6 +169,19 @@ class TXStorage:
         """
         pass
 
+    @abstractmethod
+    def get_state_for_txid(self, txid: int) -> TransactionState:
+        """
+        Get state for transaction with txid
+
+        Args:
+            txid: txid of transaction
+
+        Returns: state of transaction
+
+        """
+        pass
+
     @abstractmethod
     def session_exists(self, session_id: str) -> bool:
         """
@@ -149,6 +195,30 @@ class TXStorage:
         """
         pass
 
+    def next_txid(self) -> Optional[int]:
+        """
+        Return the txid following the highest one stored, None if the
+        storage doesn't keep them. :class:`PayProc` starts allocating txids
+        from it, so they are not reused after a restart.
+        """
+        return None
+
+    def flush(self):
+        """
+        Save the changes of the states made since the last call. It's
+        called by :class:`PayProc` after handling each message, so that
+        storages can batch the many attribute changes it does. Storages
+        saving each change on notification don't need to implement it.
+        """
+        pass
+
+    def session_ids(self) -> Iterator[str]:
+        """
+        Return the session_id of the open sessions. Storages can implement
+        it without loading the sessions.
+        """
+        return (session_id for session_id, _ in self)
+
     def __iter__(self):
         return self
 
@@ -163,22 +233,78 @@ class TXStorage:
 class TXStorageMemory(TXStorage):
     """
     Implmentation of TXStorage as memory storage
+
+    The sessions can be saved with :meth:`dump` and restored with
+    :meth:`load`. Restored sessions are decoded when first accessed.
     """
 
     states: Dict[str, TransactionState]
+    # txid -> session_id
+    txids: Dict[int, str]
+    snapshot: Optional[SessionSnapshot] = None
 
     def __init__(self):
         self.states = {}
+        self.txids = {}
+        # txids of the snapshot sessions decoded or replaced
+        self._taken: Set[int] = set()
+
+    def load(self, path: str):
+        """
+        Restore the sessions saved by :meth:`dump`. The file is memory
+        mapped and each session is decoded on first access, so it takes
+        the same time whatever the number of sessions.
+
+        Args:
+            path: file name of the snapshot
+        """
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.snapshot = SessionSnapshot(path)
+        self._taken = set()
+
+    def dump(self, path: str):
+        """
+        Save the open sessions in a snapshot. Sessions restored by
+        :meth:`load` and never accessed are copied without decoding them.
+
+        Args:
+            path: file name of the snapshot
+        """
+        def records():
+            for session_id, state in list(self.states.items()):
+                payload = messages.json_backend.dumps(encode_fields(state))
+                yield session_id, state.txid, payload.encode("utf-8")
+
+            if self.snapshot is not None:
+                for i in self.snapshot:
+                    if self.snapshot.txid(i) not in self._taken:
+                        yield self.snapshot.raw(i)
+
+        write_snapshot(path, records())
+
+    def _from_snapshot(self, i: int) -> Optional[TransactionState]:
+        assert self.snapshot is not None
+        if i < 0 or self.snapshot.txid(i) in self._taken:
+            return None
+
+        txid = self.snapshot.txid(i)
+        self._taken.add(txid)
+        state = TransactionState(
+            txid=txid, notify=self._on_notify, **self.snapshot.fields(i)
+        )
+        self.states[state.session_id] = state
+        self.txids[txid] = state.session_id
+        return state
 
-    def _on_notify(self, txid, key, value):
+    def _on_notify(self, txid, session_id, key, value):
         if key == "ack":
             value: AckMessage
             if value.status in [Status.PAID, Status.INVALID]:
-                session_id = next(
-                    key
-                    for key, state in self.states.items()
-                    if state.txid == int(value.txid)
-                )
+                # already removed, or the txid is now of another session
+                if self.txids.get(txid) != session_id:
+                    return
+                del self.txids[txid]
                 del self.states[session_id]
 
     def create(
@@ -187,7 +313,7 @@ class TXStorageMemory(TXStorage):
         session_id: str,
         application: str,
         order: MerchantOrderRequestMessage,
-        ack: AckMessage = None,
+        ack: Optional[AckMessage] = None,
     ) -> TransactionState:
 
         tx = TransactionState(
@@ -199,24 +325,166 @@ class TXStorageMemory(TXStorage):
             notify=self._on_notify,
         )
 
+        if txid in self.txids or (
+            self.snapshot is not None
+            and self.snapshot.find_txid(txid) >= 0
+            and txid not in self._taken
+        ):
+            raise TxidInUse(txid)
+
+        previous = self.states.get(session_id)
+        if previous is not None:
+            del self.txids[previous.txid]
+        elif self.snapshot is not None:
+            i = self.snapshot.find_session(session_id)
+            if i >= 0:
+                self._taken.add(self.snapshot.txid(i))
+
         self.states[session_id] = tx
+        self.txids[txid] = session_id
 
         return tx
 
     def get_state_for_session(self, session_id: str) -> TransactionState:
-        return self.states[session_id]
+        state = self.states.get(session_id)
+        if state is None and self.snapshot is not None:
+            state = self._from_snapshot(self.snapshot.find_session(session_id))
+        if state is None:
+            raise KeyError(session_id)
+        return state
+
+    def get_state_for_txid(self, txid: int) -> TransactionState:
+        session_id = self.txids.get(txid)
+        if session_id is not None:
+            return self.states[session_id]
+
+        state = None
+        if self.snapshot is not None:
+            state = self._from_snapshot(self.snapshot.find_txid(txid))
+        if state is None:
+            raise KeyError(txid)
+        return state
 
     def session_exists(self, session_id: str) -> bool:
-        return session_id in self.states
+        if session_id in self.states:
+            return True
+        if self.snapshot is None:
+            return False
+        i = self.snapshot.find_session(session_id)
+        return i >= 0 and self.snapshot.txid(i) not in self._taken
+
+    def session_ids(self) -> Iterator[str]:
+        yield from list(self.states)
+        if self.snapshot is not None:
+            for i in self.snapshot:
+                if self.snapshot.txid(i) not in self._taken:
+                    yield self.snapshot.session_id(i)
 
     def __iter__(self):
+        if self.snapshot is not None:
+            for i in self.snapshot:
+                self._from_snapshot(i)
         return iter(self.states.items())
 
     def __len__(self):
-        return len(self.states)
+        if self.snapshot is None:
+            return len(self.states)
+        # _taken also counts the decoded sessions, already in states
+        return len(self.states) + len(self.snapshot) - len(self._taken)
+
+
+class EnvelopeCache:
+    """
+    Cache of the signed :class:`~.messages.PaymentRequestEnvelope` of
+    each session, by requested crypto currency
+
+    Args:
+        ttl: seconds after which an envelope expires
+        maxsize: maximum number of envelopes, least recently used are
+          evicted first
+    """
+
+    ttl: float
+    maxsize: int
+    envelopes: "OrderedDict[Tuple[str, str], Tuple[float, PaymentRequestEnvelope]]"
+
+    def __init__(self, ttl: float, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.envelopes = OrderedDict()
+        self._sessions: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str, crypto_currency: str) -> Optional[PaymentRequestEnvelope]:
+        key = (session_id, crypto_currency)
+        with self._lock:
+            entry = self.envelopes.get(key)
+            if entry is None:
+                return None
+
+            expiry, envelope = entry
+            if expiry <= time.monotonic():
+                self._remove(key)
+                return None
+
+            self.envelopes.move_to_end(key)
+            return envelope
+
+    def put(self, session_id: str, crypto_currency: str, envelope: PaymentRequestEnvelope):
+        key = (session_id, crypto_currency)
+        with self._lock:
+            self.envelopes[key] = (time.monotonic() + self.ttl, envelope)
+            self.envelopes.move_to_end(key)
+            self._sessions.setdefault(session_id, set()).add(crypto_currency)
+
+            while len(self.envelopes) > self.maxsize:
+                self._remove(next(iter(self.envelopes)))
+
+    def invalidate(self, session_id: str):
+        """Remove all the envelopes of a session"""
+        with self._lock:
+            for crypto_currency in self._sessions.pop(session_id, ()):
+                del self.envelopes[(session_id, crypto_currency)]
+
+    def _remove(self, key: Tuple[str, str]):
+        del self.envelopes[key]
+        session_id, crypto_currency = key
+        cryptos = self._sessions[session_id]
+        cryptos.discard(crypto_currency)
+        if not cryptos:
+            del self._sessions[session_id]
+
+    def __len__(self):
+        return len(self.envelopes)
+
 
+def session_owner(session_id: str, workers: int) -> int:
+    """
+    Return the index of the PayProc worker owning a session
+
+    Args:
+        session_id: :term:`session_id` of the session
+        workers: number of workers
+    """
+    return zlib.crc32(session_id.encode("utf-8")) % workers
 
-def generate_crypto_legacy_url(crypto: str, address: str, amount: float) -> str:
+
+def worker_topic(group: str, worker_index: int, application_id: str) -> str:
+    """Topic where orders are forwarded to the worker owning them"""
+    return "payproc_workers/{}/{}/merchant_order_request/{}".format(
+        group, worker_index, application_id
+    )
+
+
+def is_manta_order(order: MerchantOrderRequestMessage) -> bool:
+    """
+    Check if an order is paid through the Manta protocol, ie it doesn't
+    specify a crypto currency
+    """
+    return order.crypto_currency is None or order.crypto_currency == ""
+
+
+def generate_crypto_legacy_url(crypto: str, address: str, amount: Decimal) -> str:
     if crypto == "btc":
         return "bitcoin:{}?amount={}".format(address, amount)
 
@@ -234,12 +502,62 @@ class PayProc(MantaComponent):
             certificate: File name of Manta Certificate Authority, IE Appia
             host: MQTT Broker host
             starting_txid: Transaction ID are progressive, starting from the
-              one specified
+              one specified, or from the one following the highest txid in
+              ``tx_storage`` if greater
             tx_storage: TXStorage instance to store session information
             mqtt_options: A Dict of options to be passed to MQTT Client (like
               username, password)
             port: MQTT Broker port number. Specified only if it's different
               than the default of 1883
+            msgpack: Enable MessagePack encoding with the peers advertising
+              it in the version field. Requires the *msgpack* package
+            signing_workers: Number of workers signing the payment requests
+              outside of the MQTT network thread. If 0 they are signed
+              synchronously
+            signing_processes: Use processes instead of threads as signing
+              workers
+            payment_request_cache_ttl: If not 0, the signed payment requests
+              are cached and sent again to wallets repeating the request
+              for this number of seconds, or until the session state
+              changes
+            presign_workers: If not 0, the *all* payment request of each new
+              session is built and signed in advance by this number of
+              background threads, so the first request of the wallet is
+              answered immediately. Merchant callbacks are then called
+              from these threads
+            retain_payment_requests: Publish the signed *all* payment request
+              of each new session as a retained message on
+              ``payment_requests/{session_id}`` as soon as it is ready,
+              so wallets get it on subscription. The message is cleared
+              when the session is paid or invalidated
+            workers: Number of PayProc workers sharing the load. Orders are
+              received through an MQTT shared subscription and each session
+              is handled by the worker given by :func:`session_owner`
+            worker_index: Index of this worker, from 0 to ``workers - 1``.
+              Without a ``txid_allocator`` its txids are ``worker_index``
+              modulo ``workers``
+            share_group: Name of the shared subscription group of the workers
+            txid_allocator: Source of the txids, ie a
+              :class:`~.txid.BlockAllocator` shared by the processes of a
+              host. By default txids start from ``starting_txid`` and are
+              lost on restart
+            dispatch_workers: If not 0, the messages are handled by this
+              number of threads instead of the MQTT network thread. The
+              messages of a session are always handled in order, by the
+              thread its session_id is hashed to (see
+              :class:`~.lanes.LanePool`)
+            dispatch_queue_size: Maximum number of messages queued for each
+              dispatch thread. When full, the network thread waits
+            order_rate: If not 0, orders per second accepted from each
+              :term:`POS`. The other orders are rejected with an INVALID
+              ack with memo ``busy``
+            order_burst: Orders accepted at once from each :term:`POS`, by
+              default one second of ``order_rate``
+            max_orders_in_flight: If not 0, maximum number of orders
+              waiting to be processed, ie queued for the dispatch threads.
+              The other orders are rejected like for ``order_rate``.
+              Requires ``dispatch_workers``, otherwise the orders are
+              processed one at a time by the network thread
 
         Attributes:
             get_destinations: Callback function to retrieve list of Destination
@@ -247,7 +565,8 @@ class PayProc(MantaComponent):
               supported cryptos
         """
 
-    key: RSAPrivateKey
+    key: Any
+    signer: Signer
     certificate: str
 
     # str is txid
@@ -269,7 +588,21 @@ class PayProc(MantaComponent):
 
     tx_storage: TXStorage
     dispatcher: Dispatcher
-    txid: int
+    msgpack: bool
+    signing_pool: Optional[SigningPool] = None
+    envelope_cache: Optional[EnvelopeCache] = None
+    presign_executor: Optional[ThreadPoolExecutor] = None
+    # session_id -> future of the presigned "all" envelope
+    presigned: Dict[str, "Future[PaymentRequestEnvelope]"]
+    retain_payment_requests: bool
+    workers: int
+    worker_index: int
+    share_group: str
+    txid_allocator: TxidAllocator
+    dispatch_pool: Optional[LanePool] = None
+    admission: Optional[AdmissionControl] = None
+    # True if orders are processed concurrently without dispatch_workers
+    concurrent_orders: bool = False
 
     def __init__(
         self,
@@ -280,10 +613,47 @@ class PayProc(MantaComponent):
         tx_storage: TXStorage = None,
         mqtt_options: Dict[str, Any] = None,
         port: int = 1883,
+        msgpack: bool = False,
+        signing_workers: int = 0,
+        signing_processes: bool = False,
+        payment_request_cache_ttl: float = 0,
+        presign_workers: int = 0,
+        retain_payment_requests: bool = False,
+        workers: int = 1,
+        worker_index: int = 0,
+        share_group: str = "payproc",
+        txid_allocator: Optional[TxidAllocator] = None,
+        dispatch_workers: int = 0,
+        dispatch_queue_size: int = 1000,
+        order_rate: float = 0,
+        order_burst: float = 0,
+        max_orders_in_flight: int = 0,
     ) -> None:
 
-        self.txid = starting_txid
+        if msgpack and not msgpack_available():
+            raise RuntimeError("msgpack package is required for msgpack encoding")
+
+        if not 0 <= worker_index < workers:
+            raise ValueError("worker_index must be between 0 and workers - 1")
+
+        if max_orders_in_flight > 0 and dispatch_workers == 0 and not self.concurrent_orders:
+            raise ValueError("max_orders_in_flight requires dispatch_workers")
+
+        self.msgpack = msgpack
+        self.retain_payment_requests = retain_payment_requests
+        self.workers = workers
+        self.worker_index = worker_index
+        self.share_group = share_group
         self.tx_storage = tx_storage if tx_storage is not None else TXStorageMemory()
+        if txid_allocator is None:
+            # txids of the previous runs must not be reused
+            stored = self.tx_storage.next_txid()
+            if stored is not None:
+                starting_txid = max(starting_txid, stored)
+            # first txid of this worker
+            start = starting_txid + (worker_index - starting_txid) % workers
+            txid_allocator = CounterAllocator(start, step=workers)
+        self.txid_allocator = txid_allocator
         self.dispatcher = Dispatcher(self)
         mqtt_options = mqtt_options if mqtt_options else {}
         self.mqtt_client = mqtt.Client(**mqtt_options)
@@ -297,6 +667,32 @@ class PayProc(MantaComponent):
             key_data = myfile.read()
 
         self.key = PayProc.key_from_keydata(key_data)
+        self.signer = get_signer(self.key)
+
+        if payment_request_cache_ttl > 0:
+            self.envelope_cache = EnvelopeCache(payment_request_cache_ttl)
+
+        self._session_locks = [threading.RLock() for _ in range(SESSION_LOCKS)]
+        self.presigned = {}
+        # presigned is changed by the network, dispatch and presign threads
+        self._presigned_lock = threading.Lock()
+        if presign_workers > 0:
+            self.presign_executor = ThreadPoolExecutor(
+                max_workers=presign_workers, thread_name_prefix="presign"
+            )
+
+        if dispatch_workers > 0:
+            self.dispatch_pool = LanePool(dispatch_workers, queue_size=dispatch_queue_size)
+
+        if order_rate > 0 or max_orders_in_flight > 0:
+            self.admission = AdmissionControl(
+                rate=order_rate, burst=order_burst, max_in_flight=max_orders_in_flight
+            )
+
+        if signing_workers > 0:
+            self.signing_pool = SigningPool(
+                key_data, workers=signing_workers, processes=signing_processes
+            )
 
         if cert_file is not None:
             with open(cert_file, "r") as cfile:
@@ -336,8 +732,40 @@ class PayProc(MantaComponent):
         self.mqtt_client.connect(host=self.host, port=self.port)
         self.mqtt_client.loop_start()
 
+    @property
+    def txid(self) -> Optional[int]:
+        """
+        txid of the next session, None if :attr:`txid_allocator` doesn't
+        know it in advance. Read only, kept for compatibility.
+        """
+        return self.txid_allocator.peek()
+
+    def session_lock(self, session_id: str) -> threading.RLock:
+        """
+        Return the lock guarding the state of a session. The state is
+        changed by the network thread, the dispatch and signing workers and
+        the merchant calling :meth:`confirm` or :meth:`invalidate`.
+
+        Args:
+            session_id: :term:`session_id` of the session
+        """
+        return self._session_locks[session_owner(session_id, SESSION_LOCKS)]
+
+    def close(self):
+        """
+        Stop the dispatch, presign and signing workers, after the work
+        already queued. Call it after stopping the :term:`MQTT` client.
+        """
+        # Handlers and presigning submit to the signing pool, stop it last
+        if self.dispatch_pool is not None:
+            self.dispatch_pool.shutdown()
+        if self.presign_executor is not None:
+            self.presign_executor.shutdown()
+        if self.signing_pool is not None:
+            self.signing_pool.shutdown()
+
     @staticmethod
-    def key_from_keydata(key_data: bytes) -> RSAPrivateKey:
+    def key_from_keydata(key_data: bytes) -> Any:
         """
         Given a string containing the key encoded in PEM format, loads it.
 
@@ -366,20 +794,32 @@ class PayProc(MantaComponent):
         #                      ),
         #                      hashes.SHA256())
 
-        signature = self.key.sign(message, padding.PKCS1v15(), hashes.SHA256())
-
-        return base64.b64encode(signature)
+        return sign_message(self.signer, message)
 
     # noinspection PyUnusedLocal,PyMethodMayBeStatic
     def on_connect(self, client, userdata, flags, rc):
         logger.info("Connected with result code " + str(rc))
 
-        self._subscribe("merchant_order_request/+")
+        if self.workers > 1:
+            self._subscribe("$share/{}/merchant_order_request/+".format(self.share_group))
+            self._subscribe(worker_topic(self.share_group, self.worker_index, "+"))
+        else:
+            self._subscribe("merchant_order_request/+")
+        # Only the owner has the session
         self._subscribe("merchant_order_cancel/+")
 
-        for session, value in self.tx_storage:
-            self._subscribe("payment_requests/{}/+".format(session))
-            self._subscribe("payments/{}".format(session))
+        # Many topics in each SUBSCRIBE, sessions are not loaded
+        topics = []
+        for session in self.tx_storage.session_ids():
+            topics.append(("payment_requests/{}/+".format(session), 0))
+            topics.append(("payments/{}".format(session), 0))
+
+            if len(topics) >= SUBSCRIBE_BATCH:
+                self.mqtt_client.subscribe(topics)
+                topics = []
+
+        if topics:
+            self.mqtt_client.subscribe(topics)
 
         self.mqtt_client.publish("certificate", self.certificate, retain=True)
 
@@ -394,53 +834,176 @@ class PayProc(MantaComponent):
         self.invalidate(session_id, "Canceled by Merchant")
 
     @Dispatcher.method_topic("merchant_order_request/+")
-    def on_merchant_order_request(self, application_id, payload):
+    def on_merchant_order_request(self, application_id: str, payload: JSONData):
 
         logger.info("Processing merchant_order message")
 
-        p = MerchantOrderRequestMessage.from_json(payload)
+        p = MerchantOrderRequestMessage.decode(payload)
 
-        ack: AckMessage
+        if not self.forward_order(application_id, p, payload):
+            self.submit_order(application_id, p)
 
-        # This is a manta request
-        if p.crypto_currency is None or p.crypto_currency == "":
+    def forward_order(
+        self, application_id: str, p: MerchantOrderRequestMessage, payload: JSONData
+    ) -> bool:
+        """
+        Forward a merchant order to the worker owning its session, if it's
+        not this one.
 
-            self.mqtt_client.subscribe("payment_requests/{}/+".format(p.session_id))
-            self.mqtt_client.subscribe("payments/{}".format(p.session_id))
+        Args:
+            application_id: :term:`application_id` of the :term:`POS`
+            p: the merchant order
+            payload: the order as received
+        Returns:
+            True if the order was forwarded
+        """
+        if self.workers == 1:
+            return False
 
-            ack = AckMessage(
-                status=Status.NEW,
-                url="manta://{}{}/{}".format(
-                    self.host,
-                    ":" + str(self.port) if self.port != 1883 else "",
-                    p.session_id,
-                ),
-                txid=str(self.txid),
-            )
+        owner = session_owner(p.session_id, self.workers)
+        if owner == self.worker_index:
+            return False
 
-            self.ack(p.session_id, ack)
+        logger.debug("Forwarding order %r to worker %d", p.session_id, owner)
+        if isinstance(payload, memoryview):
+            payload = payload.tobytes()
+        self.mqtt_client.publish(
+            worker_topic(self.share_group, owner, application_id), payload
+        )
+        return True
 
-            self.tx_storage.create(self.txid, p.session_id, application_id, p, ack)
+    # noinspection PyUnusedLocal
+    @Dispatcher.method_topic("payproc_workers/+/+/merchant_order_request/+")
+    def on_forwarded_order(
+        self, group: str, worker_index: str, application_id: str, payload: JSONData
+    ):
+        logger.info("Processing forwarded merchant_order message")
+        self.submit_order(application_id, MerchantOrderRequestMessage.decode(payload))
 
-            self.txid = self.txid + 1
+    def submit_order(self, application_id: str, p: MerchantOrderRequestMessage):
+        """
+        Process a merchant order if admitted, in the dispatch thread of its
+        session if there is a :attr:`dispatch_pool`
 
+        Args:
+            application_id: :term:`application_id` of the :term:`POS`
+            p: the merchant order
+        """
+        if not self.admit_order(application_id, p):
+            return
+
+        if self.dispatch_pool is None:
+            self._process_admitted_order(application_id, p)
         else:
-            destinations = self.get_destinations(application_id, p)
-            d = destinations[0]
-
-            ack = AckMessage(
-                txid=str(self.txid),
-                status=Status.NEW,
-                url=generate_crypto_legacy_url(
-                    d.crypto_currency, d.destination_address, Decimal(d.amount)
-                ),
+            self.dispatch_pool.submit(
+                p.session_id,
+                self._run_handler,
+                partial(self._process_admitted_order, application_id, p),
             )
 
-            self.ack(p.session_id, ack)
+    def admit_order(self, application_id: str, p: MerchantOrderRequestMessage) -> bool:
+        """
+        Check the admission of a merchant order. Rejected orders get at once
+        an INVALID ack with memo ``busy``. Admitted orders must be released
+        from :attr:`admission` once processed.
 
-            self.tx_storage.create(self.txid, p.session_id, application_id, p, ack),
+        Args:
+            application_id: :term:`application_id` of the :term:`POS`
+            p: the merchant order
+        Returns:
+            True if the order is admitted
+        """
+        if self.admission is None or self.admission.admit(application_id):
+            return True
 
-            self.txid = self.txid + 1
+        logger.warning("Rejecting order %r of %r, busy", p.session_id, application_id)
+        # No session is created, so there is no txid
+        ack = AckMessage(txid="", status=Status.INVALID, memo=BUSY_MEMO)
+        self.ack(p.session_id, ack, binary=self.msgpack and supports_msgpack(p.version))
+        return False
+
+    def _process_admitted_order(self, application_id: str, p: MerchantOrderRequestMessage):
+        try:
+            self.process_order(application_id, p)
+        finally:
+            if self.admission is not None:
+                self.admission.release()
+
+    def process_order(self, application_id: str, p: MerchantOrderRequestMessage):
+        """
+        Create a new session for a merchant order and publish its first ack
+
+        Args:
+            application_id: :term:`application_id` of the :term:`POS`
+            p: the merchant order
+        """
+        # Legacy orders get the destination for the url of the ack
+        destinations = None if is_manta_order(p) else self.get_destinations(application_id, p)
+        self.create_session(application_id, p, destinations)
+
+    def create_session(
+        self,
+        application_id: str,
+        p: MerchantOrderRequestMessage,
+        destinations: Optional[List[Destination]] = None,
+    ):
+        """
+        Store a new session and publish its first ack
+
+        Args:
+            application_id: :term:`application_id` of the :term:`POS`
+            p: the merchant order
+            destinations: destinations of a legacy order, None for a manta
+              order
+        """
+        with self.session_lock(p.session_id):
+            binary = self.msgpack and supports_msgpack(p.version)
+            txid = self.txid_allocator.next()
+
+            ack: AckMessage
+
+            # This is a manta request
+            if destinations is None:
+
+                self.mqtt_client.subscribe("payment_requests/{}/+".format(p.session_id))
+                self.mqtt_client.subscribe("payments/{}".format(p.session_id))
+
+                ack = AckMessage(
+                    status=Status.NEW,
+                    url="manta://{}{}/{}".format(
+                        self.host,
+                        ":" + str(self.port) if self.port != 1883 else "",
+                        p.session_id,
+                    ),
+                    txid=str(txid),
+                )
+
+                # stored first, create raises if the txid is in use
+                self.tx_storage.create(txid, p.session_id, application_id, p, ack)
+
+                self.ack(p.session_id, ack, binary=binary)
+
+                if self.presign_executor is not None:
+                    self.presign(application_id, p)
+
+                if self.retain_payment_requests:
+                    self.retain_payment_request(application_id, p)
+
+            else:
+                d = destinations[0]
+
+                ack = AckMessage(
+                    txid=str(txid),
+                    status=Status.NEW,
+                    url=generate_crypto_legacy_url(
+                        d.crypto_currency, d.destination_address, Decimal(d.amount)
+                    ),
+                )
+
+                # stored first, create raises if the txid is in use
+                self.tx_storage.create(txid, p.session_id, application_id, p, ack)
+
+                self.ack(p.session_id, ack, binary=binary)
 
         if callable(self.on_processed_order):
             self.on_processed_order(ack.txid, p, ack)
@@ -448,13 +1011,46 @@ class PayProc(MantaComponent):
     # noinspection PyUnusedLocal
     @Dispatcher.method_topic("payment_requests/+/+")
     def on_get_payment_request(
-        self, session_id: str, crypto_currency: str, payload: str
+        self, session_id: str, crypto_currency: str, payload: JSONData
     ):
         logger.info("Processing payment request message")
 
+        with self.session_lock(session_id):
+            pending = self._start_payment_request(session_id, crypto_currency, payload)
+        if pending is None:
+            return
+
+        application, request = pending
+        future = self._take_presigned(session_id, crypto_currency)
+
+        if future is None:
+            future = self.generate_payment_request_async(application, request)
+
+        if future.done():
+            self._publish_payment_request(session_id, crypto_currency, future.result())
+        else:
+            future.add_done_callback(
+                partial(self._on_payment_request_signed, session_id, crypto_currency)
+            )
+
+    def _start_payment_request(
+        self, session_id: str, crypto_currency: str, payload: JSONData
+    ) -> Optional[Tuple[str, MerchantOrderRequestMessage]]:
+        # Return application and request to sign, None if answered from the cache
         state: TransactionState = self.tx_storage.get_state_for_session(session_id)
 
         state.wallet_request = crypto_currency
+        # Wallets advertise their version in the request payload
+        state.wallet_version = (
+            payload if isinstance(payload, str) else str(payload, "utf-8")
+        )
+
+        if self.envelope_cache is not None:
+            envelope = self.envelope_cache.get(session_id, crypto_currency)
+            if envelope is not None:
+                logger.info("Using cached payment request for %r", session_id)
+                self._publish_payment_request(session_id, crypto_currency, envelope)
+                return None
 
         request = MerchantOrderRequestMessage(
             fiat_currency=state.order.fiat_currency,
@@ -462,76 +1058,243 @@ class PayProc(MantaComponent):
             session_id=session_id,
             crypto_currency=None if crypto_currency == "all" else crypto_currency,
         )
-        application = state.application
+        return state.application, request
 
-        envelope = self.generate_payment_request(application, request)
-        state.payment_request = envelope.unpack()
+    def _take_presigned(self, session_id: str, crypto_currency: str) -> Optional[Future]:
+        if crypto_currency != "all":
+            return None
 
-        logger.info("Publishing {}".format(envelope))
-        self.mqtt_client.publish(
-            "payment_requests/{}".format(session_id), envelope.to_json()
+        with self._presigned_lock:
+            future = self.presigned.pop(session_id, None)
+        if future is not None and future.done() and future.exception() is not None:
+            # Presigning failed, try again
+            return None
+        return future
+
+    def presign(self, application_id: str, order: MerchantOrderRequestMessage):
+        """
+        Build and sign in background the *all* payment request of a new
+        session, signed by the :attr:`signing_pool` if any. It will be used
+        for the first request of the wallet, unless the session state
+        changes before.
+
+        Args:
+            application_id: :term:`application_id` of the :term:`POS`
+            order: merchant order of the session
+        """
+        assert self.presign_executor is not None
+
+        request = MerchantOrderRequestMessage(
+            fiat_currency=order.fiat_currency,
+            amount=order.amount,
+            session_id=order.session_id,
+        )
+        future = self.presign_executor.submit(
+            self._presign_payment_request, application_id, request
         )
+        with self._presigned_lock:
+            self.presigned[order.session_id] = future
 
-        if callable(self.on_processed_get_payment):
-            assert state.ack is not None
-            self.on_processed_get_payment(
-                state.ack.txid, crypto_currency, envelope.unpack()
+    def _presign_payment_request(
+        self, application_id: str, request: MerchantOrderRequestMessage
+    ) -> PaymentRequestEnvelope:
+        # the presign thread waits for the signing pool
+        return self.generate_payment_request_async(application_id, request).result()
+
+    def retain_payment_request(
+        self, application_id: str, order: MerchantOrderRequestMessage
+    ):
+        """
+        Publish the *all* payment request of a new session as a retained
+        message. The presigned envelope is used if available.
+
+        Args:
+            application_id: :term:`application_id` of the :term:`POS`
+            order: merchant order of the session
+        """
+        with self._presigned_lock:
+            future = self.presigned.get(order.session_id)
+
+        if future is None:
+            request = MerchantOrderRequestMessage(
+                fiat_currency=order.fiat_currency,
+                amount=order.amount,
+                session_id=order.session_id,
             )
+            future = self.generate_payment_request_async(application_id, request)
 
-    @Dispatcher.method_topic("payments/+")
-    def on_payment(self, session_id: str, payload: str):
+        future.add_done_callback(partial(self._on_retained_signed, order.session_id))
 
-        if self.tx_storage.session_exists(session_id):
-            payment_message = PaymentMessage.from_json(payload)
+    def _on_retained_signed(
+        self, session_id: str, future: "Future[PaymentRequestEnvelope]"
+    ):
+        try:
+            envelope = future.result()
+        except Exception:
+            logger.exception("Error signing retained payment request for %r", session_id)
+            return
+
+        with self.session_lock(session_id):
+            if not self.tx_storage.session_exists(session_id):
+                return
 
             state = self.tx_storage.get_state_for_session(session_id)
+            if state.ack is None or state.ack.status != Status.NEW:
+                # Wallet already paid or session invalidated
+                return
+
+            # Wallets may pay before their own request is answered
+            if state.payment_request is None:
+                state.payment_request = envelope.unpack()
+                self.tx_storage.flush()
+
+            # Retained messages are read by any wallet, keep them JSON
+            self.mqtt_client.publish(
+                "payment_requests/{}".format(session_id), envelope.encode(), retain=True
+            )
+
+    def clear_retained_payment_request(self, session_id: str):
+        """
+        Clear the retained payment request of a session.
+
+        Args:
+            session_id: session to clear
+        """
+        self.mqtt_client.publish(
+            "payment_requests/{}".format(session_id), b"", retain=True
+        )
 
-            # check if crypto is one of the supported
-            payment_request = state.payment_request
+    def _on_payment_request_signed(
+        self, session_id: str, crypto_currency: str, future: "Future[PaymentRequestEnvelope]"
+    ):
+        try:
+            self._publish_payment_request(session_id, crypto_currency, future.result())
+        except Exception:
+            logger.exception("Error publishing payment request for %r", session_id)
 
-            assert payment_request is not None
-            if payment_message.crypto_currency.upper() not in [
-                x.upper() for x in payment_request.supported_cryptos
-            ]:
+    def _publish_payment_request(
+        self, session_id: str, crypto_currency: str, envelope: PaymentRequestEnvelope
+    ):
+        # Called by the signing threads too
+        with self.session_lock(session_id):
+            if not self.tx_storage.session_exists(session_id):
+                # session completed while signing
                 return
 
-            new_ack = attr.evolve(
-                state.ack,
-                status=Status.PENDING,
-                transaction_hash=payment_message.transaction_hash,
-                transaction_currency=payment_message.crypto_currency,
-                url=None,
+            state = self.tx_storage.get_state_for_session(session_id)
+            payment_request = envelope.unpack()
+            state.payment_request = payment_request
+
+            if self.envelope_cache is not None:
+                self.envelope_cache.put(session_id, crypto_currency, envelope)
+
+            # may be called by a signing thread, after the message handling
+            self.tx_storage.flush()
+
+            logger.debug("Publishing %s", envelope)
+            self.mqtt_client.publish(
+                "payment_requests/{}".format(session_id),
+                envelope.encode(self.msgpack and supports_msgpack(state.wallet_version)),
             )
-            assert new_ack is not None
 
-            state.payment_message = payment_message
-            state.ack = new_ack
+            if callable(self.on_processed_get_payment):
+                assert state.ack is not None
+                self.on_processed_get_payment(
+                    state.ack.txid, crypto_currency, payment_request
+                )
+
+    @Dispatcher.method_topic("payments/+")
+    def on_payment(self, session_id: str, payload: JSONData):
+
+        with self.session_lock(session_id):
+            if self.tx_storage.session_exists(session_id):
+                payment_message = PaymentMessage.decode(payload)
 
-            self.ack(session_id, new_ack)
+                state = self.tx_storage.get_state_for_session(session_id)
 
-            if callable(self.on_processed_payment):
-                self.on_processed_payment(state.ack.txid, payment_message, new_ack)
+                if state.wallet_version is None:
+                    # Wallet used the retained payment request
+                    state.wallet_version = payment_message.version
+
+                # check if crypto is one of the supported
+                payment_request = state.payment_request
+
+                assert payment_request is not None
+                if not payment_request.is_supported(payment_message.crypto_currency):
+                    return
+
+                new_ack = attr.evolve(
+                    state.ack,
+                    status=Status.PENDING,
+                    transaction_hash=payment_message.transaction_hash,
+                    transaction_currency=payment_message.crypto_currency,
+                    url=None,
+                )
+                assert new_ack is not None
+
+                binary = self.binary_acks(state)
+                state.payment_message = payment_message
+                state.ack = new_ack
+
+                self.ack(session_id, new_ack, binary=binary)
+
+                if callable(self.on_processed_payment):
+                    self.on_processed_payment(state.ack.txid, payment_message, new_ack)
 
     # noinspection PyUnusedLocal
     def on_message(self, client: mqtt.Client, userdata, msg):
-        logger.info("New Message {} on {}".format(msg.payload, msg.topic))
+        logger.info("New Message on %s", msg.topic)
+        logger.debug("Payload %r", msg.payload)
 
+        handler = partial(self.dispatcher.dispatch, msg.topic, payload=msg.payload)
+        tokens = msg.topic.split("/")
+
+        # Orders are decoded here to find their session, see submit_order
+        if self.dispatch_pool is None or tokens[0] not in SESSION_TOPICS:
+            self._run_handler(handler)
+        else:
+            self.dispatch_pool.submit(tokens[1], self._run_handler, handler)
+
+    def _run_handler(self, handler: Callable[[], Any]):
         try:
-            self.dispatcher.dispatch(msg.topic, payload=msg.payload)
+            handler()
         except Exception as e:
             logger.error(e)
             traceback.print_exc()
+        finally:
+            self.tx_storage.flush()
 
-    def ack(self, session_id: str, ack: AckMessage):
+    def binary_acks(self, state: TransactionState) -> bool:
+        """
+        Check if the acks of a session can be MessagePack encoded, ie the
+        :term:`Merchant` and the :term:`Wallet` (if any) both advertised it.
+
+        Args:
+            state: state of the session
+        """
+        return (
+            self.msgpack
+            and supports_msgpack(state.order.version)
+            and (state.wallet_version is None or supports_msgpack(state.wallet_version))
+        )
+
+    def ack(self, session_id: str, ack: AckMessage, binary: bool = False):
         """
         Publish the given :class:`~.messages.AckMessage`.
 
         Args:
             session_id: id of the session where to send the messages
+            binary: encode the message as MessagePack
         """
         logger.info("Publishing ack for {} as {}".format(session_id, ack.status.value))
 
-        self.mqtt_client.publish("acks/{}".format(session_id), ack.to_json())
+        # Payment requests are signed for the previous state
+        if self.envelope_cache is not None:
+            self.envelope_cache.invalidate(session_id)
+        with self._presigned_lock:
+            self.presigned.pop(session_id, None)
+
+        self.mqtt_client.publish("acks/{}".format(session_id), ack.encode(binary))
 
     def confirming(self, session_id: str):
         """
@@ -542,13 +1305,16 @@ class PayProc(MantaComponent):
         Args:
             session_id: session to change
         """
-        if self.tx_storage.session_exists(session_id):
-            state = self.tx_storage.get_state_for_session(session_id)
+        with self.session_lock(session_id):
+            if self.tx_storage.session_exists(session_id):
+                state = self.tx_storage.get_state_for_session(session_id)
 
-            new_ack = attr.evolve(state.ack, status=Status.CONFIRMING)
-            assert new_ack is not None
-            state.ack = new_ack
-            self.ack(session_id, new_ack)
+                new_ack = attr.evolve(state.ack, status=Status.CONFIRMING)
+                assert new_ack is not None
+                binary = self.binary_acks(state)
+                state.ack = new_ack
+                self.ack(session_id, new_ack, binary=binary)
+                self.tx_storage.flush()
 
     def confirm(
         self,
@@ -564,25 +1330,31 @@ class PayProc(MantaComponent):
         Args:
             session_id: session to change
         """
-        if self.tx_storage.session_exists(session_id):
-            state = self.tx_storage.get_state_for_session(session_id)
+        with self.session_lock(session_id):
+            if self.tx_storage.session_exists(session_id):
+                state = self.tx_storage.get_state_for_session(session_id)
+
+                new_ack = attr.evolve(state.ack, status=Status.PAID)
+                assert new_ack is not None
 
-            new_ack = attr.evolve(state.ack, status=Status.PAID)
-            assert new_ack is not None
+                new_ack.url = None
 
-            new_ack.url = None
+                if transaction_hash:
+                    new_ack.transaction_hash = transaction_hash
 
-            if transaction_hash:
-                new_ack.transaction_hash = transaction_hash
+                if transaction_currency:
+                    new_ack.transaction_currency = transaction_currency
 
-            if transaction_currency:
-                new_ack.transaction_currency = transaction_currency
+                binary = self.binary_acks(state)
+                state.ack = new_ack
+                self.ack(session_id, new_ack, binary=binary)
+                self.tx_storage.flush()
 
-            state.ack = new_ack
-            self.ack(session_id, new_ack)
+                if self.retain_payment_requests:
+                    self.clear_retained_payment_request(session_id)
 
-            if callable(self.on_processed_confirmation):
-                self.on_processed_confirmation(state.ack.txid, new_ack)
+                if callable(self.on_processed_confirmation):
+                    self.on_processed_confirmation(state.ack.txid, new_ack)
 
     def invalidate(self, session_id: str, reason: str = ""):
         """
@@ -594,14 +1366,20 @@ class PayProc(MantaComponent):
             session_id: session to change
             reason: reason for INVALID status (ex. 'Timeout')
         """
-        if self.tx_storage.session_exists(session_id):
-            state = self.tx_storage.get_state_for_session(session_id)
+        with self.session_lock(session_id):
+            if self.tx_storage.session_exists(session_id):
+                state = self.tx_storage.get_state_for_session(session_id)
 
-            new_ack = attr.evolve(state.ack, status=Status.INVALID, memo=reason)
-            assert new_ack is not None
+                new_ack = attr.evolve(state.ack, status=Status.INVALID, memo=reason)
+                assert new_ack is not None
 
-            state.ack = new_ack
-            self.ack(session_id, new_ack)
+                binary = self.binary_acks(state)
+                state.ack = new_ack
+                self.ack(session_id, new_ack, binary=binary)
+                self.tx_storage.flush()
+
+                if self.retain_payment_requests:
+                    self.clear_retained_payment_request(session_id)
 
     def generate_payment_request(
         self, device: str, merchant_request: MerchantOrderRequestMessage
@@ -616,10 +1394,62 @@ class PayProc(MantaComponent):
         Returns:
             an envelope containing a :class:`~.message.PaymentRequestMessage`
         """
+        json_message = self._payment_request_json(device, merchant_request)
+        signature = self.sign(json_message.encode("utf-8"))
+
+        return self._envelope(json_message, signature)
+
+    def generate_payment_request_async(
+        self, device: str, merchant_request: MerchantOrderRequestMessage
+    ) -> "Future[PaymentRequestEnvelope]":
+        """
+        Like :meth:`generate_payment_request`, but the message is signed by
+        the :attr:`signing_pool`, if any. The merchant callbacks are called
+        in the calling thread.
+
+        Args:
+            device: :term:`application_id` of the :term:`POS`
+            merchant_request: object containing payment infos
+        Returns:
+            a future of the envelope, already done if there is no signing
+            pool
+        """
+        json_message = self._payment_request_json(device, merchant_request)
+        future: "Future[PaymentRequestEnvelope]" = Future()
+
+        if self.signing_pool is None:
+            signature = self.sign(json_message.encode("utf-8"))
+            future.set_result(self._envelope(json_message, signature))
+            return future
+
+        def signed(signature_future: "Future[bytes]"):
+            try:
+                signature = signature_future.result()
+                future.set_result(self._envelope(json_message, signature))
+            except Exception as e:
+                future.set_exception(e)
+
+        self.signing_pool.submit(json_message.encode("utf-8")).add_done_callback(signed)
+        return future
+
+    def _payment_request_json(
+        self, device: str, merchant_request: MerchantOrderRequestMessage
+    ) -> str:
         merchant = self.get_merchant(device)
         destinations = self.get_destinations(device, merchant_request)
         supported_cryptos = self.get_supported_cryptos(device, merchant_request)
 
+        return self._build_payment_request_json(
+            merchant_request, merchant, destinations, supported_cryptos
+        )
+
+    @staticmethod
+    def _build_payment_request_json(
+        merchant_request: MerchantOrderRequestMessage,
+        merchant: Merchant,
+        destinations: List[Destination],
+        supported_cryptos: Set[str],
+    ) -> str:
         message = PaymentRequestMessage(
             merchant=merchant,
             amount=merchant_request.amount,
@@ -628,11 +1458,13 @@ class PayProc(MantaComponent):
             supported_cryptos=supported_cryptos,
         )
 
-        json_message = message.to_json()
-        signature = self.sign(json_message.encode("utf-8")).decode("utf-8")
+        return message.to_json()
 
-        payment_request_envelope = PaymentRequestEnvelope(
-            message=json_message, signature=signature
+    def _envelope(self, json_message: str, signature: bytes) -> PaymentRequestEnvelope:
+        # Tell the wallet if it can send a MessagePack payment
+        return PaymentRequestEnvelope(
+            message=json_message,
+            signature=signature.decode("utf-8"),
+            version=msgpack_version() if self.msgpack else MANTA_VERSION,
+            algorithm=self.signer.algorithm,
         )
-
-        return payment_request_envelope
@@ -0,0 +1,280 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+Signature schemes of payment requests, and their signing outside of the
+:term:`MQTT` network thread.
+
+The scheme is chosen by the type of the key:
+
+======== ================================ ===================
+Name     Key                              Signature
+======== ================================ ===================
+RS256    RSA                              PKCS#1 v1.5, SHA256
+ES256    Elliptic curve P-256 (secp256r1) ECDSA, SHA256
+EdDSA    Ed25519                          Ed25519
+======== ================================ ===================
+"""
+
+from abc import ABC, abstractmethod
+import base64
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import threading
+from typing import Any, NamedTuple
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+RS256 = "RS256"
+ES256 = "ES256"
+EDDSA = "EdDSA"
+
+"Algorithm of envelopes not advertising one"
+DEFAULT_ALGORITHM = RS256
+
+
+class Signer(ABC):
+    """Sign messages with a private key"""
+
+    algorithm: str
+
+    def __init__(self, key: Any):
+        self.key = key
+
+    @abstractmethod
+    def sign(self, message: bytes) -> bytes:
+        """
+        Args:
+            message: message to sign
+        Returns:
+            the raw signature
+        """
+
+
+class Verifier(ABC):
+    """Verify message signatures with a public key"""
+
+    algorithm: str
+
+    def __init__(self, key: Any):
+        self.key = key
+
+    def verify(self, signature: bytes, message: bytes) -> bool:
+        """
+        Args:
+            signature: the raw signature
+            message: the signed message
+        Returns:
+            True if the signature is valid
+        """
+        try:
+            self._verify(signature, message)
+            return True
+        except InvalidSignature:
+            return False
+
+    @abstractmethod
+    def _verify(self, signature: bytes, message: bytes):
+        pass
+
+
+class RSASigner(Signer):
+    algorithm = RS256
+
+    def sign(self, message: bytes) -> bytes:
+        return self.key.sign(message, padding.PKCS1v15(), hashes.SHA256())
+
+
+class RSAVerifier(Verifier):
+    algorithm = RS256
+
+    def _verify(self, signature: bytes, message: bytes):
+        self.key.verify(signature, message, padding.PKCS1v15(), hashes.SHA256())
+
+
+class ECDSASigner(Signer):
+    algorithm = ES256
+
+    def sign(self, message: bytes) -> bytes:
+        return self.key.sign(message, ec.ECDSA(hashes.SHA256()))
+
+
+class ECDSAVerifier(Verifier):
+    algorithm = ES256
+
+    def _verify(self, signature: bytes, message: bytes):
+        self.key.verify(signature, message, ec.ECDSA(hashes.SHA256()))
+
+
+class Ed25519Signer(Signer):
+    algorithm = EDDSA
+
+    def sign(self, message: bytes) -> bytes:
+        return self.key.sign(message)
+
+
+class Ed25519Verifier(Verifier):
+    algorithm = EDDSA
+
+    def _verify(self, signature: bytes, message: bytes):
+        self.key.verify(signature, message)
+
+
+def _check_curve(key: Any):
+    if not isinstance(key.curve, ec.SECP256R1):
+        raise ValueError("Unsupported elliptic curve {}".format(key.curve.name))
+
+
+def get_signer(key: Any) -> Signer:
+    """
+    Return the :class:`Signer` for a private key
+
+    Args:
+        key: RSA, P-256 or Ed25519 private key
+    """
+    if isinstance(key, rsa.RSAPrivateKey):
+        return RSASigner(key)
+    if isinstance(key, ec.EllipticCurvePrivateKey):
+        _check_curve(key)
+        return ECDSASigner(key)
+    if isinstance(key, ed25519.Ed25519PrivateKey):
+        return Ed25519Signer(key)
+    raise ValueError("Unsupported key type {}".format(type(key).__name__))
+
+
+def get_verifier(key: Any) -> Verifier:
+    """
+    Return the :class:`Verifier` for a public key
+
+    Args:
+        key: RSA, P-256 or Ed25519 public key
+    """
+    if isinstance(key, rsa.RSAPublicKey):
+        return RSAVerifier(key)
+    if isinstance(key, ec.EllipticCurvePublicKey):
+        _check_curve(key)
+        return ECDSAVerifier(key)
+    if isinstance(key, ed25519.Ed25519PublicKey):
+        return Ed25519Verifier(key)
+    raise ValueError("Unsupported key type {}".format(type(key).__name__))
+
+
+def sign_message(key: Any, message: bytes) -> bytes:
+    """
+    Sign the message with the scheme of the key
+
+    Args:
+        key: private key, or its :class:`Signer`
+        message: message to sign
+    Returns:
+        base64 encoded signature
+    """
+    signer = key if isinstance(key, Signer) else get_signer(key)
+    return base64.b64encode(signer.sign(message))
+
+
+_worker_signer: Any = None
+
+
+def _init_worker(key_data: bytes):
+    global _worker_signer
+    _worker_signer = get_signer(
+        load_pem_private_key(key_data, password=None, backend=default_backend())
+    )
+
+
+def _sign_in_worker(message: bytes) -> bytes:
+    return sign_message(_worker_signer, message)
+
+
+class SigningStats(NamedTuple):
+    "number of threads or processes"
+    workers: int
+    "messages submitted and not yet signed"
+    pending: int
+    "highest number of pending messages"
+    max_pending: int
+    "messages submitted since start"
+    submitted: int
+    "messages signed (or failed) since start"
+    completed: int
+
+
+class SigningPool:
+    """
+    Pool of workers signing messages with a private key
+
+    With threads the key is loaded once and shared, which runs in parallel
+    as long as the cryptography backend releases the GIL. With processes
+    every worker loads the key once at start.
+
+    Args:
+        key_data: private key in PEM format
+        workers: number of threads or processes
+        processes: use a process pool instead of a thread pool
+    """
+
+    workers: int
+    executor: Executor
+
+    def __init__(self, key_data: bytes, workers: int = 1, processes: bool = False):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._max_pending = 0
+        self._submitted = 0
+        self._completed = 0
+
+        if processes:
+            self.executor = ProcessPoolExecutor(
+                workers, initializer=_init_worker, initargs=(key_data,)
+            )
+            self._sign = _sign_in_worker
+        else:
+            signer = get_signer(
+                load_pem_private_key(key_data, password=None, backend=default_backend())
+            )
+            self.executor = ThreadPoolExecutor(workers, thread_name_prefix="manta-sign")
+            self._sign = partial(sign_message, signer)
+
+    def submit(self, message: bytes) -> "Future[bytes]":
+        """
+        Sign a message
+
+        Args:
+            message: message to sign
+        Returns:
+            future of the base64 encoded signature
+        """
+        with self._lock:
+            self._pending += 1
+            self._submitted += 1
+            self._max_pending = max(self._max_pending, self._pending)
+
+        future = self.executor.submit(self._sign, message)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future: Future):
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+
+    def stats(self) -> SigningStats:
+        with self._lock:
+            return SigningStats(
+                workers=self.workers,
+                pending=self._pending,
+                max_pending=self._max_pending,
+                submitted=self._submitted,
+                completed=self._completed,
+            )
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers, by default after signing the pending messages"""
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,240 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+Binary snapshot of open sessions, read through a memory map.
+
+The file starts with a header, followed by one record for each session
+and two indexes::
+
+    header   magic, number of sessions, offset of the indexes
+    records  session_id length (2 bytes), session_id, JSON attributes
+    sessions (session_id hash, txid, record offset, record length),
+             sorted by hash
+    txids    (txid, position in sessions), sorted by txid
+
+The indexes have fixed size entries and are searched directly in the
+memory map, so opening a snapshot doesn't depend on its size and each
+session is decoded only when accessed.
+"""
+
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+from typing import Any, Dict, Iterable, Iterator, Tuple
+
+from . import messages
+from .messages import (
+    AckMessage,
+    Message,
+    MerchantOrderRequestMessage,
+    PaymentMessage,
+    PaymentRequestMessage,
+    get_decoding_plan,
+)
+
+"Attributes of TransactionState saved by persistent storages"
+FIELDS = (
+    "session_id",
+    "application",
+    "order",
+    "payment_request",
+    "payment_message",
+    "ack",
+    "wallet_request",
+    "wallet_version",
+)
+
+MESSAGE_FIELDS = {
+    "order": MerchantOrderRequestMessage,
+    "payment_request": PaymentRequestMessage,
+    "payment_message": PaymentMessage,
+    "ack": AckMessage,
+}
+
+MAGIC = b"MANTASS1"
+# magic, count, sessions index offset, txids index offset
+HEADER = struct.Struct(">8sQQQ")
+# session_id hash, txid, offset, length
+SESSION_ENTRY = struct.Struct(">QqQI")
+# txid, position in the sessions index
+TXID_ENTRY = struct.Struct(">qI")
+SESSION_ID_LENGTH = struct.Struct(">H")
+
+
+def encode_fields(state: Any, fields: Iterable[str] = FIELDS) -> Dict[str, Any]:
+    """
+    Return the attributes of a state as JSON serializable values
+
+    Args:
+        state: a :class:`~.payproc.TransactionState`
+        fields: names of the attributes
+    """
+    result = {}
+    for field in fields:
+        value = getattr(state, field)
+        result[field] = value.unstructure() if isinstance(value, Message) else value
+    return result
+
+
+def decode_fields(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Inverse of :func:`encode_fields`"""
+    return {
+        key: get_decoding_plan(MESSAGE_FIELDS[key]).structure_message(value)
+        if key in MESSAGE_FIELDS and value is not None
+        else value
+        for key, value in fields.items()
+    }
+
+
+def session_hash(session_id: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(session_id.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+def write_snapshot(path: str, records: Iterable[Tuple[str, int, bytes]]):
+    """
+    Write a snapshot, atomically replacing ``path``
+
+    Args:
+        path: file name
+        records: session_id, txid and JSON encoded attributes of each session
+    """
+    entries = []
+    tmp = path + ".tmp"
+
+    with open(tmp, "wb") as f:
+        f.write(bytes(HEADER.size))
+        offset = HEADER.size
+
+        for session_id, txid, payload in records:
+            sid = session_id.encode("utf-8")
+            record = SESSION_ID_LENGTH.pack(len(sid)) + sid + payload
+            f.write(record)
+            entries.append((session_hash(session_id), txid, offset, len(record)))
+            offset += len(record)
+
+        entries.sort()
+        sessions_offset = offset
+        for entry in entries:
+            f.write(SESSION_ENTRY.pack(*entry))
+
+        txids_offset = sessions_offset + SESSION_ENTRY.size * len(entries)
+        for txid, position in sorted((entry[1], i) for i, entry in enumerate(entries)):
+            f.write(TXID_ENTRY.pack(txid, position))
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(entries), sessions_offset, txids_offset))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp, path)
+
+
+class _Index:
+    """Sequence view of the entries of an index in the memory map"""
+
+    def __init__(self, buffer: mmap.mmap, offset: int, count: int, entry: struct.Struct):
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+        self.entry = entry
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i: int) -> int:
+        # the first field, the sort key
+        return self.entry.unpack_from(self.buffer, self.offset + i * self.entry.size)[0]
+
+    def get(self, i: int) -> tuple:
+        return self.entry.unpack_from(self.buffer, self.offset + i * self.entry.size)
+
+
+class SessionSnapshot:
+    """
+    Read only snapshot of sessions
+
+    Args:
+        path: file name of a snapshot written by :func:`write_snapshot`
+    """
+
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, sessions_offset, txids_offset = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC:
+            self._buffer.close()
+            raise ValueError("{} is not a session snapshot".format(path))
+
+        self._sessions = _Index(self._buffer, sessions_offset, count, SESSION_ENTRY)
+        self._txids = _Index(self._buffer, txids_offset, count, TXID_ENTRY)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def find_session(self, session_id: str) -> int:
+        """
+        Return the position of a session, or -1 if not found
+        """
+        key = session_hash(session_id)
+        sid = session_id.encode("utf-8")
+        i = bisect.bisect_left(self._sessions, key)
+
+        # on hash collisions compare the session ids
+        while i < len(self._sessions) and self._sessions[i] == key:
+            if self._session_id_bytes(i) == sid:
+                return i
+            i += 1
+        return -1
+
+    def find_txid(self, txid: int) -> int:
+        """
+        Return the position of the session with a txid, or -1 if not found
+        """
+        i = bisect.bisect_left(self._txids, txid)
+        if i < len(self._txids) and self._txids[i] == txid:
+            return self._txids.get(i)[1]
+        return -1
+
+    def txid(self, i: int) -> int:
+        return self._sessions.get(i)[1]
+
+    def _session_id_bytes(self, i: int) -> bytes:
+        offset = self._sessions.get(i)[2]
+        (length,) = SESSION_ID_LENGTH.unpack_from(self._buffer, offset)
+        start = offset + SESSION_ID_LENGTH.size
+        return self._buffer[start:start + length]
+
+    def session_id(self, i: int) -> str:
+        return str(self._session_id_bytes(i), "utf-8")
+
+    def raw(self, i: int) -> Tuple[str, int, bytes]:
+        """
+        Return session_id, txid and encoded attributes of a session
+        """
+        _, txid, offset, length = self._sessions.get(i)
+        (sid_length,) = SESSION_ID_LENGTH.unpack_from(self._buffer, offset)
+        start = offset + SESSION_ID_LENGTH.size
+        session_id = str(self._buffer[start:start + sid_length], "utf-8")
+        payload = self._buffer[start + sid_length:offset + length]
+        return session_id, txid, payload
+
+    def fields(self, i: int) -> Dict[str, Any]:
+        """Decode the attributes of a session"""
+        _, _, payload = self.raw(i)
+        return decode_fields(messages.json_backend.loads(payload))
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(len(self)))
+
+    def close(self):
+        self._buffer.close()
@@ -18,7 +18,8 @@ from typing import List, Dict, Optional
 import paho.mqtt.client as mqtt
 
 from .base import MantaComponent
-from .messages import MerchantOrderRequestMessage, AckMessage, Status
+from .messages import (MerchantOrderRequestMessage, AckMessage, Status,
+                       BUSY_MEMO, msgpack_available, msgpack_version)
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +30,12 @@ def generate_session_id() -> str:
     # return base64.b64encode(M2Crypto.m2.rand_bytes(num_bytes))
 
 
+class PaymentProcessorBusy(Exception):
+    """The Payment Processor rejected the order because overloaded, it can
+    be requested again later"""
+    pass
+
+
 def wrap_callback(f):
     def wrapper(self: Store, *args):
         self.loop.call_soon_threadsafe(f, self, *args)
@@ -49,6 +56,8 @@ class Store(MantaComponent):
         client_options: A Dict of options to be passed to MQTT Client (like
           username, password)
         port: port of the Manta broker
+        msgpack: advertise support for MessagePack encoded acks. Requires
+          the *msgpack* package
 
     Attributes:
         acks: queue of :class:`~.messages.AckMessage` instances
@@ -64,12 +73,18 @@ class Store(MantaComponent):
     session_id: Optional[str] = None
     acks: asyncio.Queue
     first_connect = False
+    msgpack = False
     subscriptions: List[str] = []
 
     def __init__(self, device_id: str, host: str = "localhost",
-                 client_options: Dict = None, port: int = 1883):
+                 client_options: Dict = None, port: int = 1883,
+                 msgpack: bool = False):
         client_options = {} if client_options is None else client_options
 
+        if msgpack and not msgpack_available():
+            raise RuntimeError("msgpack package is required for msgpack encoding")
+
+        self.msgpack = msgpack
         self.device_id = device_id
         self.host = host
         self.mqtt_client = mqtt.Client(**client_options)
@@ -82,8 +97,9 @@ class Store(MantaComponent):
             self.loop = asyncio.new_event_loop()
             asyncio.set_event_loop(self.loop)
 
-        self.acks = asyncio.Queue(loop=self.loop)
-        self.connected = asyncio.Event(loop=self.loop)
+        # bound to the current loop, set above
+        self.acks = asyncio.Queue()
+        self.connected = asyncio.Event()
         self.port = port
 
     def close(self):
@@ -105,13 +121,14 @@ class Store(MantaComponent):
     # noinspection PyUnusedLocal
     @wrap_callback
     def on_message(self, client: mqtt.Client, userdata, msg):
-        logger.info("Got {} on {}".format(msg.payload, msg.topic))
+        logger.info("Got message on %s", msg.topic)
+        logger.debug("Payload %r", msg.payload)
         tokens = msg.topic.split('/')
 
         if tokens[0] == 'acks':
             session_id = tokens[1]
             logger.info("Got ack message")
-            ack = AckMessage.from_json(msg.payload)
+            ack = AckMessage.decode(msg.payload)
             self.acks.put_nowait(ack)
 
     def subscribe(self, topic: str):
@@ -157,7 +174,8 @@ class Store(MantaComponent):
         Create a new Merchant Order and publish it to the
         :ref:`merchant_order_request/{application_id}` topic. Raises an
         exception if an :class:`~.messages.AckMessage` isn't received
-        in less than 3 seconds.
+        in less than 3 seconds, and :class:`PaymentProcessorBusy` if the
+        order is rejected because the Payment Processor is overloaded.
 
         Args:
             amount: Fiat Amount requested
@@ -179,6 +197,9 @@ class Store(MantaComponent):
             crypto_currency=crypto
         )
 
+        if self.msgpack:
+            request.version = msgpack_version()
+
         self.subscribe("acks/{}".format(self.session_id))
         self.mqtt_client.publish("merchant_order_request/{}".format(self.device_id),
                                  request.to_json())
@@ -187,6 +208,9 @@ class Store(MantaComponent):
 
         result: AckMessage = await asyncio.wait_for(self.acks.get(), 3)
 
+        if result.status == Status.INVALID and result.memo == BUSY_MEMO:
+            raise PaymentProcessorBusy()
+
         if result.status != Status.NEW:
             raise Exception("Invalid ack")
 
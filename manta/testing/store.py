@@ -33,7 +33,7 @@ def echo() -> mqtt.Client:
         client.subscribe("acks/#")
 
     def on_message(client: mqtt.Client, userdata, msg: mqtt.MQTTMessage):
-        ack: AckMessage = AckMessage.from_json(msg.payload)
+        ack: AckMessage = AckMessage.decode(msg.payload)
         tokens = msg.topic.split('/')
         session_id = tokens[1]
 
@@ -171,7 +171,6 @@ async def _interactive_payment(wallet: Wallet, payment_req: PaymentRequestMessag
             verified = _verify_envelope(envelope, certificate,
                                         ca_certificate)
 
-        # Double unpack, why?
         payment_req = envelope.unpack()
         logger.info("Payment request: {}".format(payment_req))
         destination = payment_req.get_destination(chosen_crypto)
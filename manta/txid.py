@@ -0,0 +1,199 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+Allocation of transaction ids.
+
+:class:`BlockAllocator` reserves blocks of ids from a persistent
+:class:`BlockStore` shared by all the Payment Processors of a host (hi/lo
+allocation): ids are handed out from the current block without locks, and
+the store is accessed only once per block.
+"""
+
+from abc import ABC, abstractmethod
+import itertools
+import os
+import sqlite3
+import threading
+from types import ModuleType
+from typing import Iterator, Optional
+
+fcntl: Optional[ModuleType]
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class TxidAllocator(ABC):
+    """Source of unique transaction ids"""
+
+    @abstractmethod
+    def next(self) -> int:
+        """Return a new txid. Can be called from any thread"""
+        pass
+
+    def peek(self) -> Optional[int]:
+        """Return the txid of the next call of :meth:`next`, if known"""
+        return None
+
+
+class CounterAllocator(TxidAllocator):
+    """
+    In process counter, not persistent
+
+    Args:
+        start: first txid
+        step: increment between txids
+    """
+
+    def __init__(self, start: int = 0, step: int = 1):
+        self.step = step
+        # next() of itertools.count is atomic
+        self._ids: Iterator[int] = itertools.count(start, step)
+        self._next = start
+
+    def next(self) -> int:
+        txid = next(self._ids)
+        # only informative, peek() may lag behind concurrent calls
+        self._next = txid + self.step
+        return txid
+
+    def peek(self) -> Optional[int]:
+        return self._next
+
+
+class BlockStore(ABC):
+    """Persistent store of the first txid not yet reserved"""
+
+    @abstractmethod
+    def reserve(self, count: int) -> int:
+        """
+        Reserve ``count`` txids, atomically also across processes.
+
+        Returns: the first reserved txid
+        """
+        pass
+
+
+class FileBlockStore(BlockStore):
+    """
+    Store the first free txid in a text file, locked while reserving.
+    Requires ``fcntl`` (ie not on Windows)
+
+    Args:
+        path: file name, created if missing
+        start: first txid of a new file
+    """
+
+    path: str
+    start: int
+
+    def __init__(self, path: str, start: int = 0):
+        if fcntl is None:
+            raise RuntimeError("FileBlockStore requires fcntl")
+        self.path = path
+        self.start = start
+
+    def reserve(self, count: int) -> int:
+        assert fcntl is not None
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.read(fd, 64).strip()
+            first = int(data) if data else self.start
+            value = str(first + count).encode("ascii")
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, value)
+            os.fsync(fd)
+            return first
+        finally:
+            # closing releases the lock
+            os.close(fd)
+
+
+class SQLiteBlockStore(BlockStore):
+    """
+    Store the first free txid in a SQLite database, which can be shared
+    with :class:`~.txstorage.TXStorageSQLite`.
+
+    Args:
+        path: file name of the database
+        start: first txid of a new database
+        name: name of the sequence, to keep more of them in a database
+    """
+
+    path: str
+    start: int
+    name: str
+
+    def __init__(self, path: str, start: int = 0, name: str = "txid"):
+        self.path = path
+        self.start = start
+        self.name = name
+        self._lock = threading.Lock()
+        # transactions are explicit
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS txid_blocks "
+            "(name TEXT PRIMARY KEY, next INTEGER NOT NULL)"
+        )
+
+    def reserve(self, count: int) -> int:
+        with self._lock:
+            # the write lock is taken at begin, other processes wait
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT next FROM txid_blocks WHERE name = ?", (self.name,)
+                ).fetchone()
+                first = self.start if row is None else row[0]
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO txid_blocks (name, next) VALUES (?, ?)",
+                    (self.name, first + count),
+                )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return first
+
+    def close(self):
+        self.connection.close()
+
+
+class BlockAllocator(TxidAllocator):
+    """
+    Hand out txids from blocks reserved in a :class:`BlockStore`.
+
+    The ids left in the current block when the process stops are lost, so
+    txids are unique and increasing within a process but not contiguous.
+
+    Args:
+        store: persistent store shared by the processes
+        block_size: number of txids reserved at once
+    """
+
+    store: BlockStore
+    block_size: int
+
+    def __init__(self, store: BlockStore, block_size: int = 1000):
+        self.store = store
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._ids: Iterator[int] = iter(())
+
+    def next(self) -> int:
+        while True:
+            ids = self._ids
+            try:
+                # next() of a range iterator is atomic
+                return next(ids)
+            except StopIteration:
+                with self._lock:
+                    # another thread may have already reserved a new block
+                    if self._ids is ids:
+                        first = self.store.reserve(self.block_size)
+                        self._ids = iter(range(first, first + self.block_size))
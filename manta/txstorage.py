@@ -0,0 +1,706 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+"""
+Persistent implementations of :class:`~.payproc.TXStorage`.
+"""
+
+from abc import abstractmethod
+import logging
+import os
+import queue
+import sqlite3
+import struct
+import threading
+import zlib
+from typing import (Any, BinaryIO, Callable, Dict, FrozenSet, Iterator, List,
+                    NamedTuple, Optional, Set, Tuple)
+
+from . import messages
+from .messages import (
+    AckMessage,
+    Message,
+    MerchantOrderRequestMessage,
+    PaymentMessage,
+    PaymentRequestMessage,
+    Status,
+)
+from .payproc import TransactionState, TXStorageMemory
+from .snapshot import FIELDS, decode_fields, encode_fields
+
+logger = logging.getLogger(__name__)
+
+
+class StateChange(NamedTuple):
+    state: TransactionState
+    "changed attributes since the last flush, all of them if created"
+    fields: FrozenSet[str]
+    "True if the state was created since the last flush"
+    created: bool
+
+
+class GroupCommitWriter:
+    """
+    Thread committing the queued batches of items. The batches queued
+    while a commit is running are committed together by the next one.
+
+    Args:
+        commit: function called by the thread with the items to commit
+        batch_size: maximum number of items per commit
+        name: name of the thread
+    """
+
+    commit: Callable[[List[Any]], None]
+    batch_size: int
+
+    def __init__(
+        self,
+        commit: Callable[[List[Any]], None],
+        batch_size: int = 1000,
+        name: str = "manta-txstorage",
+    ):
+        self.commit = commit
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[Optional[List[Any]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            batch = self._queue.get()
+            batches = 1
+            items: List[Any] = [] if batch is None else list(batch)
+
+            while batch is not None and len(items) < self.batch_size:
+                try:
+                    batch = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batches += 1
+                if batch is not None:
+                    items.extend(batch)
+
+            try:
+                if items:
+                    self.commit(items)
+            except Exception:
+                logger.exception("Error committing %d changes", len(items))
+            finally:
+                for _ in range(batches):
+                    self._queue.task_done()
+
+            if batch is None:
+                return
+
+    def put(self, items: List[Any]):
+        """Queue items to be committed together"""
+        self._queue.put(items)
+
+    def join(self):
+        """Wait until all the queued items are committed"""
+        self._queue.join()
+
+    def close(self):
+        """Commit the queued items and stop the thread"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+class TXStorageWriteBehind(TXStorageMemory):
+    """
+    Base of the persistent storages that keep open sessions in memory and
+    save their changes in batches.
+
+    The attributes changed between two calls of :meth:`flush` are
+    coalesced in a single :class:`StateChange` for each state.
+    :class:`~.payproc.PayProc` flushes after handling each message, and
+    changes made outside of it are flushed every ``flush_interval``
+    seconds.
+
+    Args:
+        flush_interval: seconds between automatic flushes, 0 to disable
+    """
+
+    flush_interval: float
+
+    def __init__(self, flush_interval: float = 0.1):
+        super().__init__()
+        self.flush_interval = flush_interval
+        self._dirty: Dict[int, Tuple[TransactionState, Set[str], bool]] = {}
+        self._dirty_lock = threading.Lock()
+        # held while a batch is queued, so batches are written in order
+        self._flush_lock = threading.Lock()
+        # held while adding or removing states, the writer thread reads them.
+        # Re-entrant, creating a state notifies its fields
+        self._states_lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._timer: Optional[threading.Thread] = None
+
+    def start_timer(self):
+        """Start flushing every ``flush_interval`` seconds"""
+        if self.flush_interval > 0 and self._timer is None:
+            self._timer = threading.Thread(
+                target=self._timer_loop, name="manta-txstorage-flush", daemon=True
+            )
+            self._timer.start()
+
+    def stop_timer(self):
+        if self._timer is not None:
+            self._stopped.set()
+            self._timer.join()
+            self._timer = None
+
+    def _timer_loop(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error flushing transaction states")
+
+    def _mark(self, state: TransactionState, key: Optional[str]):
+        with self._dirty_lock:
+            entry = self._dirty.get(state.txid)
+            if entry is None:
+                entry = self._dirty[state.txid] = (state, set(), key is None)
+            if key is not None:
+                entry[1].add(key)
+
+    def _on_notify(self, txid, session_id, key, value):
+        with self._states_lock:
+            if key in FIELDS:
+                # the state is removed from memory when completed
+                if self.txids.get(txid) == session_id:
+                    self._mark(self.states[session_id], key)
+
+            super()._on_notify(txid, session_id, key, value)
+
+    def create(
+        self,
+        txid: int,
+        session_id: str,
+        application: str,
+        order: MerchantOrderRequestMessage,
+        ack: Optional[AckMessage] = None,
+    ) -> TransactionState:
+        with self._states_lock:
+            tx = super().create(txid, session_id, application, order, ack)
+        self._mark(tx, None)
+        return tx
+
+    def flush(self):
+        # Flushes run concurrently from the dispatch threads: an older batch
+        # queued after a newer one would overwrite it
+        with self._flush_lock:
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, {}
+
+            if dirty:
+                self.write_batch(
+                    [
+                        StateChange(
+                            state, frozenset(FIELDS if created else fields), created
+                        )
+                        for state, fields, created in dirty.values()
+                    ]
+                )
+
+    @abstractmethod
+    def write_batch(self, changes: List[StateChange]):
+        """
+        Save the changes of many states
+
+        Args:
+            changes: changes since the last flush
+        """
+        pass
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    txid INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    application TEXT NOT NULL,
+    status TEXT,
+    "order" TEXT NOT NULL,
+    payment_request TEXT,
+    payment_message TEXT,
+    ack TEXT,
+    wallet_request TEXT,
+    wallet_version TEXT
+);
+CREATE INDEX IF NOT EXISTS transactions_session_id ON transactions (session_id);
+CREATE INDEX IF NOT EXISTS transactions_application ON transactions (application);
+CREATE INDEX IF NOT EXISTS transactions_status ON transactions (status);
+"""
+
+INSERT = (
+    'INSERT INTO transactions (txid, session_id, application, status, "order", '
+    "payment_request, payment_message, ack, wallet_request, wallet_version) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+SELECT_OPEN = (
+    'SELECT txid, session_id, application, "order", payment_request, payment_message, '
+    "ack, wallet_request, wallet_version FROM transactions "
+    "WHERE status IS NULL OR status NOT IN (?, ?)"
+)
+
+Statement = Tuple[str, Tuple[Any, ...]]
+
+
+def _column(state: TransactionState, field: str) -> Any:
+    value = getattr(state, field)
+    return value.to_json() if isinstance(value, Message) else value
+
+
+def _status(state: TransactionState) -> Optional[str]:
+    return None if state.ack is None else state.ack.status.value
+
+
+class TXStorageSQLite(TXStorageWriteBehind):
+    """
+    Implementation of TXStorage persisted in a SQLite database.
+
+    Open sessions are kept in memory and loaded again at start, so the
+    Payment Processor can be restarted without losing them. Completed
+    sessions are kept in the database with their final status.
+
+    Each flush updates only the changed columns of each state, then a
+    background thread commits all the batches queued since the previous
+    commit in a single transaction. The database is in WAL mode, so
+    readers don't block the writer.
+
+    Args:
+        path: file name of the database
+        batch_size: maximum number of statements per transaction
+        flush_interval: seconds between automatic flushes, 0 to disable
+    """
+
+    path: str
+    batch_size: int
+
+    def __init__(self, path: str, batch_size: int = 1000, flush_interval: float = 0.1):
+        super().__init__(flush_interval)
+        self.path = path
+        self.batch_size = batch_size
+        # the connection is shared with the writer thread
+        self._lock = threading.Lock()
+        # UPDATE statement for each set of changed columns
+        self._updates: Dict[FrozenSet[str], str] = {}
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # With WAL only a power loss can lose the last commits
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self._load()
+
+        self._writer = GroupCommitWriter(self._commit, batch_size)
+        self.start_timer()
+
+    def _load(self):
+        rows = self.connection.execute(
+            SELECT_OPEN, (Status.PAID.value, Status.INVALID.value)
+        )
+        for row in rows:
+            (txid, session_id, application, order, payment_request,
+             payment_message, ack, wallet_request, wallet_version) = row
+
+            state = TransactionState(
+                txid=txid,
+                session_id=session_id,
+                application=application,
+                order=MerchantOrderRequestMessage.from_json(order),
+                payment_request=None
+                if payment_request is None
+                else PaymentRequestMessage.from_json(payment_request),
+                payment_message=None
+                if payment_message is None
+                else PaymentMessage.from_json(payment_message),
+                ack=None if ack is None else AckMessage.from_json(ack),
+                wallet_request=wallet_request,
+                wallet_version=wallet_version,
+                notify=self._on_notify,
+            )
+            self.states[session_id] = state
+            self.txids[txid] = session_id
+
+        logger.info("Loaded %d open sessions from %s", len(self.states), self.path)
+
+    def _commit(self, statements: List[Statement]):
+        with self._lock, self.connection:
+            for statement in statements:
+                self.connection.execute(*statement)
+
+    def _update_sql(self, fields: FrozenSet[str]) -> str:
+        sql = self._updates.get(fields)
+        if sql is None:
+            columns = ['"{}" = ?'.format(field) for field in sorted(fields)]
+            if "ack" in fields:
+                columns.append("status = ?")
+            sql = self._updates[fields] = "UPDATE transactions SET {} WHERE txid = ?".format(
+                ", ".join(columns)
+            )
+        return sql
+
+    def write_batch(self, changes: List[StateChange]):
+        statements: List[Statement] = []
+
+        for state, fields, created in changes:
+            if created:
+                statements.append(
+                    (
+                        INSERT,
+                        (
+                            state.txid,
+                            state.session_id,
+                            state.application,
+                            _status(state),
+                            _column(state, "order"),
+                            _column(state, "payment_request"),
+                            _column(state, "payment_message"),
+                            _column(state, "ack"),
+                            state.wallet_request,
+                            state.wallet_version,
+                        ),
+                    )
+                )
+            else:
+                params = [_column(state, field) for field in sorted(fields)]
+                if "ack" in fields:
+                    params.append(_status(state))
+                params.append(state.txid)
+                statements.append((self._update_sql(fields), tuple(params)))
+
+        self._writer.put(statements)
+
+    def next_txid(self) -> int:
+        """
+        Return the txid following the highest one in the database, used
+        by :class:`~.payproc.PayProc` as first txid.
+        """
+        self.sync()
+        with self._lock:
+            (txid,) = self.connection.execute(
+                "SELECT MAX(txid) FROM transactions"
+            ).fetchone()
+        return 0 if txid is None else txid + 1
+
+    def sync(self):
+        """Flush and wait until all the changes are committed"""
+        self.flush()
+        self._writer.join()
+
+    def close(self):
+        """Commit all the changes and close the database"""
+        self.stop_timer()
+        self.flush()
+        self._writer.close()
+        self.connection.close()
+
+
+# length and CRC32 of the payload
+RECORD_HEADER = struct.Struct(">II")
+
+
+def _encode_payload(record: dict) -> bytes:
+    payload = messages.json_backend.dumps(record).encode("utf-8")
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def encode_record(change: StateChange) -> bytes:
+    """
+    Encode a change as a journal record: a header with length and CRC32,
+    followed by a JSON object with the txid and the changed attributes.
+    """
+    fields = encode_fields(change.state, change.fields)
+    return _encode_payload(
+        {"txid": change.state.txid, "created": change.created, "fields": fields}
+    )
+
+
+def read_records(f: BinaryIO) -> Iterator[Tuple[int, dict]]:
+    """
+    Read the records of a journal from the current position
+
+    Args:
+        f: file opened in binary mode
+    Returns:
+        the position after each record, and the record. It stops at the
+        end of the file or at an incomplete or corrupted record
+    """
+    position = f.tell()
+    while True:
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            break
+
+        length, crc = RECORD_HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+
+        position += RECORD_HEADER.size + length
+        yield position, messages.json_backend.loads(payload)
+
+    f.seek(position)
+
+
+def _fsync_directory(path: str):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:  # pragma: no cover
+        pass  # not supported on some platforms
+    finally:
+        os.close(fd)
+
+
+class CorruptedJournal(Exception):
+    pass
+
+
+class TXStorageJournal(TXStorageWriteBehind):
+    """
+    Implementation of TXStorage persisted in an append only journal.
+
+    Each change is appended to ``{path}.log`` as a length prefixed record.
+    A background thread writes all the records queued since its previous
+    write at once, followed by a single fsync. After ``compact_every``
+    records the open sessions are written to ``{path}.snapshot`` and a new
+    empty log is started. At start the snapshot is loaded, then the
+    records of the log are replayed. The snapshot also keeps the txid
+    following the highest one written, returned by :meth:`next_txid`.
+
+    A hot standby Payment Processor can follow the journal of the active
+    one: it's created with ``standby=True``, calls :meth:`catch_up` to
+    apply the new records and :meth:`promote` to become the writer when
+    the active one fails.
+
+    Args:
+        path: path of the journal files, without extension
+        compact_every: number of records in the log, replayed ones included,
+          before compacting the journal, 0 to never compact
+        batch_size: maximum number of records per write
+        flush_interval: seconds between automatic flushes, 0 to disable
+        fsync: sync the log to disk after each write
+        standby: only read the journal
+    """
+
+    log_path: str
+    snapshot_path: str
+    compact_every: int
+    batch_size: int
+    fsync: bool
+    standby: bool
+
+    def __init__(
+        self,
+        path: str,
+        compact_every: int = 100000,
+        batch_size: int = 1000,
+        flush_interval: float = 0.1,
+        fsync: bool = True,
+        standby: bool = False,
+    ):
+        super().__init__(flush_interval)
+        self.log_path = path + ".log"
+        self.snapshot_path = path + ".snapshot"
+        self.compact_every = compact_every
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.standby = standby
+        self._records = 0
+        self._next_txid = 0
+        self._log: Optional[BinaryIO] = None
+        self._reader: Optional[BinaryIO] = None
+        self._writer: Optional[GroupCommitWriter] = None
+
+        # Open the log before reading the snapshot, if the journal is
+        # compacted in between the records are read again from the old log
+        if os.path.exists(self.log_path):
+            self._reader = open(self.log_path, "rb")
+
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as f:
+                for _, record in read_records(f):
+                    self._apply(record)
+
+        self.catch_up()
+
+        if not standby:
+            self.promote()
+
+    def _apply(self, record: dict):
+        if "next_txid" in record:
+            # first record of a snapshot
+            self._next_txid = max(self._next_txid, record["next_txid"])
+            return
+
+        txid = record["txid"]
+        fields = decode_fields(record["fields"])
+        self._next_txid = max(self._next_txid, txid + 1)
+
+        if record["created"]:
+            # A session written again after a compaction has the same txid
+            owner = self.txids.get(txid)
+            if owner is not None and owner != fields["session_id"]:
+                raise CorruptedJournal(
+                    "txid {} of open session {!r} reused by {!r}".format(
+                        txid, owner, fields["session_id"]
+                    )
+                )
+            previous = self.states.get(fields["session_id"])
+            if previous is not None:
+                del self.txids[previous.txid]
+
+            state = TransactionState(txid=txid, notify=self._on_notify, **fields)
+            self.states[state.session_id] = state
+            self.txids[txid] = state.session_id
+        else:
+            session_id = self.txids.get(txid)
+            if session_id is None:
+                # completed or compacted
+                return
+            state = self.states[session_id]
+            for key, value in fields.items():
+                # bypass notify, the change is already in the journal
+                object.__setattr__(state, key, value)
+
+        if state.ack is not None and state.ack.status in (Status.PAID, Status.INVALID):
+            del self.txids[txid]
+            del self.states[state.session_id]
+
+    def catch_up(self) -> int:
+        """
+        Apply the records appended to the journal since the last call,
+        following it when compacted.
+
+        Returns:
+            the number of records applied
+        """
+        count = 0
+
+        while self._reader is not None:
+            for _, record in read_records(self._reader):
+                self._apply(record)
+                count += 1
+                self._records += 1
+
+            try:
+                replaced = os.stat(self.log_path).st_ino != os.fstat(self._reader.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = False
+
+            if not replaced:
+                break
+
+            # Compacted: the old log is complete, read what's left of it
+            # before following the new one. The snapshot is not needed,
+            # the changes it contains are also in the new log.
+            for _, record in read_records(self._reader):
+                self._apply(record)
+                count += 1
+            self._reader.close()
+            self._reader = open(self.log_path, "rb")
+            self._records = 0
+
+        return count
+
+    def promote(self):
+        """
+        Apply the last records, then start writing the journal
+        """
+        if self._writer is not None:
+            return
+
+        if self._reader is not None:
+            self.catch_up()
+            end = self._reader.tell()
+            self._reader.close()
+            self._reader = None
+            self._log = open(self.log_path, "r+b")
+            # drop the incomplete record of a crash, if any
+            self._log.truncate(end)
+            self._log.seek(end)
+        else:
+            self._log = open(self.log_path, "wb")
+
+        self.standby = False
+        self._writer = GroupCommitWriter(self._commit, self.batch_size)
+        self.start_timer()
+
+    def _commit(self, records: List[bytes]):
+        assert self._log is not None
+        self._log.write(b"".join(records))
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+
+        self._records += len(records)
+        if self.compact_every and self._records >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """
+        Write the open sessions in a new snapshot and start a new log.
+        Called by the writer thread.
+        """
+        assert self._log is not None
+        with self._states_lock:
+            states = list(self.states.values())
+
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_encode_payload({"next_txid": self._next_txid}))
+            for state in states:
+                f.write(encode_record(StateChange(state, frozenset(FIELDS), True)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+
+        tmp = self.log_path + ".tmp"
+        log = open(tmp, "wb")
+        os.fsync(log.fileno())
+        os.replace(tmp, self.log_path)
+        _fsync_directory(self.log_path)
+
+        self._log.close()
+        self._log = log
+        self._records = 0
+        logger.info("Compacted journal %s with %d open sessions", self.log_path, len(states))
+
+    def write_batch(self, changes: List[StateChange]):
+        if self._writer is None:
+            raise RuntimeError("Standby journal can't be written")
+        for change in changes:
+            if change.created:
+                self._next_txid = max(self._next_txid, change.state.txid + 1)
+        self._writer.put([encode_record(change) for change in changes])
+
+    def next_txid(self) -> int:
+        """
+        Return the txid following the highest one written to the journal,
+        also by the sessions completed before the last compaction.
+        """
+        return self._next_txid
+
+    def sync(self):
+        """Flush and wait until all the changes are written"""
+        self.flush()
+        if self._writer is not None:
+            self._writer.join()
+
+    def close(self):
+        """Write all the changes and close the journal"""
+        self.stop_timer()
+        if self._writer is not None:
+            self.flush()
+            self._writer.close()
+            self._writer = None
+        for f in (self._log, self._reader):
+            if f is not None:
+                f.close()
+        self._log = self._reader = None
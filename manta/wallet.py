@@ -18,7 +18,8 @@ from cryptography.hazmat.backends import default_backend
 import paho.mqtt.client as mqtt
 
 from .base import MantaComponent
-from .messages import PaymentRequestEnvelope, PaymentMessage, AckMessage
+from .messages import (PaymentRequestEnvelope, PaymentMessage, AckMessage,
+                       msgpack_available, msgpack_version, supports_msgpack)
 
 
 logger = logging.getLogger(__name__)
@@ -45,6 +46,10 @@ class Wallet(MantaComponent):
         session_id: a session_id
         host: :term:`MQTT` broker IP addresses
         port: optional port number of the broker service
+        msgpack: advertise support for MessagePack encoded messages.
+          Requires the *msgpack* package
+        retained: use the *all* payment request retained by the broker, if
+          it arrives before the answer of the :term:`Payment Processor`
 
     Attributes:
         acks: queue of :class:`~.messages.AckMessage` instances
@@ -60,6 +65,12 @@ class Wallet(MantaComponent):
     certificate_future: Optional[asyncio.Future] = None
     acks: asyncio.Queue
     first_connect = False
+    msgpack = False
+    "True if the Payment Processor accepts MessagePack payments"
+    payproc_msgpack = False
+    retained = False
+    "True if the retained payment request answers the current request"
+    accept_retained = False
 
     @classmethod
     def factory(cls, url: str) -> Union[Wallet, None]:
@@ -81,7 +92,13 @@ class Wallet(MantaComponent):
             return None
 
     def __init__(self, url: str, session_id: str, host: str = "localhost",
-                 port: int = 1883):
+                 port: int = 1883, msgpack: bool = False,
+                 retained: bool = False):
+        if msgpack and not msgpack_available():
+            raise RuntimeError("msgpack package is required for msgpack encoding")
+
+        self.msgpack = msgpack
+        self.retained = retained
         self.host = host
         self.port = port
         self.session_id = session_id
@@ -97,8 +114,9 @@ class Wallet(MantaComponent):
             self.loop = asyncio.new_event_loop()
             asyncio.set_event_loop(self.loop)
 
-        self.acks = asyncio.Queue(loop=self.loop)
-        self.connected = asyncio.Event(loop=self.loop)
+        # bound to the current loop, set above
+        self.acks = asyncio.Queue()
+        self.connected = asyncio.Event()
 
     def close(self):
         """Disconnect and stop :term:`MQTT` client's processing loop."""
@@ -118,15 +136,23 @@ class Wallet(MantaComponent):
 
     @wrap_callback
     def on_message(self, client: mqtt.Client, userdata, msg):
-        logger.info("New message {} on {}".format(msg.payload, msg.topic))
+        logger.info("New message on %s", msg.topic)
+        logger.debug("Payload %r", msg.payload)
         tokens = msg.topic.split('/')
 
         if tokens[0] == "payment_requests":
-            envelope = PaymentRequestEnvelope.from_json(msg.payload)
-            assert self.payment_request_future is not None
-            self.loop.call_soon_threadsafe(self.payment_request_future.set_result, envelope)
+            # empty payload is the retained payment request being cleared
+            if (not msg.payload or self.payment_request_future is None
+                    or self.payment_request_future.done()):
+                return
+            # the retained payment request is the *all* one
+            if msg.retain and not self.accept_retained:
+                return
+            envelope = PaymentRequestEnvelope.decode(msg.payload)
+            self.payproc_msgpack = self.msgpack and supports_msgpack(envelope.version)
+            self.payment_request_future.set_result(envelope)
         elif tokens[0] == "acks":
-            ack = AckMessage.from_json(msg.payload)
+            ack = AckMessage.decode(msg.payload)
             self.acks.put_nowait(ack)
         elif tokens[0] == "certificate":
             assert self.certificate_future is not None
@@ -189,8 +215,16 @@ class Wallet(MantaComponent):
         await self.connect()
 
         self.payment_request_future = self.loop.create_future()
+        self.accept_retained = self.retained and crypto_currency == "all"
         self.mqtt_client.subscribe("payment_requests/{}".format(self.session_id))
-        self.mqtt_client.publish("payment_requests/{}/{}".format(self.session_id, crypto_currency))
+
+        # requested anyway, the first of the two answers is used
+        topic = "payment_requests/{}/{}".format(self.session_id, crypto_currency)
+        if self.msgpack:
+            # advertise MessagePack support in the request payload
+            self.mqtt_client.publish(topic, msgpack_version())
+        else:
+            self.mqtt_client.publish(topic)
 
         logger.info("Published payment_requests/{}".format(self.session_id))
 
@@ -212,6 +246,9 @@ class Wallet(MantaComponent):
             transaction_hash=transaction_hash,
             crypto_currency=crypto_currency
         )
+        if self.msgpack:
+            # the request may have been skipped using the retained message
+            message.version = msgpack_version()
         self.mqtt_client.subscribe("acks/{}".format(self.session_id))
         self.mqtt_client.publish("payments/{}".format(self.session_id),
-                                 message.to_json(), qos=1)
+                                 message.encode(self.payproc_msgpack), qos=1)
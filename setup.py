@@ -33,7 +33,11 @@ setup(
     author="Alessandro Viganò",
     author_email="alessandro@appia.co",
     install_requires=requirements,
-    extras_require={"runner": requirements_tests,},
+    extras_require={
+        "runner": requirements_tests,
+        "orjson": ["orjson>=3.0"],
+        "msgpack": ["msgpack>=1.0"],
+    },
     python_requires=">=3.7",
     classifiers=[
         "Development Status :: 4 - Beta",
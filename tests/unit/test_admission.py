@@ -0,0 +1,72 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+from manta.admission import AdmissionControl, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket():
+    clock = Clock()
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+
+    assert [True, True, True, False] == [bucket.take() for _ in range(4)]
+
+    clock.now = 0.5
+    assert bucket.take()
+    assert not bucket.take()
+
+    # never more than burst tokens
+    clock.now = 100
+    assert [True, True, True, False] == [bucket.take() for _ in range(4)]
+
+
+def test_rate_per_application():
+    clock = Clock()
+    admission = AdmissionControl(rate=1, burst=2, clock=clock)
+
+    assert admission.admit("pos1")
+    assert admission.admit("pos1")
+    assert not admission.admit("pos1")
+    assert admission.admit("pos2")
+
+    clock.now = 1
+    assert admission.admit("pos1")
+
+    stats = admission.stats()
+    assert 4 == stats.admitted
+    assert 1 == stats.rejected_rate
+    assert 4 == stats.in_flight
+
+
+def test_max_in_flight():
+    admission = AdmissionControl(max_in_flight=2)
+
+    assert admission.admit("pos1")
+    assert admission.admit("pos2")
+    assert not admission.admit("pos3")
+
+    admission.release()
+    assert admission.admit("pos3")
+
+    stats = admission.stats()
+    assert 2 == stats.in_flight
+    assert 1 == stats.rejected_in_flight
+    assert 0 == stats.rejected_rate
+
+
+def test_in_flight_rejection_keeps_tokens():
+    clock = Clock()
+    admission = AdmissionControl(rate=1, burst=1, max_in_flight=1, clock=clock)
+
+    assert admission.admit("pos1")
+    assert not admission.admit("pos2")
+    admission.release()
+    assert admission.admit("pos2")
@@ -0,0 +1,210 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+import asyncio
+from decimal import Decimal
+import socket
+from unittest.mock import MagicMock
+
+import pytest
+
+from manta.admission import AdmissionControl
+from manta.aiomqtt import AsyncioMQTTTransport
+from manta.aiopayproc import AsyncPayProc
+from manta.messages import (
+    AckMessage,
+    MerchantOrderRequestMessage,
+    PaymentRequestEnvelope,
+    Status,
+)
+from manta.signing import SigningPool
+
+from tests.utils import (
+    DESTINATIONS,
+    KEY_FILENAME,
+    MERCHANT,
+)
+
+
+def make_payproc() -> AsyncPayProc:
+    # the loop is running only inside the tests
+    pp = AsyncPayProc(KEY_FILENAME)
+
+    async def get_merchant(device):
+        await asyncio.sleep(0)
+        return MERCHANT
+
+    pp.get_merchant = get_merchant
+    pp.get_destinations = lambda device, order: DESTINATIONS
+    pp.get_supported_cryptos = lambda device, order: {"btc", "nano"}
+    return pp
+
+
+async def drain(pp: AsyncPayProc):
+    while pp.tasks:
+        await asyncio.gather(*pp.tasks)
+
+
+def published(mock_mqtt, topic):
+    return [c[0][1] for c in mock_mqtt.publish.call_args_list if c[0][0] == topic]
+
+
+def order(session_id: str, crypto_currency: str = None) -> str:
+    return MerchantOrderRequestMessage(
+        amount=Decimal("1000"),
+        session_id=session_id,
+        fiat_currency="eur",
+        crypto_currency=crypto_currency,
+    ).to_json()
+
+
+@pytest.mark.asyncio
+async def test_payment_request(mock_mqtt):
+    async_payproc = make_payproc()
+    async_payproc.run()
+    mock_mqtt.push("merchant_order_request/device1", order("1423"))
+    mock_mqtt.push("payment_requests/1423/all", "")
+    await drain(async_payproc)
+
+    ack = AckMessage.decode(published(mock_mqtt, "acks/1423")[0])
+    assert Status.NEW == ack.status
+
+    (payload,) = published(mock_mqtt, "payment_requests/1423")
+    message = PaymentRequestEnvelope.decode(payload).unpack()
+    assert MERCHANT == message.merchant
+    assert DESTINATIONS == message.destinations
+    assert not async_payproc._lanes
+
+
+@pytest.mark.asyncio
+async def test_slow_destinations(mock_mqtt):
+    async_payproc = make_payproc()
+    release = asyncio.Event()
+
+    async def get_destinations(device, order):
+        if order.session_id == "slow":
+            await release.wait()
+        return DESTINATIONS[:1]
+
+    async_payproc.get_destinations = get_destinations
+
+    mock_mqtt.push("merchant_order_request/device1", order("slow", "btc"))
+    mock_mqtt.push("merchant_order_request/device1", order("fast"))
+    mock_mqtt.push("payment_requests/fast/all", "")
+    # the request of the slow session waits for its order
+    mock_mqtt.push("payment_requests/slow/btc", "")
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    assert published(mock_mqtt, "payment_requests/fast")
+    assert not published(mock_mqtt, "acks/slow")
+
+    release.set()
+    await drain(async_payproc)
+    assert published(mock_mqtt, "acks/slow")
+    assert published(mock_mqtt, "payment_requests/slow")
+
+
+@pytest.mark.asyncio
+async def test_session_order(mock_mqtt):
+    async_payproc = make_payproc()
+    mock_mqtt.push("merchant_order_request/device1", order("1423"))
+    mock_mqtt.push("payment_requests/1423/all", "")
+    mock_mqtt.push("merchant_order_cancel/1423", "")
+    await drain(async_payproc)
+
+    topics = [c[0][0] for c in mock_mqtt.publish.call_args_list]
+    assert ["acks/1423", "payment_requests/1423", "acks/1423"] == topics
+    ack = AckMessage.decode(published(mock_mqtt, "acks/1423")[1])
+    assert Status.INVALID == ack.status
+
+
+@pytest.mark.asyncio
+async def test_signing_pool(mock_mqtt):
+    async_payproc = make_payproc()
+    with open(KEY_FILENAME, "rb") as myfile:
+        async_payproc.signing_pool = SigningPool(myfile.read(), workers=1)
+
+    mock_mqtt.push("merchant_order_request/device1", order("1423"))
+    mock_mqtt.push("payment_requests/1423/all", "")
+    await drain(async_payproc)
+    async_payproc.signing_pool.shutdown()
+
+    (payload,) = published(mock_mqtt, "payment_requests/1423")
+    assert DESTINATIONS == PaymentRequestEnvelope.decode(payload).unpack().destinations
+    assert 1 == async_payproc.signing_pool.stats().completed
+
+
+@pytest.mark.asyncio
+async def test_presign(mock_mqtt):
+    async_payproc = make_payproc()
+    async_payproc.presign_executor = MagicMock()
+
+    mock_mqtt.push("merchant_order_request/device1", order("1423"))
+    await drain(async_payproc)
+    presigned = async_payproc.presigned["1423"]
+    await presigned
+
+    mock_mqtt.push("payment_requests/1423/all", "")
+    await drain(async_payproc)
+    (payload,) = published(mock_mqtt, "payment_requests/1423")
+    assert presigned.result() == PaymentRequestEnvelope.decode(payload)
+    async_payproc.presign_executor.submit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_order_in_flight_cap(mock_mqtt):
+    async_payproc = make_payproc()
+    async_payproc.admission = AdmissionControl(max_in_flight=1)
+    release = asyncio.Event()
+
+    async def get_destinations(device, order):
+        await release.wait()
+        return DESTINATIONS[:1]
+
+    async_payproc.get_destinations = get_destinations
+
+    mock_mqtt.push("merchant_order_request/device1", order("slow", "btc"))
+    mock_mqtt.push("merchant_order_request/device1", order("rejected", "btc"))
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    ack = AckMessage.decode(published(mock_mqtt, "acks/rejected")[0])
+    assert Status.INVALID == ack.status
+    assert "busy" == ack.memo
+
+    release.set()
+    await drain(async_payproc)
+    assert Status.NEW == AckMessage.decode(published(mock_mqtt, "acks/slow")[0]).status
+    assert 0 == async_payproc.admission.stats().in_flight
+
+
+@pytest.mark.asyncio
+async def test_max_orders_in_flight(mock_mqtt):
+    # the orders are handled concurrently by tasks
+    async_payproc = AsyncPayProc(KEY_FILENAME, max_orders_in_flight=1)
+    assert 1 == async_payproc.admission.max_in_flight
+
+
+@pytest.mark.asyncio
+async def test_transport_socket():
+    loop = asyncio.get_event_loop()
+    client = MagicMock()
+    read = asyncio.Event()
+    client.loop_read.side_effect = lambda: read.set()
+    transport = AsyncioMQTTTransport(client, loop)
+
+    a, b = socket.socketpair()
+    try:
+        transport._on_socket_open(client, None, a)
+        b.send(b"x")
+        await asyncio.wait_for(read.wait(), 1)
+
+        transport._closing = True
+        transport._on_socket_close(client, None, a)
+        assert transport._misc is None
+        assert transport._reconnect is None
+    finally:
+        a.close()
+        b.close()
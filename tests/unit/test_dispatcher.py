@@ -117,3 +117,24 @@ def test_register_in_class_with_kwargs():
     c = MyClass()
     c.d.dispatch("payment_requests/arg1/subtopic/arg2", payload="mypayload")
     m.assert_called_with("arg1", "arg2", "mypayload")
+
+
+def test_register_overridden_method():
+    m = MagicMock()
+
+    class Base():
+        def __init__(self):
+            self.d = Dispatcher(self)
+
+        @Dispatcher.method_topic("payment_requests/+")
+        def my_method(self, arg1):
+            m("base", arg1)
+
+    class Derived(Base):
+        def my_method(self, arg1):
+            m("derived", arg1)
+            return arg1
+
+    c = Derived()
+    assert ["arg1"] == c.d.dispatch("payment_requests/arg1")
+    m.assert_called_once_with("derived", "arg1")
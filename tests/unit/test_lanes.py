@@ -0,0 +1,65 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+import threading
+
+import pytest
+
+from manta.lanes import LanePool
+
+
+def test_order_per_key():
+    pool = LanePool(4)
+    results = {key: [] for key in ("a", "b", "c")}
+
+    for i in range(100):
+        for key, values in results.items():
+            pool.submit(key, values.append, i)
+    pool.shutdown()
+
+    for values in results.values():
+        assert list(range(100)) == values
+
+    stats = pool.stats()
+    assert 300 == stats.submitted == stats.completed
+    assert (0, 0, 0, 0) == stats.pending
+    assert 4 == len(stats.utilization)
+
+
+def test_slow_key_doesnt_block_others():
+    pool = LanePool(2)
+    keys = {pool.lane_index(key): key for key in map(str, range(10))}
+    slow, fast = keys[0], keys[1]
+    release = threading.Event()
+    done = threading.Event()
+
+    pool.submit(slow, release.wait)
+    pool.submit(fast, done.set)
+    assert done.wait(1)
+
+    stats = pool.stats()
+    assert 1 == stats.pending[0]
+    release.set()
+    pool.shutdown()
+
+
+def test_errors_are_logged(caplog):
+    pool = LanePool(1)
+    done = []
+
+    def fail():
+        raise RuntimeError("failed")
+
+    pool.submit("a", fail)
+    pool.submit("a", done.append, 1)
+    pool.shutdown()
+
+    assert [1] == done
+    assert "failed" in caplog.text
+    assert 2 == pool.stats().completed
+
+
+def test_invalid_lanes():
+    with pytest.raises(ValueError):
+        LanePool(0)
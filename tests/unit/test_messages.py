@@ -2,9 +2,367 @@
 # Manta Protocol Implementation for Python
 # Copyright (C) 2018-2019 Alessandro Viganò
 
-from manta.messages import  MerchantOrderRequestMessage
+import datetime
+from decimal import Decimal
+
+import attr
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.x509.oid import NameOID
+import pytest
+import simplejson
+
+from manta import MANTA_VERSION
+from manta.messages import (
+    AckMessage,
+    CertificateCache,
+    Destination,
+    Merchant,
+    MerchantOrderRequestMessage,
+    PaymentRequestEnvelope,
+    PaymentRequestMessage,
+    Status,
+    drop_nonattrs,
+    is_msgpack_payload,
+    msgpack_version,
+    set_json_backend,
+    structure_ignore_extras,
+    supports_msgpack,
+    verify_chain,
+    verify_many,
+)
 
 
 def test_serialize():
     payload = '{"amount": 10, "session_id": "pXbNKx8YRJ2dsIjJIfEuQA==", "fiat_currency": "eur", "crypto_currency": null}'
     order = MerchantOrderRequestMessage.from_json(payload)
+
+
+def test_roundtrip():
+    ack = AckMessage(txid="0", status=Status.NEW, amount=Decimal("0.01"))
+    assert ack == AckMessage.from_json(ack.to_json())
+
+
+def test_unstructure_decimal():
+    order = MerchantOrderRequestMessage(
+        amount=Decimal("10.50"), session_id="123", fiat_currency="eur"
+    )
+    assert "10.50" == order.unstructure()["amount"]
+
+
+def test_payment_request_roundtrip():
+    message = PaymentRequestMessage(
+        merchant=Merchant(name="Merchant 1"),
+        amount=Decimal("10"),
+        fiat_currency="eur",
+        destinations=[
+            Destination(
+                amount=Decimal("5"), destination_address="addr", crypto_currency="btc"
+            )
+        ],
+        supported_cryptos={"btc", "nano"},
+    )
+    assert message == PaymentRequestMessage.from_json(message.to_json())
+
+
+@pytest.fixture(params=["simplejson", "orjson"])
+def backend(request):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    previous = set_json_backend(request.param)
+    yield request.param
+    set_json_backend(previous)
+
+
+def test_backend_wire_format(backend):
+    message = PaymentRequestMessage(
+        merchant=Merchant(name="Merchant 1"),
+        amount=Decimal("10.50"),
+        fiat_currency="eur",
+        destinations=[],
+        supported_cryptos={"btc"},
+    )
+    decoded = simplejson.loads(message.to_json())
+    assert "10.50" == decoded["amount"]
+    assert ["btc"] == decoded["supported_cryptos"]
+    assert message == PaymentRequestMessage.from_json(message.to_json())
+
+
+@pytest.mark.parametrize("wrap", [bytes, bytearray, memoryview])
+def test_from_json_bytes(backend, wrap):
+    ack = AckMessage(txid="0", status=Status.NEW, amount=Decimal("0.01"))
+    payload = wrap(ack.to_json().encode("utf-8"))
+    assert ack == AckMessage.from_json(payload)
+
+
+def test_from_json_extra_and_missing_fields():
+    payload = '{"txid": "1", "status": "paid", "extra": {"a": 1}}'
+    ack = AckMessage.from_json(payload)
+    assert AckMessage(txid="1", status=Status.PAID, version="") == ack
+
+
+def test_drop_nonattrs():
+    d = {"name": "Merchant 1", "extra": "extra"}
+    assert {"name": "Merchant 1"} == drop_nonattrs(d, Merchant)
+    assert Merchant(name="Merchant 1") == structure_ignore_extras(d, Merchant)
+
+
+def test_drop_nonattrs_not_attrs():
+    with pytest.raises(ValueError):
+        drop_nonattrs({}, dict)
+
+
+def test_msgpack_roundtrip():
+    pytest.importorskip("msgpack")
+    message = PaymentRequestMessage(
+        merchant=Merchant(name="Merchant 1"),
+        amount=Decimal("10.50"),
+        fiat_currency="eur",
+        destinations=[
+            Destination(
+                amount=Decimal("5"), destination_address="addr", crypto_currency="btc"
+            )
+        ],
+        supported_cryptos={"btc"},
+    )
+    payload = message.encode(binary=True)
+    assert is_msgpack_payload(payload)
+    assert message == PaymentRequestMessage.decode(payload)
+    assert message == PaymentRequestMessage.decode(memoryview(payload))
+
+
+def test_decode_json():
+    ack = AckMessage(txid="0", status=Status.NEW)
+    assert not is_msgpack_payload(ack.to_json())
+    assert not is_msgpack_payload(ack.to_json().encode("utf-8"))
+    assert ack == AckMessage.decode(ack.to_json().encode("utf-8"))
+
+
+def test_supports_msgpack():
+    assert supports_msgpack(msgpack_version())
+    assert not supports_msgpack(MANTA_VERSION)
+    assert not supports_msgpack(None)
+
+
+def test_envelope_unpack_cached():
+    message = PaymentRequestMessage(
+        merchant=Merchant(name="Merchant 1"),
+        amount=Decimal("10"),
+        fiat_currency="eur",
+        destinations=[],
+        supported_cryptos={"btc"},
+    )
+    envelope = PaymentRequestEnvelope(message=message.to_json(), signature="sig")
+    assert message == envelope.unpack()
+    assert envelope.unpack() is envelope.unpack()
+    assert "_unpacked" not in envelope.unstructure()
+    assert envelope == PaymentRequestEnvelope.from_json(envelope.to_json())
+
+    with pytest.raises(attr.exceptions.FrozenInstanceError):
+        envelope.message = "{}"
+
+
+def make_certificate(name, key, issuer=None, issuer_key=None, ca=False):
+    """A certificate valid for one day"""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)])
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(issuer.subject if issuer else subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=None), True)
+        .add_extension(
+            x509.KeyUsage(not ca, False, False, False, False, ca, ca, False, False),
+            True,
+        )
+    )
+    return builder.sign(issuer_key or key, hashes.SHA256())
+
+
+@pytest.fixture(scope="module")
+def ca(tmp_path_factory):
+    ca_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    ca = make_certificate("Test CA", ca_key, ca=True)
+
+    ca_file = tmp_path_factory.mktemp("certs") / "ca.crt"
+    ca_file.write_bytes(ca.public_bytes(serialization.Encoding.PEM))
+    return ca_key, ca, str(ca_file)
+
+
+def issue(ca, key):
+    """Write a certificate for key signed by the CA and return its path"""
+    ca_key, ca_cert, ca_file = ca
+    cert = make_certificate("test", key, issuer=ca_cert, issuer_key=ca_key)
+    cert_file = "{}.{}.crt".format(ca_file, cert.serial_number)
+    with open(cert_file, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    return cert_file
+
+
+@pytest.fixture(scope="module")
+def certificates(ca):
+    """A CA and a certificate signed by it, both valid for one day"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key, issue(ca, key), ca[2]
+
+
+def test_certificate_cache(certificates):
+    _, cert_file, _ = certificates
+    cache = CertificateCache()
+
+    cert = cache.load_certificate(cert_file)
+    assert cert is cache.load_certificate(cert_file)
+    assert cache.public_key(cert_file) is cache.public_key(cert)
+
+
+def test_certificate_cache_maxsize(certificates):
+    _, cert_file, ca_file = certificates
+    cache = CertificateCache(maxsize=1)
+
+    cert = cache.load_certificate(cert_file)
+    cache.load_certificate(ca_file)
+    assert cert is not cache.load_certificate(cert_file)
+
+
+def test_certificate_cache_expired(tests_dir):
+    cache = CertificateCache()
+    # repository test certificate is expired
+    path = str(tests_dir.parent / "certificates" / "root" / "certs" / "test.crt")
+    assert cache.load_certificate(path) is not cache.load_certificate(path)
+
+
+def test_verify_cached(certificates):
+    key, cert_file, ca_file = certificates
+    message = PaymentRequestMessage(
+        merchant=Merchant(name="Merchant 1"),
+        amount=Decimal("10"),
+        fiat_currency="eur",
+        destinations=[],
+        supported_cryptos={"btc"},
+    )
+    envelope = message.get_envelope(key)
+    with open(cert_file) as f:
+        pem = f.read()
+
+    assert envelope.verify(cert_file)
+    assert envelope.verify(pem)
+    assert not attr.evolve(envelope, message=envelope.message + " ").verify(pem)
+
+    path = verify_chain(pem, ca_file)
+    assert path
+    assert path is verify_chain(pem, ca_file)
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_verify_many(certificates, processes):
+    key, cert_file, _ = certificates
+    message = PaymentRequestMessage(
+        merchant=Merchant(name="Merchant 1"),
+        amount=Decimal("10"),
+        fiat_currency="eur",
+        destinations=[],
+        supported_cryptos={"btc"},
+    )
+    envelope = message.get_envelope(key)
+    envelopes = [
+        envelope,
+        attr.evolve(envelope, message=envelope.message + " "),
+        attr.evolve(envelope, signature="invalid"),
+        envelope,
+    ]
+
+    results = verify_many(envelopes, cert_file, max_workers=2, processes=processes)
+    assert [True, False, False, True] == results
+    assert [] == verify_many([], cert_file)
+
+
+def test_get_destination():
+    btc = Destination(amount=Decimal("5"), destination_address="a", crypto_currency="btc")
+    nano = Destination(
+        amount=Decimal("10"), destination_address="b", crypto_currency="NANO"
+    )
+    message = PaymentRequestMessage(
+        merchant=Merchant(name="Merchant 1"),
+        amount=Decimal("10"),
+        fiat_currency="eur",
+        destinations=[btc, nano],
+        supported_cryptos={"btc", "NANO", "xmr"},
+    )
+    assert btc is message.get_destination("BTC")
+    assert nano is message.get_destination("nano")
+    assert message.get_destination("xmr") is None
+    assert message.is_supported("XMR")
+    assert not message.is_supported("eth")
+
+    message.destinations = [btc]
+    message.supported_cryptos = {"btc"}
+    assert message.get_destination("nano") is None
+    assert not message.is_supported("xmr")
+    assert message == PaymentRequestMessage.from_json(message.to_json())
+
+
+def test_index_not_serialized():
+    message = PaymentRequestMessage(
+        merchant=Merchant(name="Merchant 1"),
+        amount=Decimal("10"),
+        fiat_currency="eur",
+        destinations=[
+            Destination(amount=Decimal("5"), destination_address="a", crypto_currency="btc")
+        ],
+        supported_cryptos={"btc"},
+    )
+    expected = message.to_json()
+    message.get_destination("btc")
+
+    assert "_index" not in message.unstructure()
+    assert expected == message.to_json()
+    assert message == PaymentRequestMessage.from_json(message.to_json())
+
+
+@pytest.mark.parametrize(
+    "key, algorithm",
+    [
+        (ec.generate_private_key(ec.SECP256R1()), "ES256"),
+        (ed25519.Ed25519PrivateKey.generate(), "EdDSA"),
+    ],
+)
+def test_envelope_algorithms(ca, key, algorithm):
+    cert_file = issue(ca, key)
+    message = PaymentRequestMessage(
+        merchant=Merchant(name="Merchant 1"),
+        amount=Decimal("10"),
+        fiat_currency="eur",
+        destinations=[],
+        supported_cryptos={"btc"},
+    )
+    envelope = message.get_envelope(key)
+
+    assert algorithm == envelope.algorithm
+    decoded = PaymentRequestEnvelope.from_json(envelope.to_json())
+    assert decoded.verify(cert_file)
+    assert not attr.evolve(decoded, algorithm="RS256").verify(cert_file)
+    assert verify_chain(cert_file, ca[2])
+    assert [True] == verify_many([decoded], cert_file)
+
+
+def test_envelope_default_algorithm(certificates):
+    key, cert_file, _ = certificates
+    message = PaymentRequestMessage(
+        merchant=Merchant(name="Merchant 1"),
+        amount=Decimal("10"),
+        fiat_currency="eur",
+        destinations=[],
+        supported_cryptos={"btc"},
+    )
+    data = simplejson.loads(message.get_envelope(key).to_json())
+    assert "RS256" == data.pop("algorithm")
+
+    # envelopes of previous versions don't advertise the algorithm
+    envelope = PaymentRequestEnvelope.from_json(simplejson.dumps(data))
+    assert "RS256" == envelope.algorithm
+    assert envelope.verify(cert_file)
@@ -2,6 +2,11 @@
 # Manta Protocol Implementation for Python
 # Copyright (C) 2018-2019 Alessandro Viganò
 
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import time
+from unittest.mock import MagicMock
+
 import pytest
 import simplejson as json
 import attr
@@ -16,11 +21,32 @@ from manta.messages import (
     AckMessage,
     Status,
     Merchant,
+    PaymentRequestEnvelope,
+    is_msgpack_payload,
+    msgpack_version,
+    supports_msgpack,
+)
+from manta.payproc import (
+    EnvelopeCache,
+    PayProc,
+    TXStorageMemory,
+    session_owner,
+    worker_topic,
 )
-from manta.payproc import PayProc, TXStorageMemory
+from manta.admission import AdmissionControl
+from manta.lanes import LanePool
+from manta.signing import SigningPool
+from manta.txid import CounterAllocator
 
 # pytest.register_assert_rewrite("tests.utils")
-from tests.utils import JsonContains
+from tests.utils import (
+    CERTIFICATE_FILENAME,
+    DESTINATIONS,
+    HELLO_SIGNED,
+    KEY_FILENAME,
+    MERCHANT,
+    JsonContains,
+)
 from decimal import Decimal
 
 PRIV_KEY_DATA = b"""\
@@ -76,29 +102,6 @@ z4TYl3Vuacma4wEMQGqhJSWv0gjRQg==
 -----END CERTIFICATE-----
 """
 
-HELLO_SIGNED = (
-    b"LJH1BHPP/KmEnqyz24eb3ph8nyhS9TjVT1jnw7oSU3vbwoj9MMePwBifBbnpvFHl6KSUnTcX0I3OK6MSdF"
-    b"m6/1I+i7RkyNeAIkN/boF46xRucuaaevfk5PWuHKJSPsQt6QLs3TyQUet+WLTu8sxIs29+wLTn71dzFfAe45YesIOoKhboyiPO23"
-    b"Di8sLuFQCiW4uau4SttMK8+MCHMmQzShdu922JMHFv1l2sbqfnM0LNFzWIbVs35Q4pNow0P6gzECSOpREwdy5S793YJdA7goZNCM"
-    b"QB6LpOEnuXBeA1wJ5t3fnSANUvXewyaMiNIXz93vh9UrDel7NITHo46dVKXw=="
-)
-
-KEY_FILENAME = "certificates/root/keys/test.key"
-CERTIFICATE_FILENAME = "certificates/root/certs/AppiaDeveloperCA.crt"
-
-DESTINATIONS = [
-    Destination(
-        amount=Decimal("5"), destination_address="btc_daddress", crypto_currency="btc"
-    ),
-    Destination(
-        amount=Decimal("10"),
-        destination_address="nano_daddress",
-        crypto_currency="nano",
-    ),
-]
-
-MERCHANT = Merchant(name="Merchant 1", address="5th Avenue")
-
 
 @pytest.fixture
 def payproc():
@@ -182,6 +185,15 @@ def test_on_connect(mock_mqtt, payproc):
     mock_mqtt.publish.assert_called_with("certificate", certificate, retain=True)
 
 
+def test_on_connect_sessions(mock_mqtt, payproc):
+    test_receive_merchant_order_request(mock_mqtt, payproc)
+    payproc.run()
+
+    mock_mqtt.subscribe.assert_any_call(
+        [("payment_requests/1423/+", 0), ("payments/1423", 0)]
+    )
+
+
 def test_receive_merchant_order_request(mock_mqtt, payproc):
     request = MerchantOrderRequestMessage(
         amount=Decimal("1000"), session_id="1423", fiat_currency="eur",
@@ -467,3 +479,373 @@ class TestTXStorageMemory:
 
         assert 1 == len(tx_storage)
         assert Status.NEW == tx_storage.get_state_for_session("321").ack.status
+
+    def test_ack_paid_twice(self, tx_storage):
+        self.test_create(tx_storage)
+        state = tx_storage.get_state_for_session("123")
+
+        state.ack = attr.evolve(state.ack, status=Status.PAID)
+        state.ack = attr.evolve(state.ack, status=Status.INVALID)
+
+        assert 0 == len(tx_storage)
+
+    def test_ack_paid_recreated(self, tx_storage):
+        self.test_create(tx_storage)
+        old = tx_storage.get_state_for_session("123")
+        ack = AckMessage(amount=Decimal("10"), status=Status.NEW, txid="1")
+        tx_storage.create(1, "123", "app0@user0", old.order, ack)
+
+        old.ack = attr.evolve(old.ack, status=Status.INVALID)
+
+        assert 1 == tx_storage.get_state_for_session("123").txid
+
+    def test_get_state_for_txid(self, tx_storage):
+        self.test_ack_paid(tx_storage)
+
+        assert "321" == tx_storage.get_state_for_txid(1).session_id
+        with pytest.raises(KeyError):
+            tx_storage.get_state_for_txid(0)
+
+    def test_dump_load(self, tx_storage, tmp_path):
+        self.test_create(tx_storage)
+        ack = AckMessage(amount=Decimal("10"), status=Status.NEW, txid="1")
+        order = MerchantOrderRequestMessage(
+            amount=Decimal("10"), session_id="321", fiat_currency="EUR"
+        )
+        tx_storage.create(1, "321", "app0@user0", order, ack)
+        tx_storage.get_state_for_session("321").wallet_request = "all"
+        path = str(tmp_path / "sessions")
+        tx_storage.dump(path)
+
+        restored = TXStorageMemory()
+        restored.load(path)
+        assert 2 == len(restored)
+        assert {"123", "321"} == set(restored.session_ids())
+        assert restored.session_exists("321")
+        assert not restored.session_exists("999")
+        # nothing decoded yet
+        assert {} == restored.states
+
+        state = restored.get_state_for_txid(1)
+        assert "all" == state.wallet_request
+        assert state is restored.get_state_for_session("321")
+        assert Decimal("10") == state.order.amount
+
+        state.ack = attr.evolve(state.ack, status=Status.PAID)
+        assert not restored.session_exists("321")
+        assert 1 == len(restored)
+        with pytest.raises(KeyError):
+            restored.get_state_for_session("321")
+
+        # sessions never accessed are copied to the new snapshot
+        restored.dump(path)
+        restored = TXStorageMemory()
+        restored.load(path)
+        assert ["123"] == list(restored.session_ids())
+        assert Status.NEW == restored.get_state_for_session("123").ack.status
+
+
+@pytest.fixture
+def payproc_msgpack(payproc):
+    pytest.importorskip("msgpack")
+    payproc.msgpack = True
+    return payproc
+
+
+class AckEqual(Matcher):
+    def __init__(self, ack: AckMessage, binary: bool):
+        self.ack = ack
+        self.binary = binary
+
+    def match(self, value):
+        assert self.binary == is_msgpack_payload(value)
+        assert self.ack == AckMessage.decode(value)
+        return True
+
+
+def test_msgpack_negotiation(mock_mqtt, payproc_msgpack):
+    request = MerchantOrderRequestMessage(
+        amount=Decimal("1000"),
+        session_id="1423",
+        fiat_currency="eur",
+        version=msgpack_version(),
+    )
+    mock_mqtt.push("merchant_order_request/device1", request.to_json())
+
+    ack = AckMessage(txid="0", url="manta://localhost/1423", status=Status.NEW)
+    mock_mqtt.publish.assert_any_call("acks/1423", AckEqual(ack, binary=True))
+
+    mock_mqtt.push("payment_requests/1423/all", msgpack_version().encode("utf-8"))
+    envelope = PaymentRequestEnvelope.decode(mock_mqtt.publish.call_args[0][1])
+    assert is_msgpack_payload(mock_mqtt.publish.call_args[0][1])
+    assert supports_msgpack(envelope.version)
+
+    message = PaymentMessage(crypto_currency="NANO", transaction_hash="myhash")
+    mock_mqtt.push("payments/1423", message.to_msgpack())
+
+    ack = attr.evolve(
+        ack,
+        status=Status.PENDING,
+        url=None,
+        transaction_hash="myhash",
+        transaction_currency="NANO",
+    )
+    mock_mqtt.publish.assert_called_with("acks/1423", AckEqual(ack, binary=True))
+
+
+def test_msgpack_legacy_wallet(mock_mqtt, payproc_msgpack):
+    request = MerchantOrderRequestMessage(
+        amount=Decimal("1000"),
+        session_id="1423",
+        fiat_currency="eur",
+        version=msgpack_version(),
+    )
+    mock_mqtt.push("merchant_order_request/device1", request.to_json())
+    mock_mqtt.push("payment_requests/1423/all", b"")
+
+    assert not is_msgpack_payload(mock_mqtt.publish.call_args[0][1])
+
+    payproc_msgpack.confirm("1423")
+    ack = AckMessage(txid="0", status=Status.PAID)
+    mock_mqtt.publish.assert_called_with("acks/1423", AckEqual(ack, binary=False))
+
+
+def test_get_payment_request_signing_pool(mock_mqtt, payproc):
+    with open(KEY_FILENAME, "rb") as myfile:
+        payproc.signing_pool = SigningPool(myfile.read(), workers=2)
+    test_receive_merchant_order_request(mock_mqtt, payproc)
+    mock_mqtt.push("payment_requests/1423/all", "")
+    payproc.signing_pool.shutdown()
+
+    expected = PaymentRequestMessage(
+        merchant=MERCHANT,
+        fiat_currency="eur",
+        amount=Decimal("1000"),
+        destinations=DESTINATIONS,
+        supported_cryptos={"nano", "btc", "xmr"},
+    )
+
+    topic, payload = mock_mqtt.publish.call_args[0]
+    envelope = PaymentRequestEnvelope.decode(payload)
+    assert "payment_requests/1423" == topic
+    assert expected == envelope.unpack()
+    assert expected == payproc.tx_storage.get_state_for_session("1423").payment_request
+    assert 1 == payproc.signing_pool.stats().completed
+
+
+def test_get_payment_request_signing_pool_locked(mock_mqtt, payproc):
+    with open(KEY_FILENAME, "rb") as myfile:
+        payproc.signing_pool = SigningPool(myfile.read(), workers=1)
+    test_receive_merchant_order_request(mock_mqtt, payproc)
+
+    # the signing thread waits for the merchant confirming the session
+    with payproc.session_lock("1423"):
+        mock_mqtt.push("payment_requests/1423/all", "")
+        while payproc.signing_pool.stats().completed == 0:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        assert "acks/1423" == mock_mqtt.publish.call_args[0][0]
+        payproc.confirm("1423")
+
+    payproc.signing_pool.shutdown()
+    # session completed while signing
+    topics = [c[0][0] for c in mock_mqtt.publish.call_args_list]
+    assert ["acks/1423", "acks/1423"] == topics[-2:]
+    ack = AckMessage.decode(mock_mqtt.publish.call_args[0][1])
+    assert Status.PAID == ack.status
+
+def test_get_payment_request_cached(mock_mqtt, payproc):
+    payproc.envelope_cache = EnvelopeCache(ttl=60)
+    test_receive_merchant_order_request(mock_mqtt, payproc)
+
+    mock_mqtt.push("payment_requests/1423/all", "")
+    first = mock_mqtt.publish.call_args
+
+    payproc.get_merchant = MagicMock(side_effect=AssertionError)
+    mock_mqtt.push("payment_requests/1423/all", "")
+    assert first == mock_mqtt.publish.call_args
+
+    payproc.confirming("1423")
+    assert 0 == len(payproc.envelope_cache)
+
+
+def test_envelope_cache_ttl():
+    cache = EnvelopeCache(ttl=-1)
+    envelope = PaymentRequestEnvelope(message="{}", signature="")
+    cache.put("123", "all", envelope)
+    assert cache.get("123", "all") is None
+    assert 0 == len(cache)
+
+
+def test_envelope_cache_maxsize():
+    cache = EnvelopeCache(ttl=60, maxsize=2)
+    envelope = PaymentRequestEnvelope(message="{}", signature="")
+    cache.put("1", "all", envelope)
+    cache.put("1", "btc", envelope)
+    cache.put("2", "all", envelope)
+    assert cache.get("1", "all") is None
+    assert envelope is cache.get("2", "all")
+    cache.invalidate("1")
+    assert 1 == len(cache)
+
+
+def test_get_payment_request_presigned(mock_mqtt, payproc):
+    payproc.presign_executor = ThreadPoolExecutor(max_workers=1)
+    test_receive_merchant_order_request(mock_mqtt, payproc)
+
+    future = payproc.presigned["1423"]
+    future.result(timeout=10)
+
+    payproc.get_merchant = MagicMock(side_effect=AssertionError)
+    mock_mqtt.push("payment_requests/1423/all", "")
+
+    mock_mqtt.publish.assert_called_with("payment_requests/1423", future.result().encode())
+    assert "1423" not in payproc.presigned
+    payproc.presign_executor.shutdown()
+
+
+def test_presign_signing_pool(mock_mqtt, payproc):
+    payproc.presign_executor = ThreadPoolExecutor(max_workers=1)
+    with open(KEY_FILENAME, "rb") as myfile:
+        payproc.signing_pool = SigningPool(myfile.read(), workers=1)
+    test_receive_merchant_order_request(mock_mqtt, payproc)
+
+    envelope = payproc.presigned["1423"].result(timeout=10)
+    payproc.presign_executor.shutdown()
+    payproc.signing_pool.shutdown()
+
+    assert 1 == payproc.signing_pool.stats().completed
+    assert DESTINATIONS == envelope.unpack().destinations
+
+def test_presigned_dropped_on_state_change(mock_mqtt, payproc):
+    payproc.presign_executor = ThreadPoolExecutor(max_workers=1)
+    test_receive_merchant_order_request(mock_mqtt, payproc)
+
+    payproc.confirming("1423")
+    assert "1423" not in payproc.presigned
+    payproc.presign_executor.shutdown()
+
+
+def test_retain_payment_request(mock_mqtt, payproc):
+    payproc.retain_payment_requests = True
+    test_receive_merchant_order_request(mock_mqtt, payproc)
+
+    topic, payload = mock_mqtt.publish.call_args[0]
+    assert "payment_requests/1423" == topic
+    assert mock_mqtt.publish.call_args[1] == {"retain": True}
+
+    expected = PaymentRequestMessage(
+        merchant=MERCHANT,
+        fiat_currency="eur",
+        amount=Decimal("1000"),
+        destinations=DESTINATIONS,
+        supported_cryptos={"nano", "btc", "xmr"},
+    )
+    assert expected == PaymentRequestEnvelope.decode(payload).unpack()
+    assert expected == payproc.tx_storage.get_state_for_session("1423").payment_request
+
+    payproc.invalidate("1423", "Timeout")
+    mock_mqtt.publish.assert_called_with("payment_requests/1423", b"", retain=True)
+
+
+def test_workers(mock_mqtt, payproc):
+    payproc.workers = 2
+    payproc.worker_index = session_owner("1423", 2)
+    payproc.txid_allocator = CounterAllocator(payproc.worker_index, step=2)
+    other = 1 - payproc.worker_index
+    session_id = next(
+        str(i) for i in itertools.count() if session_owner(str(i), 2) == other
+    )
+
+    request = MerchantOrderRequestMessage(
+        amount=Decimal("1000"), session_id=session_id, fiat_currency="eur",
+    )
+    mock_mqtt.push("merchant_order_request/device1", request.to_json())
+    mock_mqtt.publish.assert_called_with(
+        worker_topic("payproc", other, "device1"), request.to_json()
+    )
+    assert not payproc.tx_storage.session_exists(session_id)
+
+    request = attr.evolve(request, session_id="1423")
+    mock_mqtt.push(worker_topic("payproc", payproc.worker_index, "device1"), request.to_json())
+    state = payproc.tx_storage.get_state_for_session("1423")
+    assert payproc.worker_index == state.txid
+    assert payproc.worker_index + 2 == payproc.txid_allocator.next()
+
+
+def test_workers_txid(mock_mqtt):
+    pp = PayProc(KEY_FILENAME, starting_txid=5, workers=4, worker_index=2)
+    assert 6 == pp.txid
+    assert 6 == pp.txid_allocator.next()
+    assert 10 == pp.txid
+    assert 10 == pp.txid_allocator.next()
+
+    with pytest.raises(ValueError):
+        PayProc(KEY_FILENAME, workers=2, worker_index=2)
+
+
+def test_dispatch_pool(mock_mqtt, payproc):
+    payproc.dispatch_pool = LanePool(4)
+    for session_id in ("1423", "1424"):
+        request = MerchantOrderRequestMessage(
+            amount=Decimal("1000"), session_id=session_id, fiat_currency="eur",
+        )
+        mock_mqtt.push("merchant_order_request/device1", request.to_json())
+        mock_mqtt.push("payment_requests/{}/all".format(session_id), "")
+        mock_mqtt.push("merchant_order_cancel/{}".format(session_id), "")
+    payproc.dispatch_pool.shutdown()
+
+    for session_id in ("1423", "1424"):
+        topics = [
+            c[0][0] for c in mock_mqtt.publish.call_args_list if session_id in c[0][0]
+        ]
+        assert [
+            "acks/" + session_id,
+            "payment_requests/" + session_id,
+            "acks/" + session_id,
+        ] == topics
+
+    stats = payproc.dispatch_pool.stats()
+    assert 6 == stats.completed
+
+
+def test_order_rejected_busy(mock_mqtt, payproc):
+    payproc.admission = AdmissionControl(rate=1, burst=1)
+
+    for session_id in ("1423", "1424"):
+        request = MerchantOrderRequestMessage(
+            amount=Decimal("1000"), session_id=session_id, fiat_currency="eur",
+        )
+        mock_mqtt.push("merchant_order_request/device1", request.to_json())
+
+    accepted = AckMessage(txid="0", url="manta://localhost/1423", status=Status.NEW)
+    mock_mqtt.publish.assert_any_call("acks/1423", JsonContains(accepted))
+    mock_mqtt.publish.assert_called_with(
+        "acks/1424", JsonContains(AckMessage(txid="", status=Status.INVALID, memo="busy"))
+    )
+    assert not payproc.tx_storage.session_exists("1424")
+    assert 0 == payproc.admission.stats().in_flight
+    assert 1 == payproc.admission.stats().rejected_rate
+
+
+def test_admission_options(mock_mqtt):
+    pp = PayProc(KEY_FILENAME, order_rate=10, max_orders_in_flight=100, dispatch_workers=1)
+    assert 10 == pp.admission.burst
+    assert 100 == pp.admission.max_in_flight
+    pp.close()
+    assert PayProc(KEY_FILENAME).admission is None
+
+    # without dispatch threads there's only one order in flight
+    with pytest.raises(ValueError):
+        PayProc(KEY_FILENAME, max_orders_in_flight=1)
+
+
+def test_close(mock_mqtt):
+    pp = PayProc(KEY_FILENAME, dispatch_workers=2, signing_workers=1, presign_workers=1)
+    pp.close()
+
+    assert all(not lane.thread.is_alive() for lane in pp.dispatch_pool._lanes)
+    with pytest.raises(RuntimeError):
+        pp.presign_executor.submit(print)
+    with pytest.raises(RuntimeError):
+        pp.signing_pool.submit(b"message")
@@ -0,0 +1,58 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+import pytest
+
+from manta.signing import (
+    ES256,
+    EDDSA,
+    RS256,
+    SigningPool,
+    get_signer,
+    get_verifier,
+)
+
+from tests.utils import HELLO_SIGNED, KEY_FILENAME
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_signing_pool(processes):
+    with open(KEY_FILENAME, "rb") as myfile:
+        key_data = myfile.read()
+
+    pool = SigningPool(key_data, workers=2, processes=processes)
+    futures = [pool.submit(b"Hello") for _ in range(4)]
+
+    assert [HELLO_SIGNED] * 4 == [f.result(timeout=10) for f in futures]
+
+    pool.shutdown()
+    stats = pool.stats()
+    assert 2 == stats.workers
+    assert 0 == stats.pending
+    assert 4 == stats.submitted == stats.completed
+    assert 1 <= stats.max_pending <= 4
+
+
+@pytest.mark.parametrize(
+    "key, algorithm",
+    [
+        (rsa.generate_private_key(public_exponent=65537, key_size=2048), RS256),
+        (ec.generate_private_key(ec.SECP256R1()), ES256),
+        (ed25519.Ed25519PrivateKey.generate(), EDDSA),
+    ],
+)
+def test_signer(key, algorithm):
+    signer = get_signer(key)
+    verifier = get_verifier(key.public_key())
+    assert algorithm == signer.algorithm == verifier.algorithm
+
+    signature = signer.sign(b"Hello")
+    assert verifier.verify(signature, b"Hello")
+    assert not verifier.verify(signature, b"Hello!")
+
+
+def test_unsupported_curve():
+    with pytest.raises(ValueError):
+        get_signer(ec.generate_private_key(ec.SECP384R1()))
@@ -6,8 +6,8 @@ import re
 
 import pytest
 
-from manta.store import Store
-from manta.messages import AckMessage, Status, MerchantOrderRequestMessage
+from manta.store import PaymentProcessorBusy, Store
+from manta.messages import AckMessage, BUSY_MEMO, Status, MerchantOrderRequestMessage
 
 BASE64PATTERN = "(?:[A-Za-z0-9+/]{4})*(?:[A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?"
 BASE64PATTERNSAFE = "(?:[A-Za-z0-9_-]{4})*(?:[A-Za-z0-9_-]{2}==|[A-Za-z0-9_-]{3}=)?"
@@ -71,3 +71,21 @@ async def test_ack(mock_mqtt):
 
     ack_message = await store.acks.get()
     assert expected_ack == ack_message
+
+
+@pytest.mark.asyncio
+async def test_busy(mock_mqtt):
+    store = Store('device1')
+
+    def se(topic, payload):
+        nonlocal mock_mqtt
+
+        if topic == "merchant_order_request/device1":
+            order = MerchantOrderRequestMessage.from_json(payload)
+            reply = AckMessage(txid="", status=Status.INVALID, memo=BUSY_MEMO)
+            mock_mqtt.push("acks/{}".format(order.session_id), reply.to_json())
+
+    mock_mqtt.publish.side_effect = se
+
+    with pytest.raises(PaymentProcessorBusy):
+        await store.merchant_order_request(amount=10, fiat='eur')
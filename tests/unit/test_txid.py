@@ -0,0 +1,64 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from manta.txid import (
+    BlockAllocator,
+    CounterAllocator,
+    FileBlockStore,
+    SQLiteBlockStore,
+)
+
+
+def test_counter():
+    allocator = CounterAllocator(3, step=2)
+    assert 3 == allocator.peek()
+    assert [3, 5, 7] == [allocator.next() for _ in range(3)]
+    assert 9 == allocator.peek()
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def make_store(request, tmp_path):
+    path = str(tmp_path / "txid")
+
+    def make(start=0):
+        if request.param == "file":
+            return FileBlockStore(path, start=start)
+        return SQLiteBlockStore(path, start=start)
+
+    return make
+
+
+def test_block_allocator(make_store):
+    allocator = BlockAllocator(make_store(start=10), block_size=3)
+    assert allocator.peek() is None
+    assert [10, 11, 12, 13] == [allocator.next() for _ in range(4)]
+
+    # restarted, the rest of the block is skipped
+    allocator = BlockAllocator(make_store(), block_size=3)
+    assert 16 == allocator.next()
+
+
+def test_block_allocator_threads(make_store):
+    allocator = BlockAllocator(make_store(), block_size=7)
+    with ThreadPoolExecutor(8) as executor:
+        txids = list(executor.map(lambda _: allocator.next(), range(1000)))
+    assert sorted(txids) == list(range(1000))
+
+
+def _allocate(store, count):
+    allocator = BlockAllocator(store, block_size=5)
+    return [allocator.next() for _ in range(count)]
+
+
+def test_block_allocator_processes(tmp_path):
+    store = FileBlockStore(str(tmp_path / "txid"))
+    with ProcessPoolExecutor(4) as executor:
+        results = list(executor.map(_allocate, [store] * 4, [23] * 4))
+
+    txids = [txid for result in results for txid in result]
+    assert len(set(txids)) == len(txids)
@@ -0,0 +1,318 @@
+# Manta Python
+# Manta Protocol Implementation for Python
+# Copyright (C) 2018-2019 Alessandro Viganò
+
+from decimal import Decimal
+import os
+import threading
+
+import attr
+import pytest
+
+from manta.messages import AckMessage, MerchantOrderRequestMessage, Status
+from manta.payproc import PayProc, TXStorageMemory, TxidInUse
+from manta.snapshot import FIELDS
+from manta.txstorage import (
+    CorruptedJournal,
+    StateChange,
+    TXStorageJournal,
+    TXStorageSQLite,
+    TXStorageWriteBehind,
+    encode_record,
+)
+
+from tests.utils import KEY_FILENAME
+
+
+@pytest.fixture()
+def db_path(tmp_path):
+    return str(tmp_path / "tx.db")
+
+
+def create(tx_storage, txid, session_id):
+    ack = AckMessage(amount=Decimal("10"), status=Status.NEW, txid=str(txid))
+    order = MerchantOrderRequestMessage(
+        amount=Decimal("10"), session_id=session_id, fiat_currency="EUR"
+    )
+    return tx_storage.create(txid, session_id, "app0@user0", order, ack)
+
+
+class TestTXStorageSQLite:
+    def test_reload(self, db_path):
+        tx_storage = TXStorageSQLite(db_path)
+        create(tx_storage, 0, "123")
+        state = create(tx_storage, 1, "321")
+        state.ack = attr.evolve(state.ack, status=Status.PENDING)
+        state.wallet_request = "all"
+        tx_storage.close()
+
+        tx_storage = TXStorageSQLite(db_path)
+        assert 2 == len(tx_storage)
+        state = tx_storage.get_state_for_session("321")
+        assert Status.PENDING == state.ack.status
+        assert "all" == state.wallet_request
+        assert Decimal("10") == state.order.amount
+        assert state is tx_storage.get_state_for_txid(1)
+        assert 2 == tx_storage.next_txid()
+        tx_storage.close()
+
+    def test_flush_during_change(self, db_path):
+        tx_storage = TXStorageSQLite(db_path, flush_interval=0)
+        state = create(tx_storage, 0, "123")
+        tx_storage.flush()
+        mark = tx_storage._mark
+
+        def mark_and_flush(state, key):
+            mark(state, key)
+            # the flush timer runs right after the notification
+            tx_storage.flush()
+
+        tx_storage._mark = mark_and_flush
+        state.ack = attr.evolve(state.ack, status=Status.PAID)
+        tx_storage._mark = mark
+        tx_storage.close()
+
+        tx_storage = TXStorageSQLite(db_path)
+        assert not tx_storage.session_exists("123")
+        tx_storage.close()
+
+    def test_completed_not_loaded(self, db_path):
+        tx_storage = TXStorageSQLite(db_path)
+        state = create(tx_storage, 0, "123")
+        create(tx_storage, 1, "321")
+        state.ack = attr.evolve(state.ack, status=Status.PAID)
+        assert not tx_storage.session_exists("123")
+        tx_storage.close()
+
+        tx_storage = TXStorageSQLite(db_path)
+        assert not tx_storage.session_exists("123")
+        assert tx_storage.session_exists("321")
+        # the changes of reloaded sessions are saved
+        tx_storage.get_state_for_session("321").ack = attr.evolve(
+            state.ack, status=Status.INVALID, txid="1"
+        )
+        tx_storage.close()
+
+        tx_storage = TXStorageSQLite(db_path)
+        assert 0 == len(tx_storage)
+        assert 2 == tx_storage.next_txid()
+        tx_storage.close()
+
+    def test_txid_not_reused(self, db_path, mock_mqtt):
+        tx_storage = TXStorageSQLite(db_path)
+        create(tx_storage, 0, "A")
+        tx_storage.close()
+
+        tx_storage = TXStorageSQLite(db_path)
+        with pytest.raises(TxidInUse):
+            create(tx_storage, 0, "B")
+        assert 1 == PayProc(KEY_FILENAME, tx_storage=tx_storage).txid
+        assert 5 == PayProc(KEY_FILENAME, tx_storage=tx_storage, starting_txid=5).txid
+        tx_storage.close()
+
+    def test_empty(self, db_path):
+        tx_storage = TXStorageSQLite(db_path)
+        assert 0 == tx_storage.next_txid()
+        tx_storage.close()
+
+    def test_write_behind(self, db_path):
+        tx_storage = TXStorageSQLite(db_path, flush_interval=0)
+        writes = []
+        write_batch = tx_storage.write_batch
+        tx_storage.write_batch = lambda changes: writes.append(changes) or write_batch(
+            changes
+        )
+
+        state = create(tx_storage, 0, "123")
+        state.wallet_request = "all"
+        state.ack = attr.evolve(state.ack, status=Status.PENDING)
+        tx_storage.flush()
+
+        state.wallet_request = "btc"
+        state.wallet_version = "1.6"
+        state.wallet_request = "nano"
+        tx_storage.flush()
+        tx_storage.flush()
+
+        assert 2 == len(writes)
+        assert writes[0][0].created
+        assert not writes[1][0].created
+        assert {"wallet_request", "wallet_version"} == writes[1][0].fields
+        tx_storage.close()
+
+        tx_storage = TXStorageSQLite(db_path)
+        state = tx_storage.get_state_for_session("123")
+        assert "nano" == state.wallet_request
+        assert Status.PENDING == state.ack.status
+        tx_storage.close()
+
+
+@pytest.fixture()
+def journal_path(tmp_path):
+    return str(tmp_path / "payproc")
+
+
+class TestTXStorageJournal:
+    def test_reload(self, journal_path):
+        tx_storage = TXStorageJournal(journal_path, flush_interval=0)
+        create(tx_storage, 0, "123")
+        state = create(tx_storage, 1, "321")
+        tx_storage.flush()
+        state.ack = attr.evolve(state.ack, status=Status.PENDING)
+        state.wallet_request = "all"
+        tx_storage.get_state_for_session("123").ack = attr.evolve(
+            state.ack, status=Status.PAID, txid="0"
+        )
+        tx_storage.close()
+
+        tx_storage = TXStorageJournal(journal_path)
+        assert 1 == len(tx_storage)
+        state = tx_storage.get_state_for_txid(1)
+        assert Status.PENDING == state.ack.status
+        assert "all" == state.wallet_request
+        assert Decimal("10") == state.order.amount
+        tx_storage.close()
+
+    def test_incomplete_record(self, journal_path):
+        tx_storage = TXStorageJournal(journal_path)
+        create(tx_storage, 0, "123")
+        tx_storage.close()
+
+        with open(journal_path + ".log", "ab") as f:
+            f.write(b"\x00\x00\x01\x00garbage")
+
+        tx_storage = TXStorageJournal(journal_path)
+        create(tx_storage, 1, "321")
+        tx_storage.close()
+
+        tx_storage = TXStorageJournal(journal_path)
+        assert 2 == len(tx_storage)
+        tx_storage.close()
+
+    def test_compaction(self, journal_path):
+        tx_storage = TXStorageJournal(journal_path, compact_every=3, flush_interval=0)
+        for txid in range(5):
+            state = create(tx_storage, txid, str(txid))
+            tx_storage.flush()
+            state.wallet_request = "all"
+            tx_storage.sync()
+        state.ack = attr.evolve(state.ack, status=Status.INVALID)
+        tx_storage.close()
+
+        assert os.path.exists(journal_path + ".snapshot")
+
+        tx_storage = TXStorageJournal(journal_path)
+        assert 4 == len(tx_storage)
+        assert all(state.wallet_request == "all" for _, state in tx_storage)
+        tx_storage.close()
+
+    def test_compaction_after_reload(self, journal_path):
+        tx_storage = TXStorageJournal(journal_path, compact_every=0, flush_interval=0)
+        for txid in range(3):
+            create(tx_storage, txid, str(txid))
+            tx_storage.flush()
+        tx_storage.close()
+
+        # the replayed records count toward compact_every
+        tx_storage = TXStorageJournal(journal_path, compact_every=4, flush_interval=0)
+        create(tx_storage, 3, "3")
+        tx_storage.sync()
+        assert os.path.exists(journal_path + ".snapshot")
+        assert 0 == os.path.getsize(journal_path + ".log")
+        tx_storage.close()
+
+        tx_storage = TXStorageJournal(journal_path)
+        assert 4 == len(tx_storage)
+        tx_storage.close()
+
+    def test_txid_not_reused(self, journal_path, mock_mqtt):
+        tx_storage = TXStorageJournal(journal_path, compact_every=3, flush_interval=0)
+        create(tx_storage, 0, "A")
+        state = create(tx_storage, 1, "B")
+        tx_storage.sync()
+        state.ack = attr.evolve(state.ack, status=Status.PAID)
+        tx_storage.close()
+
+        # B was completed before the compaction, only the snapshot has its txid
+        assert 0 == os.path.getsize(journal_path + ".log")
+        tx_storage = TXStorageJournal(journal_path)
+        assert ["A"] == list(tx_storage.session_ids())
+        assert 2 == tx_storage.next_txid()
+        with pytest.raises(TxidInUse):
+            create(tx_storage, 0, "C")
+        assert 2 == PayProc(KEY_FILENAME, tx_storage=tx_storage).txid
+        tx_storage.close()
+
+    def test_duplicate_txid(self, journal_path):
+        with open(journal_path + ".log", "wb") as f:
+            for session_id in ("A", "B"):
+                state = create(TXStorageMemory(), 0, session_id)
+                f.write(encode_record(StateChange(state, frozenset(FIELDS), True)))
+
+        with pytest.raises(CorruptedJournal):
+            TXStorageJournal(journal_path)
+
+    def test_standby(self, journal_path):
+        active = TXStorageJournal(journal_path, compact_every=2, flush_interval=0)
+        create(active, 0, "123")
+        active.sync()
+
+        standby = TXStorageJournal(journal_path, standby=True)
+        assert standby.session_exists("123")
+
+        state = create(active, 1, "321")
+        active.sync()
+        # compacted
+        state.ack = attr.evolve(state.ack, status=Status.PENDING)
+        active.sync()
+
+        assert 0 < standby.catch_up()
+        assert Status.PENDING == standby.get_state_for_session("321").ack.status
+        active.close()
+
+        standby.promote()
+        state = standby.get_state_for_session("321")
+        state.ack = attr.evolve(state.ack, status=Status.PAID)
+        standby.close()
+
+        tx_storage = TXStorageJournal(journal_path)
+        assert not tx_storage.session_exists("321")
+        assert tx_storage.session_exists("123")
+        tx_storage.close()
+
+
+class RecordingStorage(TXStorageWriteBehind):
+    def __init__(self):
+        super().__init__(flush_interval=0)
+        self.batches = []
+        self.on_write = None
+
+    def write_batch(self, changes):
+        if self.on_write is not None:
+            on_write, self.on_write = self.on_write, None
+            on_write()
+        self.batches.append([change.fields for change in changes])
+
+
+def test_concurrent_flushes_in_order():
+    tx_storage = RecordingStorage()
+    state = create(tx_storage, 0, "123")
+    tx_storage.flush()
+    tx_storage.batches.clear()
+
+    def flush_newer():
+        state.ack = attr.evolve(state.ack, status=Status.PENDING)
+        flusher = threading.Thread(target=tx_storage.flush)
+        flusher.start()
+        # the newer flush waits for this one
+        flusher.join(0.2)
+        assert flusher.is_alive()
+        threads.append(flusher)
+
+    threads = []
+    tx_storage.on_write = flush_newer
+    state.wallet_request = "all"
+    tx_storage.flush()
+    threads[0].join()
+
+    assert [[{"wallet_request"}], [{"ack"}]] == tx_storage.batches
@@ -5,6 +5,7 @@
 from decimal import Decimal
 import logging
 
+import attr
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.serialization import load_pem_private_key
 from cryptography.x509 import NameOID
@@ -166,3 +167,45 @@ def test_verify_chain_str():
 
     path = verify_chain(pem, CA_CERTIFICATE)
     assert path
+
+
+@pytest.mark.timeout(2)
+@pytest.mark.asyncio
+async def test_get_payment_request_retained(mock_mqtt, payment_request):
+    wallet = Wallet("manta://localhost:8000/123", "123", retained=True)
+
+    # noinspection PyUnusedLocal
+    def se(topic):
+        nonlocal mock_mqtt, payment_request
+
+        if topic == "payment_requests/123":
+            mock_mqtt.push("payment_requests/123", payment_request.to_json(), retain=True)
+
+    mock_mqtt.subscribe.side_effect = se
+
+    envelope = await wallet.get_payment_request()
+    assert envelope.unpack() == payment_request.unpack()
+    # requested without waiting for the retained one
+    mock_mqtt.publish.assert_called_once_with("payment_requests/123/all")
+
+
+@pytest.mark.timeout(2)
+@pytest.mark.asyncio
+async def test_get_payment_request_retained_crypto(mock_mqtt, payment_request):
+    wallet = Wallet("manta://localhost:8000/123", "123", retained=True)
+    answer = attr.evolve(payment_request, signature="btc signature")
+
+    # noinspection PyUnusedLocal
+    def subscribe(topic):
+        mock_mqtt.push("payment_requests/123", payment_request.to_json(), retain=True)
+
+    # noinspection PyUnusedLocal
+    def publish(topic, payload=None):
+        if topic == "payment_requests/123/btc":
+            mock_mqtt.push("payment_requests/123", answer.to_json())
+
+    mock_mqtt.subscribe.side_effect = subscribe
+    mock_mqtt.publish.side_effect = publish
+
+    envelope = await wallet.get_payment_request("btc")
+    assert envelope == answer
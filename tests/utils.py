@@ -2,6 +2,7 @@
 # Manta Protocol Implementation for Python
 # Copyright (C) 2018-2019 Alessandro Viganò
 
+from decimal import Decimal
 import difflib
 import pprint
 from typing import NamedTuple, Dict
@@ -13,7 +14,30 @@ import pytest
 import paho.mqtt.client as mqtt
 import simplejson as json
 
-from manta.messages import Message
+from manta.messages import Destination, Merchant, Message
+
+HELLO_SIGNED = (
+    b"LJH1BHPP/KmEnqyz24eb3ph8nyhS9TjVT1jnw7oSU3vbwoj9MMePwBifBbnpvFHl6KSUnTcX0I3OK6MSdF"
+    b"m6/1I+i7RkyNeAIkN/boF46xRucuaaevfk5PWuHKJSPsQt6QLs3TyQUet+WLTu8sxIs29+wLTn71dzFfAe45YesIOoKhboyiPO23"
+    b"Di8sLuFQCiW4uau4SttMK8+MCHMmQzShdu922JMHFv1l2sbqfnM0LNFzWIbVs35Q4pNow0P6gzECSOpREwdy5S793YJdA7goZNCM"
+    b"QB6LpOEnuXBeA1wJ5t3fnSANUvXewyaMiNIXz93vh9UrDel7NITHo46dVKXw=="
+)
+
+KEY_FILENAME = "certificates/root/keys/test.key"
+CERTIFICATE_FILENAME = "certificates/root/certs/AppiaDeveloperCA.crt"
+
+DESTINATIONS = [
+    Destination(
+        amount=Decimal("5"), destination_address="btc_daddress", crypto_currency="btc"
+    ),
+    Destination(
+        amount=Decimal("10"),
+        destination_address="nano_daddress",
+        crypto_currency="nano",
+    ),
+]
+
+MERCHANT = Merchant(name="Merchant 1", address="5th Avenue")
 
 
 def is_namedtuple_instance(x):
@@ -26,13 +50,14 @@ def is_namedtuple_instance(x):
 
 
 class MQTTMock(MagicMock):
-    def push(self, topic, payload):
-        self.on_message(self, None, MQTTMessage(topic, payload))
+    def push(self, topic, payload, retain=False):
+        self.on_message(self, None, MQTTMessage(topic, payload, retain))
 
 
 class MQTTMessage(NamedTuple):
     topic: any
     payload: any
+    retain: bool = False
 
 
 def compare_dicts(d1, d2):